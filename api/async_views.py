@@ -0,0 +1,206 @@
+"""Async versions of the read-only workout endpoints for ASGI deployments.
+
+This Django version has no async ORM, so database work runs in worker
+threads through sync_to_async(thread_sensitive=False), each with its own
+connection. The independent queries of one request (validators, rows,
+child rows) run concurrently with asyncio.gather, and the event loop is
+free while they wait. The responses are the same as those of the DRF views
+in api.views, which keep serving WSGI deployments; api.urls picks one set
+by the API_ASYNC_READS setting.
+"""
+import asyncio
+import functools
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.http import HttpResponse, JsonResponse
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+
+from main.models import Exercise, SetDescription, Workout
+from .conditional import add_validators, make_etag, not_modified
+from .fastjson import FastJSONRenderer, field_plan
+from .pagination import KeysetPagination
+from .serializers import (SetDescriptionSerializer, WorkoutDetailSerializer,
+                          WorkoutSerializer)
+
+DETAIL_FIELDS = tuple(WorkoutDetailSerializer().fields)
+from .views import filter_by_dates, list_validators
+
+
+def in_thread(func):
+    """Runs ORM code in a worker thread, so that several calls can run at
+    once; the thread's connection follows CONN_MAX_AGE like a request's"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(wrapper, thread_sensitive=False)
+
+
+async def gather(*awaitables):
+    """asyncio.gather() that waits for every call before raising the first
+    error, so no worker thread is left running unobserved"""
+    results = await asyncio.gather(*awaitables, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+def error(exception, status_code=None):
+    return JsonResponse({'detail': exception.detail},
+                        status=status_code or exception.status_code)
+
+
+def render(data):
+    return HttpResponse(FastJSONRenderer().render(data),
+                        content_type='application/json')
+
+
+@in_thread
+def authenticated_user(request):
+    user = request.user
+    return user if user.is_authenticated else None
+
+
+def read_view(view):
+    """Authentication and 404/400 handling shared by the async views"""
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return error(exceptions.MethodNotAllowed(request.method))
+        user = await authenticated_user(request)
+        if user is None:
+            # 403 like DRF with session authentication, which has no
+            # WWW-Authenticate challenge for a 401
+            return error(exceptions.NotAuthenticated(),
+                         status.HTTP_403_FORBIDDEN)
+        try:
+            return await view(request, user, *args, **kwargs)
+        except (Workout.DoesNotExist, Exercise.DoesNotExist):
+            return error(exceptions.NotFound())
+        except exceptions.ValidationError as exception:
+            return JsonResponse(exception.detail,
+                                status=status.HTTP_400_BAD_REQUEST)
+
+    return wrapper
+
+
+@in_thread
+def workout_validators(user, workout_pk):
+    workout = Workout.objects.only('updated_at').get(pk=workout_pk,
+                                                     owner=user)
+    return workout.updated_at.isoformat(), workout.updated_at
+
+
+async def respond(request, validators, build):
+    """Runs the validator and data queries concurrently and answers with a
+    304 when the client's copy is current"""
+    (source, last_modified), data = await gather(validators, build)
+    etag = make_etag(request, source)
+    response = not_modified(request, etag, last_modified)
+    if response is None:
+        response = render(data)
+    return add_validators(response, etag, last_modified)
+
+
+@read_view
+async def workouts(request, user):
+    workouts = filter_by_dates(Workout.objects.filter(owner=user),
+                               request.GET)
+
+    @in_thread
+    def page():
+        paginator = KeysetPagination()
+        plan = field_plan(WorkoutSerializer)
+        rows = paginator.paginate_queryset(plan.rows(workouts),
+                                           Request(request))
+        return paginator.get_paginated_response(plan.many(rows)).data
+
+    return await respond(request, in_thread(list_validators)(workouts),
+                         page())
+
+
+@in_thread
+def set_rows(user, **lookups):
+    plan = field_plan(SetDescriptionSerializer)
+    return plan.many(
+        plan.rows(
+            SetDescription.objects.filter(
+                exercise__workout__owner=user,
+                **lookups).order_by('number', 'pk')))
+
+
+@in_thread
+def exercise_rows(user, workout_pk):
+    return list(
+        Exercise.objects.filter(workout_id=workout_pk,
+                                workout__owner=user).order_by('pk'))
+
+
+async def exercise_tree(user, workout_pk):
+    """Exercises of a workout with their sets, two concurrent queries"""
+    exercises, sets = await gather(
+        exercise_rows(user, workout_pk),
+        set_rows(user, exercise__workout_id=workout_pk))
+    by_exercise = {}
+    for set_description in sets:
+        by_exercise.setdefault(set_description['exercise'],
+                               []).append(set_description)
+    data = []
+    for exercise in exercises:
+        data.append({
+            'id': exercise.pk,
+            'workout': exercise.workout_id,
+            'name': exercise.name,
+            'sets': by_exercise.get(exercise.pk, []),
+        })
+    return data
+
+
+@read_view
+async def workout(request, user, workout_pk):
+    @in_thread
+    def workout_data():
+        return WorkoutSerializer(
+            Workout.objects.get(pk=workout_pk, owner=user)).data
+
+    async def build():
+        data, exercises = await gather(
+            workout_data(), exercise_tree(user, workout_pk))
+        data['exercises'] = exercises
+        # The key order of WorkoutDetailSerializer, so the bytes match
+        return {name: data[name] for name in DETAIL_FIELDS}
+
+    return await respond(request, workout_validators(user, workout_pk),
+                         build())
+
+
+@read_view
+async def exercises(request, user, workout_pk):
+    return await respond(request, workout_validators(user, workout_pk),
+                         exercise_tree(user, workout_pk))
+
+
+@read_view
+async def sets(request, user, workout_pk, exercise_id):
+    @in_thread
+    def check_exercise():
+        Exercise.objects.only('pk').get(pk=exercise_id,
+                                        workout_id=workout_pk,
+                                        workout__owner=user)
+
+    async def build():
+        rows, _ = await gather(
+            set_rows(user,
+                     exercise_id=exercise_id,
+                     exercise__workout_id=workout_pk), check_exercise())
+        return rows
+
+    return await respond(request, workout_validators(user, workout_pk),
+                         build())
@@ -0,0 +1,47 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+
+def make_etag(request, source):
+    # The representation also depends on the query string (cursor, limit,
+    # filters) and the user
+    source = '%s|%s|%s' % (request.user.pk, request.get_full_path(), source)
+    return '"%s"' % hashlib.md5(source.encode()).hexdigest()
+
+
+def not_modified(request, etag, last_modified):
+    """A 304 response when the client's copy is current, otherwise None"""
+    return get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=int(last_modified.timestamp())
+        if last_modified else None)
+
+
+def add_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+class ConditionalGetMixin:
+    """ETag/Last-Modified validation for GET views.
+
+    get_validators() returns (etag source, last modified datetime) computed
+    with cheap queries, so a client that already has the current
+    representation gets a 304 without the resource being serialized.
+    """
+    def get_validators(self):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        source, last_modified = self.get_validators()
+        etag = make_etag(request, source)
+        response = not_modified(request, etag, last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        return add_validators(response, etag, last_modified)
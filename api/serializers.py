@@ -1,6 +1,7 @@
 from rest_framework import serializers
 
-from main.models import Workout, Exercise, SetDescription
+from main.models import (DailyActivity, Workout, Exercise, ExerciseStats,
+                         Movement, SetDescription, WeeklyTonnage)
 
 
 class WorkoutSerializer(serializers.ModelSerializer):
@@ -9,13 +10,109 @@ class WorkoutSerializer(serializers.ModelSerializer):
         fields = ('__all__')
 
 
-class WorkoutDetailSerializer(serializers.ModelSerializer):
+class SetDescriptionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SetDescription
+        fields = ('__all__')
+
+
+class ExerciseSerializer(serializers.ModelSerializer):
+    sets = SetDescriptionSerializer(source='setdescription_set',
+                                    many=True,
+                                    read_only=True)
+
+    class Meta:
+        model = Exercise
+        fields = ('id', 'workout', 'name', 'sets')
+
+
+class ExerciseRowSerializer(serializers.ModelSerializer):
+    """An exercise without its sets"""
     class Meta:
         model = Exercise
+        fields = ('id', 'workout', 'name', 'updated_at')
+
+
+class WorkoutDetailSerializer(serializers.ModelSerializer):
+    exercises = ExerciseSerializer(source='exercise_set',
+                                   many=True,
+                                   read_only=True)
+
+    class Meta:
+        model = Workout
         fields = ('__all__')
 
 
-class SetDescriptionSerializer(serializers.ModelSerializer):
+class ExerciseStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ExerciseStats
+        exclude = ('id', 'user')
+
+
+class WeeklyTonnageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = WeeklyTonnage
+        fields = ('week', 'set_count', 'volume')
+
+
+class DailyActivitySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DailyActivity
+        fields = ('day', 'sessions', 'set_count', 'volume')
+
+
+class MovementSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Movement
+        fields = ('id', 'name')
+
+
+class MovementSetSerializer(serializers.ModelSerializer):
+    """A set of a movement's history with the workout it was done in"""
+    workout = serializers.IntegerField(source='exercise.workout_id')
+    date = serializers.DateField(source='exercise.workout.created_at')
+
     class Meta:
         model = SetDescription
-        fields = ('__all__')
+        fields = ('id', 'exercise', 'workout', 'date', 'number', 'weight',
+                  'repeats')
+
+
+# Limits of one batched write
+MAX_EXERCISES = 50
+MAX_SETS = 50
+
+
+class SetInputSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SetDescription
+        fields = ('number', 'weight', 'repeats')
+
+
+class ExerciseInputSerializer(serializers.ModelSerializer):
+    sets = SetInputSerializer(many=True, required=False)
+
+    class Meta:
+        model = Exercise
+        fields = ('name', 'sets')
+
+    def validate_sets(self, value):
+        if len(value) > MAX_SETS:
+            raise serializers.ValidationError(
+                'Не больше %d подходов в упражнении' % MAX_SETS)
+        return value
+
+
+class WorkoutTreeSerializer(serializers.ModelSerializer):
+    """A new workout with its exercises and their sets"""
+    exercises = ExerciseInputSerializer(many=True, required=False)
+
+    class Meta:
+        model = Workout
+        fields = ('name', 'created_at', 'comment', 'exercises')
+
+    def validate_exercises(self, value):
+        if len(value) > MAX_EXERCISES:
+            raise serializers.ValidationError(
+                'Не больше %d упражнений в тренировке' % MAX_EXERCISES)
+        return value
@@ -1,3 +1,543 @@
-from django.test import TestCase
+import datetime
+import json
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+
+from main import deletion
+from main.importers import import_rows
+from main.models import (AdvUser, Exercise, ExerciseStats, SetDescription,
+                         Workout)
+from main.pagination import KeysetPaginator
+from . import async_views, fastjson
+from .serializers import SetDescriptionSerializer, WorkoutSerializer
+
+
+class WorkoutListApiTests(TestCase):
+    def setUp(self):
+        self.user = AdvUser.objects.create_user('sportsman', password='pass')
+        for day in range(1, 26):
+            Workout.objects.create(owner=self.user,
+                                   name='Тренировка %d' % day,
+                                   created_at=datetime.date(2021, 11, day))
+        self.client.force_login(self.user)
+
+    def test_requires_login(self):
+        self.client.logout()
+        self.assertEqual(self.client.get('/api/workouts/').status_code, 403)
+
+    def test_only_own_workouts(self):
+        other = AdvUser.objects.create_user('other', password='pass')
+        Workout.objects.create(owner=other,
+                               name='Чужая',
+                               created_at=datetime.date(2021, 12, 1))
+        data = self.client.get('/api/workouts/?limit=100').json()
+        self.assertEqual(len(data['results']), 25)
+        self.assertNotIn('Чужая', [w['name'] for w in data['results']])
+
+    def test_limit_and_dates(self):
+        data = self.client.get('/api/workouts/?from=2021-11-10&to=2021-11-20'
+                               '&limit=5').json()
+        self.assertEqual([w['name'] for w in data['results']],
+                         ['Тренировка %d' % d for d in range(20, 15, -1)])
+        data = self.client.get(data['next']).json()
+        self.assertEqual(len(data['results']), 5)
+        response = self.client.get('/api/workouts/?from=вчера')
+        self.assertEqual(response.status_code, 400)
+
+    def test_not_modified(self):
+        response = self.client.get('/api/workouts/')
+        etag = response['ETag']
+        response = self.client.get('/api/workouts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        Workout.objects.filter(name='Тренировка 1').delete()
+        response = self.client.get('/api/workouts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        # A deletion leaves Max(updated_at) where it was
+        self.assertNotIn('Last-Modified', response)
+
+    def test_cursor_pagination(self):
+        response = self.client.get('/api/workouts/')
+        data = response.json()
+        self.assertEqual(len(data['results']), 20)
+        self.assertIsNone(data['previous'])
+        self.assertEqual(data['results'][0]['name'], 'Тренировка 25')
+        data = self.client.get(data['next']).json()
+        self.assertEqual([w['name'] for w in data['results']],
+                         ['Тренировка %d' % d for d in range(5, 0, -1)])
+        self.assertIsNone(data['next'])
+        self.assertIsNotNone(data['previous'])
+
+    def test_bad_cursor_gives_first_page(self):
+        for values in (['2021-11-02', 'abc'], ['2021-13-45', '1']):
+            cursor = KeysetPaginator.encode_cursor(values, 'next')
+            response = self.client.get('/api/workouts/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['results'][0]['name'],
+                             'Тренировка 25')
+
+
+class WorkoutDetailApiTests(TestCase):
+    def setUp(self):
+        self.user = AdvUser.objects.create_user('sportsman', password='pass')
+        self.workout = Workout.objects.create(
+            owner=self.user, name='Грудь', created_at=datetime.date(2021, 11, 1))
+        self.exercise = Exercise.objects.create(workout=self.workout,
+                                                name='Жим')
+        for number in (2, 1):
+            SetDescription.objects.create(exercise=self.exercise,
+                                          number=number,
+                                          weight=60,
+                                          repeats=10)
+        self.client.force_login(self.user)
+
+    def test_nested_detail(self):
+        with self.assertNumQueries(6):
+            # session, user, validators, workout, exercises, sets
+            data = self.client.get('/api/workouts/%d/' %
+                                   self.workout.pk).json()
+        self.assertEqual(data['exercises'][0]['name'], 'Жим')
+        self.assertEqual([s['number'] for s in data['exercises'][0]['sets']],
+                         [1, 2])
+
+    def test_sets(self):
+        url = '/api/workouts/%d/exercises/%d/sets/' % (self.workout.pk,
+                                                       self.exercise.pk)
+        self.assertEqual(len(self.client.get(url).json()), 2)
+        old_url = '/api/workouts/%d/%d/' % (self.workout.pk, self.exercise.pk)
+        self.assertEqual(self.client.get(old_url).json(),
+                         self.client.get(url).json())
+        exercises = self.client.get('/api/workouts/%d/exercises/' %
+                                    self.workout.pk).json()
+        self.assertEqual(len(exercises[0]['sets']), 2)
+
+    def test_other_users_workout(self):
+        other = AdvUser.objects.create_user('other', password='pass')
+        self.client.force_login(other)
+        for url in ('/api/workouts/%d/', '/api/workouts/%d/exercises/'):
+            response = self.client.get(url % self.workout.pk)
+            self.assertEqual(response.status_code, 404)
+
+    def test_changed_set_updates_validators(self):
+        url = '/api/workouts/%d/' % self.workout.pk
+        response = self.client.get(url)
+        modified = response['Last-Modified']
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_MODIFIED_SINCE=modified).status_code,
+            304)
+        etag = response['ETag']
+        Workout.objects.filter(pk=self.workout.pk).update(
+            updated_at=self.workout.updated_at - datetime.timedelta(days=1))
+        SetDescription.objects.filter(number=1).get().save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class AsyncReadTests(TransactionTestCase):
+    # The async views query from worker threads with their own
+    # connections, which only see committed data
+
+    def setUp(self):
+        self.user = AdvUser.objects.create_user('sportsman', password='pass')
+        self.workouts = []
+        for day in range(1, 4):
+            workout = Workout.objects.create(
+                owner=self.user, name='Тренировка %d' % day,
+                created_at=datetime.date(2021, 11, day))
+            for name in ('Жим', 'Присед'):
+                exercise = Exercise.objects.create(workout=workout, name=name)
+                for number in (1, 2):
+                    SetDescription.objects.create(exercise=exercise,
+                                                  number=number,
+                                                  weight=60,
+                                                  repeats=10)
+            self.workouts.append(workout)
+        self.workout = self.workouts[-1]
+        self.exercise = self.workout.exercise_set.order_by('pk').first()
+        self.client.force_login(self.user)
+
+    def call(self, view, path, user=None, headers=None, **kwargs):
+        request = RequestFactory().get(path, **(headers or {}))
+        request.user = user or self.user
+        return async_to_sync(view)(request, **kwargs)
+
+    def assertSameAsSync(self, view, path, **kwargs):
+        expected = self.client.get(path)
+        response = self.call(view, path, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, expected.content)
+        self.assertEqual(response['ETag'], expected['ETag'])
+        return response
+
+    def test_same_responses_as_sync_views(self):
+        self.assertSameAsSync(async_views.workouts,
+                              '/api/workouts/?limit=2&from=2021-11-02')
+        self.assertSameAsSync(async_views.workout,
+                              '/api/workouts/%d/' % self.workout.pk,
+                              workout_pk=self.workout.pk)
+        self.assertSameAsSync(async_views.exercises,
+                              '/api/workouts/%d/exercises/' % self.workout.pk,
+                              workout_pk=self.workout.pk)
+        self.assertSameAsSync(
+            async_views.sets, '/api/workouts/%d/exercises/%d/sets/' %
+            (self.workout.pk, self.exercise.pk),
+            workout_pk=self.workout.pk,
+            exercise_id=self.exercise.pk)
+
+    def test_not_modified(self):
+        path = '/api/workouts/%d/' % self.workout.pk
+        etag = self.call(async_views.workout, path,
+                         workout_pk=self.workout.pk)['ETag']
+        response = self.call(async_views.workout, path,
+                             headers={'HTTP_IF_NONE_MATCH': etag},
+                             workout_pk=self.workout.pk)
+        self.assertEqual(response.status_code, 304)
+
+    def test_errors(self):
+        stranger = AdvUser.objects.create_user('stranger', password='pass')
+        path = '/api/workouts/%d/' % self.workout.pk
+        response = self.call(async_views.workout, path, user=stranger,
+                             workout_pk=self.workout.pk)
+        self.assertEqual(response.status_code, 404)
+        response = self.call(async_views.sets, path, workout_pk=self.workout.pk,
+                             exercise_id=self.workouts[0].exercise_set.first().pk)
+        self.assertEqual(response.status_code, 404)
+        response = self.call(async_views.workouts, '/api/workouts/',
+                             user=AnonymousUser())
+        self.assertEqual(response.status_code, 403)
+        response = self.call(async_views.workouts, '/api/workouts/?to=завтра')
+        self.assertEqual(response.status_code, 400)
+
+
+class FastJSONTests(TestCase):
+    def setUp(self):
+        self.user = AdvUser.objects.create_user('sportsman', password='pass')
+        workout = Workout.objects.create(
+            owner=self.user,
+            name='Ноги \u2028 "кавычки" \\ \x07',
+            created_at=datetime.date(2021, 11, 18),
+            comment='\u2029\U0001F600')
+        Workout.objects.create(owner=self.user,
+                               name='Спина',
+                               created_at=datetime.date(2021, 11, 19))
+        exercise = Exercise.objects.create(workout=workout, name='Присед')
+        for number, weight in enumerate(('0', '7.5', '99.9', '12'), 1):
+            SetDescription.objects.create(exercise=exercise,
+                                          number=number,
+                                          weight=weight,
+                                          repeats=number * 3)
+
+    def test_plan_matches_serializer(self):
+        for serializer_class, queryset in (
+                (WorkoutSerializer, Workout.objects.order_by('pk')),
+                (SetDescriptionSerializer,
+                 SetDescription.objects.order_by('pk'))):
+            plan = fastjson.field_plan(serializer_class)
+            self.assertEqual(plan.many(plan.rows(queryset)),
+                             serializer_class(queryset, many=True).data)
+
+    def test_renderer_output_is_identical(self):
+        data = {
+            'results': WorkoutSerializer(Workout.objects.all(),
+                                         many=True).data,
+            'text': ''.join(map(chr, range(128))) + '\u2028\u2029ёЁ',
+            'numbers': [0, -1, 2**40, True, None],
+        }
+        self.assertEqual(fastjson.FastJSONRenderer().render(data),
+                         JSONRenderer().render(data))
+
+    def test_list_payloads_unchanged(self):
+        self.client.force_login(self.user)
+        workout = Workout.objects.get(name='Спина')
+        exercise = Exercise.objects.get()
+        response = self.client.get('/api/workouts/')
+        self.assertEqual(
+            json.loads(response.content)['results'],
+            WorkoutSerializer(Workout.objects.order_by('-created_at', '-id'),
+                              many=True).data)
+        response = self.client.get('/api/workouts/%d/exercises/%d/sets/' %
+                                   (exercise.workout_id, exercise.pk))
+        self.assertEqual(
+            response.content,
+            JSONRenderer().render(
+                SetDescriptionSerializer(SetDescription.objects.all(),
+                                         many=True).data))
+        self.assertEqual(
+            self.client.get('/api/workouts/%d/' % workout.pk).json()['name'],
+            'Спина')
+
+    def test_list_includes_summary(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            results = self.client.get('/api/workouts/').json()['results']
+        self.assertEqual(len(queries), 4)
+        summary = {
+            name: results[1][name]
+            for name in ('exercise_count', 'set_count', 'total_volume',
+                         'top_weight')
+        }
+        self.assertEqual(summary, {
+            'exercise_count': 1,
+            'set_count': 4,
+            'total_volume': '1088.1',
+            'top_weight': '99.9',
+        })
+
+
+class SyncApiTests(TestCase):
+    def setUp(self):
+        self.user = AdvUser.objects.create_user('sportsman', password='pass')
+        self.workouts = []
+        for day in range(1, 4):
+            workout = Workout.objects.create(owner=self.user,
+                                             name='Тренировка %d' % day,
+                                             created_at=datetime.date(
+                                                 2021, 11, day))
+            exercise = Exercise.objects.create(workout=workout, name='Жим')
+            for number in (1, 2):
+                SetDescription.objects.create(exercise=exercise,
+                                              number=number,
+                                              weight='60.0',
+                                              repeats=10)
+            self.workouts.append(workout)
+        self.client.force_login(self.user)
+
+    def sync(self, since=None, **params):
+        if since is not None:
+            params['since'] = since
+        response = self.client.get('/api/sync/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def sync_all(self, since=None, limit=4):
+        """Follows the tokens until the server has nothing more"""
+        batches = []
+        while True:
+            data = self.sync(since, limit=limit)
+            batches.append(data)
+            since = data['token']
+            if not data['more']:
+                return batches
+
+    def test_full_sync_in_batches(self):
+        batches = self.sync_all()
+        self.assertEqual(len(batches), 3)
+        self.assertEqual(
+            sum(len(b['workouts']) + len(b['exercises']) + len(b['sets'])
+                for b in batches), 12)
+        self.assertEqual(batches[0]['workouts'][0]['name'], 'Тренировка 1')
+        self.assertIn('updated_at', batches[-1]['sets'][0])
+        self.assertEqual(self.sync(batches[-1]['token'])['sets'], [])
+
+    def test_only_changes_after_token(self):
+        token = self.sync_all()[-1]['token']
+        set_description = SetDescription.objects.first()
+        set_description.repeats = 12
+        set_description.save()
+        data = self.sync(token)
+        self.assertEqual(data['exercises'], [])
+        self.assertEqual([s['repeats'] for s in data['sets']], [12])
+        # Its workout's summary changed with it
+        self.assertEqual([w['total_volume'] for w in data['workouts']],
+                         ['1320.0'])
+        self.assertFalse(data['more'])
+
+    def test_workout_summary_follows_its_sets(self):
+        token = self.sync_all()[-1]['token']
+        exercise = self.workouts[1].exercise_set.get()
+        SetDescription.objects.create(exercise=exercise,
+                                      number=3,
+                                      weight='80.0',
+                                      repeats=5)
+        data = self.sync(token)
+        workout, = data['workouts']
+        self.assertEqual(workout['id'], self.workouts[1].pk)
+        self.assertEqual(
+            (workout['set_count'], workout['total_volume'],
+             workout['top_weight']), (3, '1600.0', '80.0'))
+        self.assertEqual(len(data['sets']), 1)
+
+    def test_tombstones(self):
+        token = self.sync_all()[-1]['token']
+        first, second, third = self.workouts
+        deletion.delete_workouts(Workout.objects.filter(pk=first.pk))
+        exercise = second.exercise_set.get()
+        exercise_pk = exercise.pk
+        deletion.delete_exercise(exercise)
+        set_description = SetDescription.objects.filter(
+            exercise__workout=third).first()
+        set_pk = set_description.pk
+        set_description.delete()
+        data = self.sync(token)
+        self.assertEqual(data['deleted'], {
+            'workouts': [first.pk],
+            'exercises': [exercise_pk],
+            'sets': [set_pk],
+        })
+        # A new client only learns about what is left
+        batches = self.sync_all()
+        self.assertEqual(
+            sum(len(b['sets']) + len(b['deleted']['sets']) for b in batches),
+            2)
+
+    def test_import_and_other_users(self):
+        token = self.sync_all()[-1]['token']
+        stranger = AdvUser.objects.create_user('stranger', password='pass')
+        Workout.objects.create(owner=stranger,
+                               name='Чужая',
+                               created_at=datetime.date(2021, 11, 5))
+        import_rows(self.user, [
+            'date,workout,comment,exercise,number,weight,repeats',
+            '2021-11-06,Спина,,Тяга,1,80,8',
+        ])
+        data = self.sync(token)
+        self.assertEqual([w['name'] for w in data['workouts']], ['Спина'])
+        self.assertEqual(len(data['exercises']), 1)
+        self.assertEqual(len(data['sets']), 1)
+
+    def test_bad_token(self):
+        response = self.client.get('/api/sync/', {'since': 'вчера'})
+        self.assertEqual(response.status_code, 400)
+
+
+class WorkoutCreateApiTests(TestCase):
+    def setUp(self):
+        self.user = AdvUser.objects.create_user('sportsman', password='pass')
+        self.client.force_login(self.user)
+
+    def document(self, exercises=8, sets=4):
+        return {
+            'name': 'Ноги',
+            'created_at': '2021-11-18',
+            'comment': 'Тяжело',
+            'exercises': [{
+                'name': 'Упражнение %d' % e,
+                'sets': [{
+                    'number': n,
+                    'weight': '60.0',
+                    'repeats': 10
+                } for n in range(1, sets + 1)],
+            } for e in range(exercises)],
+        }
+
+    def post(self, document):
+        return self.client.post('/api/workouts/new/',
+                                json.dumps(document),
+                                content_type='application/json')
+
+    def test_creates_tree(self):
+        response = self.post(self.document())
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        workout = Workout.objects.get(pk=data['id'])
+        self.assertEqual(workout.owner, self.user)
+        self.assertEqual([e['id'] for e in data['exercises']],
+                         list(workout.exercise_set.order_by('pk').values_list(
+                             'pk', flat=True)))
+        self.assertEqual(
+            len(data['exercises'][0]['sets']),
+            SetDescription.objects.filter(
+                exercise=data['exercises'][0]['id']).count())
+        self.assertEqual(SetDescription.objects.count(), 32)
+        stats = ExerciseStats.objects.get(name='Упражнение 0')
+        self.assertEqual((stats.set_count, stats.total_volume), (4, 2400))
+        self.assertEqual(
+            self.client.get('/api/search/', {
+                'q': 'упражнение'
+            }).json()[0]['id'], workout.pk)
+
+    def test_one_insert_per_level(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.post(self.document())
+        inserts = [q['sql'] for q in queries
+                   if q['sql'].startswith('INSERT INTO "main_setdescription"')]
+        self.assertEqual(len(inserts), 1)
+        with CaptureQueriesContext(connection) as small:
+            self.post(self.document(exercises=8, sets=1))
+        with CaptureQueriesContext(connection) as large:
+            self.post(self.document(exercises=8, sets=10))
+        self.assertEqual(len(small), len(large))
+
+    def test_invalid_document_writes_nothing(self):
+        document = self.document()
+        document['exercises'][3]['sets'][1]['weight'] = 'тяжело'
+        response = self.post(document)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('weight',
+                      response.json()['exercises'][3]['sets'][1])
+        self.assertFalse(Workout.objects.exists())
+        response = self.post(self.document(exercises=51, sets=0))
+        self.assertEqual(response.status_code, 400)
+
+
+class CalendarApiTests(TestCase):
+    def setUp(self):
+        self.user = AdvUser.objects.create_user('sportsman', password='pass')
+        today = datetime.date.today()
+        for days_ago in (0, 1, 400):
+            workout = Workout.objects.create(
+                owner=self.user,
+                name='Тренировка',
+                created_at=today - datetime.timedelta(days=days_ago))
+            exercise = Exercise.objects.create(workout=workout, name='Жим')
+            SetDescription.objects.create(exercise=exercise,
+                                          number=1,
+                                          weight='62.5',
+                                          repeats=8)
+        self.client.force_login(self.user)
+
+    def test_last_year_by_default(self):
+        today = datetime.date.today()
+        self.assertEqual(self.client.get('/api/calendar/').json(), [{
+            'day': (today - datetime.timedelta(days=1)).isoformat(),
+            'sessions': 1,
+            'set_count': 1,
+            'volume': '500.0',
+        }, {
+            'day': today.isoformat(),
+            'sessions': 1,
+            'set_count': 1,
+            'volume': '500.0',
+        }])
+
+    def test_window(self):
+        old = (datetime.date.today() - datetime.timedelta(days=400))
+        data = self.client.get('/api/calendar/?from=%s&to=%s' %
+                               (old - datetime.timedelta(days=7), old)).json()
+        self.assertEqual([day['day'] for day in data], [old.isoformat()])
+        response = self.client.get('/api/calendar/?to=завтра')
+        self.assertEqual(response.status_code, 400)
+
+
+class ImportApiTests(TestCase):
+    def setUp(self):
+        self.user = AdvUser.objects.create_user('sportsman', password='pass')
+
+    def test_requires_login(self):
+        response = self.client.post('/api/import/')
+        self.assertEqual(response.status_code, 403)
+
+    def test_upload(self):
+        self.client.force_login(self.user)
+        upload = SimpleUploadedFile(
+            'log.csv', 'date,workout,comment,exercise,number,weight,repeats\n'
+            '2021-11-01,Грудь,,Жим,1,60,10\n'.encode('utf-8-sig'))
+        response = self.client.post('/api/import/', {'file': upload})
+        self.assertEqual(response.json()['sets'], 1)
+        self.assertEqual(Workout.objects.get().owner, self.user)
+
+    def test_non_utf8_upload(self):
+        self.client.force_login(self.user)
+        # An Excel export in the Windows Cyrillic code page
+        upload = SimpleUploadedFile(
+            'log.csv', 'date,workout,comment,exercise,number,weight,repeats\n'
+            '2021-11-01,Грудь,,Жим,1,60,10\n'.encode('cp1251'))
+        response = self.client.post('/api/import/', {'file': upload})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('file', response.json())
+        self.assertFalse(Workout.objects.exists())
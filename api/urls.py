@@ -1,10 +1,41 @@
+from django.conf import settings
 from django.urls import path
 
-from main.models import Exercise
-from .views import WorkoutDetailView, workouts, setdescription
+from . import async_views
+from .views import (ExerciseList, MovementHistory, MovementList, SetList,
+                    WorkoutDetail, WorkoutList, analytics, calendar,
+                    create_workout, import_workouts, search, stats, sync)
 
+if settings.API_ASYNC_READS:
+    workouts = async_views.workouts
+    workout = async_views.workout
+    exercises = async_views.exercises
+    sets = async_views.sets
+else:
+    workouts = WorkoutList.as_view()
+    workout = WorkoutDetail.as_view()
+    exercises = ExerciseList.as_view()
+    sets = SetList.as_view()
+
+app_name = 'api'
 urlpatterns = [
-    path('workouts/<int:workout_pk>/<int:exercise_id>/', setdescription),
-    path('workouts/<int:pk>/', WorkoutDetailView.as_view()),
-    path('workouts/', workouts),
+    path('workouts/<int:workout_pk>/exercises/<int:exercise_id>/sets/',
+         sets,
+         name='sets'),
+    # Older clients' path of the same resource
+    path('workouts/<int:workout_pk>/<int:exercise_id>/', sets),
+    path('workouts/<int:workout_pk>/exercises/', exercises, name='exercises'),
+    path('workouts/<int:workout_pk>/', workout, name='workout'),
+    path('workouts/', workouts, name='workouts'),
+    path('workouts/new/', create_workout, name='workout_create'),
+    path('movements/', MovementList.as_view(), name='movements'),
+    path('movements/<int:pk>/history/',
+         MovementHistory.as_view(),
+         name='movement_history'),
+    path('search/', search, name='search'),
+    path('stats/', stats, name='stats'),
+    path('calendar/', calendar, name='calendar'),
+    path('sync/', sync, name='sync'),
+    path('analytics/', analytics, name='analytics'),
+    path('import/', import_workouts, name='import'),
 ]
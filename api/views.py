@@ -1,27 +1,313 @@
-from django.shortcuts import render
-from rest_framework import serializers
-from rest_framework.decorators import api_view
+import codecs
+import datetime
+import os
+
+from django.db.models import Count, Max, Prefetch
+from django.shortcuts import get_object_or_404
+from django.utils.dateparse import parse_date
+from rest_framework import status
+from rest_framework.decorators import (api_view, parser_classes,
+                                       permission_classes, renderer_classes)
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
-from rest_framework.generics import RetrieveAPIView
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import ListAPIView, RetrieveAPIView
+
+from main import batch, changes
+from main.analytics import progress_report
+from main.importers import (ENCODING, PARSERS, check_encoding,
+                            import_rows)
+from main.models import (Change, DailyActivity, Exercise, ExerciseStats,
+                         Movement, SetDescription, WeeklyTonnage, Workout)
+from main.movements import history
+from main.search import search_workouts
+from .conditional import ConditionalGetMixin
+from .fastjson import FastJSONRenderer, field_plan
+from .pagination import KeysetPagination, MovementHistoryPagination
+from .serializers import (DailyActivitySerializer, ExerciseRowSerializer,
+                          ExerciseSerializer, ExerciseStatsSerializer,
+                          MovementSerializer, MovementSetSerializer,
+                          SetDescriptionSerializer, WeeklyTonnageSerializer,
+                          WorkoutSerializer, WorkoutDetailSerializer,
+                          WorkoutTreeSerializer)
+
+
+def filter_by_dates(queryset, params, field='created_at'):
+    """Applies the ?from= and ?to= training date filters"""
+    for param, lookup in (('from', field + '__gte'), ('to', field + '__lte')):
+        value = params.get(param)
+        if value:
+            try:
+                day = parse_date(value)
+            except ValueError:
+                day = None
+            if day is None:
+                raise ValidationError({param: ['Ожидается ГГГГ-ММ-ДД']})
+            queryset = queryset.filter(**{lookup: day})
+    return queryset
+
+
+def list_validators(workouts):
+    # No Last-Modified: Max(updated_at) stays put when a workout is deleted,
+    # so only the ETag, which also covers the count, validates a list
+    summary = workouts.aggregate(count=Count('pk'), last=Max('updated_at'))
+    return '%(count)s|%(last)s' % summary, None
+
+
+class FastJSONMixin:
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+
+class ValuesListMixin(FastJSONMixin):
+    """Lists .values() rows through the serializer's compiled FieldPlan
+    instead of serializing model instances"""
+    def list(self, request, *args, **kwargs):
+        plan = field_plan(self.get_serializer_class())
+        rows = plan.rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(plan.many(page))
+        return Response(plan.many(rows))
+
+
+class OwnedWorkoutMixin:
+    """Scopes everything to the workouts of the requesting user"""
+    permission_classes = [IsAuthenticated]
+
+    def get_workout(self):
+        if not hasattr(self, '_workout'):
+            self._workout = get_object_or_404(
+                Workout.objects.only('pk', 'updated_at'),
+                pk=self.kwargs['workout_pk'],
+                owner=self.request.user)
+        return self._workout
+
+    def get_validators(self):
+        workout = self.get_workout()
+        return workout.updated_at.isoformat(), workout.updated_at
+
+
+class WorkoutList(ValuesListMixin, ConditionalGetMixin, ListAPIView):
+    """The user's workouts, newest first.
+
+    ?from= and ?to= limit the training dates (YYYY-MM-DD), ?limit= sets the
+    page size and ?cursor= comes from the next/previous links.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = WorkoutSerializer
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        return filter_by_dates(
+            Workout.objects.filter(owner=self.request.user),
+            self.request.query_params)
+
+    def get_validators(self):
+        return list_validators(self.get_queryset())
+
+
+class WorkoutDetail(OwnedWorkoutMixin, FastJSONMixin, ConditionalGetMixin,
+                    RetrieveAPIView):
+    """One workout with its exercises and their sets"""
+    serializer_class = WorkoutDetailSerializer
+    lookup_url_kwarg = 'workout_pk'
+
+    def get_queryset(self):
+        return Workout.objects.filter(owner=self.request.user).with_tree()
+
+
+class ExerciseList(OwnedWorkoutMixin, FastJSONMixin, ConditionalGetMixin,
+                   ListAPIView):
+    serializer_class = ExerciseSerializer
+
+    def get_queryset(self):
+        sets = SetDescription.objects.order_by('number', 'pk')
+        return Exercise.objects.filter(workout=self.get_workout()).order_by(
+            'pk').prefetch_related(Prefetch('setdescription_set',
+                                            queryset=sets))
 
-from main.models import Exercise, Workout, SetDescription
-from .serializers import SetDescriptionSerializer, WorkoutSerializer, WorkoutDetailSerializer
+
+class SetList(OwnedWorkoutMixin, ValuesListMixin, ConditionalGetMixin,
+              ListAPIView):
+    serializer_class = SetDescriptionSerializer
+
+    def get_queryset(self):
+        exercise = get_object_or_404(Exercise,
+                                     pk=self.kwargs['exercise_id'],
+                                     workout=self.get_workout())
+        return SetDescription.objects.filter(exercise=exercise).order_by(
+            'number', 'pk')
+
+
+class MovementList(FastJSONMixin, ListAPIView):
+    """The user's exercise catalogue"""
+    permission_classes = [IsAuthenticated]
+    serializer_class = MovementSerializer
+
+    def get_queryset(self):
+        return Movement.objects.filter(owner=self.request.user)
+
+
+class MovementHistory(FastJSONMixin, ListAPIView):
+    """Every set of one movement, newest first; ?limit= and ?cursor= as in
+    the workout list"""
+    permission_classes = [IsAuthenticated]
+    serializer_class = MovementSetSerializer
+    pagination_class = MovementHistoryPagination
+
+    def get_queryset(self):
+        movement = get_object_or_404(Movement,
+                                     pk=self.kwargs['pk'],
+                                     owner=self.request.user)
+        return history(movement)
 
 
 @api_view(['GET'])
-def workouts(request):
-    workouts = Workout.objects.all()
+@permission_classes([IsAuthenticated])
+def search(request):
+    workouts = search_workouts(request.user, request.query_params.get('q', ''))
     serializer = WorkoutSerializer(workouts, many=True)
     return Response(serializer.data)
 
 
-class WorkoutDetailView(RetrieveAPIView):
-    queryset = Exercise.objects.all()
-    serializer_class = WorkoutDetailSerializer
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def stats(request):
+    exercises = ExerciseStats.objects.filter(user=request.user)
+    weeks = WeeklyTonnage.objects.filter(user=request.user, set_count__gt=0)
+    return Response({
+        'exercises': ExerciseStatsSerializer(exercises, many=True).data,
+        'weeks': WeeklyTonnageSerializer(weeks, many=True).data,
+    })
+
+
+CALENDAR_DAYS = 365
 
 
 @api_view(['GET'])
-def setdescription(request, workout_pk, exercise_id):
-    sets = SetDescription.objects.filter(id=exercise_id)
-    serializer = SetDescriptionSerializer(sets, many=True)
-    return Response(serializer.data)
+@permission_classes([IsAuthenticated])
+@renderer_classes([FastJSONRenderer, BrowsableAPIRenderer])
+def calendar(request):
+    """Workouts, sets and volume per day, oldest first, only days with a
+    workout. ?from= and ?to= (YYYY-MM-DD) set the window, the last
+    CALENDAR_DAYS days by default."""
+    params = request.query_params
+    days = DailyActivity.objects.filter(user=request.user)
+    if not params.get('from') and not params.get('to'):
+        today = datetime.date.today()
+        days = days.filter(day__range=(
+            today - datetime.timedelta(days=CALENDAR_DAYS - 1), today))
+    plan = field_plan(DailyActivitySerializer)
+    return Response(
+        plan.many(plan.rows(filter_by_dates(days, params, 'day'))))
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def analytics(request):
+    try:
+        window = max(1, int(request.query_params.get('window', 7)))
+    except ValueError:
+        window = 7
+    return Response(progress_report(request.user.pk, window))
+
+
+SYNC_BATCH_SIZE = 500
+SYNC_MAX_BATCH_SIZE = 5000
+
+# Payload key, serializer and owner lookup of every kind of change
+SYNC_KINDS = (
+    (Change.WORKOUT, 'workouts', WorkoutSerializer, 'owner'),
+    (Change.EXERCISE, 'exercises', ExerciseRowSerializer, 'workout__owner'),
+    (Change.SET, 'sets', SetDescriptionSerializer,
+     'exercise__workout__owner'),
+)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@renderer_classes([FastJSONRenderer, BrowsableAPIRenderer])
+def sync(request):
+    """Workouts, exercises and sets changed after ?since= (the token of the
+    previous response, 0 or nothing for everything), at most ?limit=
+    changes at a time. Clients repeat the request with the returned token
+    while `more` is true; a deleted workout or exercise takes its contents
+    with it."""
+    try:
+        sequence = int(request.query_params.get('since') or 0)
+        if sequence < 0:
+            raise ValueError
+    except ValueError:
+        raise ValidationError({'since': ['Неверный токен синхронизации']})
+    try:
+        limit = int(request.query_params.get('limit', SYNC_BATCH_SIZE))
+    except ValueError:
+        limit = SYNC_BATCH_SIZE
+    limit = min(max(limit, 1), SYNC_MAX_BATCH_SIZE)
+    rows, more = changes.since(request.user.pk, sequence, limit)
+    live, deleted = {}, {}
+    for _, kind, object_id, is_deleted in rows:
+        ids = deleted if is_deleted else live
+        ids.setdefault(kind, []).append(object_id)
+    data = {'token': str(rows[-1][0] if rows else sequence), 'more': more}
+    for kind, key, serializer_class, owner in SYNC_KINDS:
+        data[key] = []
+        if kind in live:
+            plan = field_plan(serializer_class)
+            model = serializer_class.Meta.model
+            data[key] = plan.many(
+                plan.rows(
+                    model.objects.filter(**{
+                        'pk__in': live[kind],
+                        owner: request.user
+                    }).order_by('pk')))
+    data['deleted'] = {
+        key: deleted.get(kind, [])
+        for kind, key, _, _ in SYNC_KINDS
+    }
+    return Response(data)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def create_workout(request):
+    """Creates a workout with its exercises and their sets from one JSON
+    document in a single transaction, answers with the new ids"""
+    serializer = WorkoutTreeSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    workout = batch.create_workouts(request.user,
+                                    [serializer.validated_data])[0]
+    return Response(
+        {
+            'id': workout.pk,
+            'exercises': [{
+                'id': exercise.pk,
+                'sets': [s.pk for s in exercise.sets],
+            } for exercise in workout.exercises],
+        },
+        status=status.HTTP_201_CREATED)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@parser_classes([MultiPartParser])
+def import_workouts(request):
+    upload = request.FILES.get('file')
+    if upload is None:
+        return Response({'file': ['Файл не передан']},
+                        status=status.HTTP_400_BAD_REQUEST)
+    format = request.data.get('format') or os.path.splitext(
+        upload.name)[1].lstrip('.').lower()
+    if format not in PARSERS:
+        return Response({'format': ['Поддерживаются форматы csv и ndjson']},
+                        status=status.HTTP_400_BAD_REQUEST)
+    try:
+        check_encoding(upload.chunks())
+    except UnicodeDecodeError:
+        return Response({'file': ['Файл должен быть в кодировке UTF-8']},
+                        status=status.HTTP_400_BAD_REQUEST)
+    lines = codecs.iterdecode(upload, ENCODING)
+    report = import_rows(request.user, lines, format)
+    return Response(report.as_dict())
@@ -0,0 +1,9 @@
+"""Benchmarks of the hot request paths.
+
+    python -m benchmarks --save baseline.json
+    python -m benchmarks --compare baseline.json
+
+The suite runs against a throwaway test database filled by a deterministic
+generator, see `python -m benchmarks --help` for the data size and the
+number of repetitions.
+"""
@@ -0,0 +1,90 @@
+import argparse
+import os
+import sys
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description='Times the hot request paths on generated data.')
+    parser.add_argument('--users', type=int, default=3)
+    parser.add_argument('--workouts', type=int, default=200,
+                        help='workouts per user')
+    parser.add_argument('--exercises', type=int, default=5,
+                        help='exercises per workout')
+    parser.add_argument('--sets', type=int, default=4,
+                        help='sets per exercise')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--warm', action='store_true',
+                        help='keep the page cache between runs')
+    parser.add_argument('--only', nargs='+', metavar='SCENARIO')
+    parser.add_argument('--save', metavar='JSON',
+                        help='write the results as a baseline')
+    parser.add_argument('--compare', metavar='JSON',
+                        help='compare with a baseline, exit with 1 on '
+                        'regressions')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='tolerated p50 slowdown (default 0.2 = 20%%)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'workout_diary.settings')
+    import django
+    django.setup()
+
+    from django.conf import settings
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+
+    from . import runner
+    from .data import generate
+    from .scenarios import SCENARIOS, Context
+
+    settings.PROFILING_SAMPLE_RATE = 0
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+    users = generate(args.users, args.workouts, args.exercises, args.sets,
+                     args.seed)
+    client = Client()
+    client.force_login(users[0])
+    context = Context(users[0])
+
+    scenarios = [s for s in SCENARIOS
+                 if not args.only or s.name in args.only]
+    results = {}
+    for scenario in scenarios:
+        results[scenario.name] = runner.measure(scenario, client, context,
+                                                args.repeat, args.warmup,
+                                                cold=not args.warm)
+        print('%-20s p50 %8.2f  p90 %8.2f  p99 %8.2f ms  queries %3d  '
+              'peak %8.1f KiB' % ((scenario.name, ) + tuple(
+                  results[scenario.name][key]
+                  for key in ('p50_ms', 'p90_ms', 'p99_ms', 'queries',
+                              'peak_kb'))))
+
+    meta = {key: getattr(args, key)
+            for key in ('users', 'workouts', 'exercises', 'sets', 'seed',
+                        'repeat', 'warm')}
+    if args.save:
+        runner.save(args.save, meta, results)
+    if args.compare:
+        baseline = runner.load(args.compare)
+        if baseline['meta'] != meta:
+            print('Warning: baseline was made with %s' % baseline['meta'])
+        lines, regressions = runner.compare(results, baseline['results'],
+                                            args.threshold)
+        print()
+        print('\n'.join(lines))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+"""Read API throughput under ASGI (async views) against WSGI (DRF views).
+
+    python -m benchmarks.asgi --concurrency 64 --threads 8 --seconds 10
+
+Each mode runs in its own process on a fresh database file. `concurrency`
+clients send the workout list, detail, exercises and sets requests in a
+closed loop. For WSGI, `threads` handler threads serve them, like a
+threaded WSGI server with that many threads, and a request waiting for a
+free thread counts toward its latency. For ASGI, all requests go through
+one event loop, and database work runs in the default thread pool. The
+servers themselves are not part of the measurement; both modes use
+Django's test client handlers.
+"""
+import argparse
+import asyncio
+import json
+import math
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+MODES = ('wsgi', 'asgi')
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.asgi')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--threads', type=int, default=8,
+                        help='WSGI handler threads')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--workouts', type=int, default=200)
+    parser.add_argument('--mode', choices=MODES,
+                        help='run one mode in this process, print JSON')
+    return parser.parse_args(argv)
+
+
+def summary(latencies, seconds):
+    latencies.sort()
+
+    def percentile(fraction):
+        if not latencies:
+            return None
+        rank = max(1, math.ceil(fraction * len(latencies)))
+        return round(latencies[rank - 1] * 1000, 2)
+
+    return {
+        'requests_per_second': round(len(latencies) / seconds, 1),
+        'p50_ms': percentile(0.5),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+    }
+
+
+def paths(context):
+    workout, exercise = context.workout.pk, context.exercise.pk
+    return [
+        '/api/workouts/',
+        '/api/workouts/%d/' % workout,
+        '/api/workouts/%d/exercises/' % workout,
+        '/api/workouts/%d/exercises/%d/sets/' % (workout, exercise),
+    ]
+
+
+def run_wsgi(args, user, urls):
+    from django.test import Client
+
+    server_threads = threading.Semaphore(args.threads)
+    deadline = time.perf_counter() + args.seconds
+    latencies, lock = [], threading.Lock()
+
+    def client_loop(offset):
+        client = Client()
+        client.force_login(user)
+        own = []
+        i = offset
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            with server_threads:
+                response = client.get(urls[i % len(urls)])
+            assert response.status_code == 200, response.status_code
+            own.append(time.perf_counter() - start)
+            i += 1
+        with lock:
+            latencies.extend(own)
+
+    clients = [threading.Thread(target=client_loop, args=(i, ))
+               for i in range(args.concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return latencies
+
+
+def run_asgi(args, user, urls):
+    from django.test import AsyncClient
+
+    client = AsyncClient()
+    client.force_login(user)
+
+    async def client_loop(offset, deadline):
+        own = []
+        i = offset
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = await client.get(urls[i % len(urls)])
+            assert response.status_code == 200, response.status_code
+            own.append(time.perf_counter() - start)
+            i += 1
+        return own
+
+    async def main():
+        deadline = time.perf_counter() + args.seconds
+        results = await asyncio.gather(*[
+            client_loop(i, deadline) for i in range(args.concurrency)
+        ])
+        return [latency for own in results for latency in own]
+
+    return asyncio.run(main())
+
+
+def run_mode(args, directory):
+    from .environment import setup
+
+    setup(directory, API_ASYNC_READS=args.mode == 'asgi')
+
+    from django.db import connections
+
+    from .data import generate
+    from .scenarios import Context
+
+    user = generate(users=1, workouts=args.workouts)[0]
+    urls = paths(Context(user))
+    connections.close_all()
+    run = run_asgi if args.mode == 'asgi' else run_wsgi
+    return summary(run(args, user, urls), args.seconds)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.mode:
+        directory = tempfile.mkdtemp()
+        try:
+            print(json.dumps(run_mode(args, directory)))
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        return 0
+    argv = list(argv if argv is not None else sys.argv[1:])
+    print('%-6s %8s %9s %9s %9s' % ('mode', 'req/s', 'p50 ms', 'p95 ms',
+                                     'p99 ms'))
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.asgi', '--mode', mode] + argv,
+            check=True, stdout=subprocess.PIPE, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print('%-6s %8s %9s %9s %9s' %
+              (mode, result['requests_per_second'], result['p50_ms'],
+               result['p95_ms'], result['p99_ms']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
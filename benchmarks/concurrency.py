@@ -0,0 +1,137 @@
+"""Concurrent read/write throughput with and without the SQLite profile.
+
+    python -m benchmarks.concurrency --threads 8 --seconds 10
+
+Every profile runs in a fresh process against its own database file (the
+journal mode is stored in the file), migrated and filled by the data
+generator. Worker threads, each with its own connection like separate web
+workers, then loop over a mix of API reads and workout form posts for a
+fixed time. The table shows requests per second, write latency and the
+requests that failed with "database is locked".
+"""
+import argparse
+import json
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+PROFILES = ('default', 'tuned')
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.concurrency')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--writes',
+                        type=float,
+                        default=0.2,
+                        help='share of requests that write (default 0.2)')
+    parser.add_argument('--workouts', type=int, default=200)
+    parser.add_argument('--profile', choices=PROFILES,
+                        help='run one profile in this process, print JSON')
+    return parser.parse_args(argv)
+
+
+def run_profile(args, directory):
+    from .environment import setup
+
+    if args.profile == 'default':
+        setup(directory, conn_max_age=0, SQLITE_PRAGMAS={})
+    else:
+        setup(directory)
+
+    from django.db import OperationalError, connection, connections
+    from django.test import Client
+
+    from .data import generate
+    from .scenarios import Context, workout_form
+
+    user = generate(users=1, workouts=args.workouts)[0]
+    context = Context(user)
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode')
+        journal_mode = cursor.fetchone()[0]
+    connection.close()
+
+    reads = ['/api/workouts/', '/api/workouts/%d/' % context.workout.pk,
+             '/api/workouts/%d/exercises/' % context.workout.pk]
+    deadline = time.perf_counter() + args.seconds
+    lock = threading.Lock()
+    totals = {'reads': 0, 'writes': 0, 'locked': 0, 'write_seconds': 0.0}
+
+    def worker(seed):
+        rng = random.Random(seed)
+        client = Client()
+        client.force_login(user)
+        counts = dict.fromkeys(totals, 0)
+        while time.perf_counter() < deadline:
+            write = rng.random() < args.writes
+            start = time.perf_counter()
+            try:
+                if write:
+                    client.post('/workout_add/', workout_form(context))
+                else:
+                    client.get(rng.choice(reads))
+            except OperationalError:
+                counts['locked'] += 1
+                continue
+            if write:
+                counts['writes'] += 1
+                counts['write_seconds'] += time.perf_counter() - start
+            else:
+                counts['reads'] += 1
+        connections.close_all()
+        with lock:
+            for key, value in counts.items():
+                totals[key] += value
+
+    threads = [threading.Thread(target=worker, args=(seed, ))
+               for seed in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {
+        'journal_mode': journal_mode,
+        'requests_per_second': round(
+            (totals['reads'] + totals['writes']) / args.seconds, 1),
+        'reads': totals['reads'],
+        'writes': totals['writes'],
+        'locked': totals['locked'],
+        'write_ms': round(totals['write_seconds'] / totals['writes'] * 1000,
+                          2) if totals['writes'] else None,
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.profile:
+        directory = tempfile.mkdtemp()
+        try:
+            print(json.dumps(run_profile(args, directory)))
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        return 0
+    argv = list(argv if argv is not None else sys.argv[1:])
+    print('%-8s %-8s %8s %8s %8s %8s %10s' %
+          ('profile', 'journal', 'req/s', 'reads', 'writes', 'locked',
+           'write ms'))
+    for profile in PROFILES:
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.concurrency', '--profile',
+             profile] + argv,
+            check=True, stdout=subprocess.PIPE, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print('%-8s %-8s %8s %8d %8d %8d %10s' %
+              (profile, result['journal_mode'],
+               result['requests_per_second'], result['reads'],
+               result['writes'], result['locked'], result['write_ms']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""Deterministic synthetic diaries.
+
+The same arguments always produce the same users, workouts, exercises and
+sets. Rows go through main.importers, so they are written with chunked
+bulk inserts and the search index and statistics are built the same way as
+for an imported log.
+"""
+import datetime
+import random
+
+from django.contrib.auth.hashers import make_password
+
+from main.importers import Importer
+from main.models import AdvUser
+
+WORKOUT_NAMES = ('Грудь', 'Спина', 'Ноги', 'Плечи', 'Руки', 'Фулбади')
+
+EXERCISE_NAMES = ('Жим лёжа', 'Жим гантелей', 'Присед', 'Становая тяга',
+                  'Тяга штанги', 'Подтягивания', 'Жим стоя', 'Выпады',
+                  'Сгибания на бицепс', 'Французский жим', 'Разводка',
+                  'Махи гантелями')
+
+COMMENTS = ('', '', 'Тяжело', 'Легко', 'Хорошее самочувствие', 'Мало сна')
+
+FIRST_DAY = datetime.date(2020, 1, 1)
+
+PASSWORD = 'benchmark'
+
+
+def diary_rows(rng, workouts, exercises, sets):
+    """Import rows of one user's diary, a workout every one to three days"""
+    day = FIRST_DAY
+    line = 0
+    for _ in range(workouts):
+        day += datetime.timedelta(days=rng.randint(1, 3))
+        name = rng.choice(WORKOUT_NAMES)
+        comment = rng.choice(COMMENTS)
+        for exercise in rng.sample(EXERCISE_NAMES, exercises):
+            weight = rng.randrange(20, 200) / 2
+            for number in range(1, sets + 1):
+                line += 1
+                yield line, {
+                    'date': day.isoformat(),
+                    'workout': name,
+                    'comment': comment,
+                    'exercise': exercise,
+                    'number': number,
+                    'weight': '%.1f' % weight,
+                    'repeats': rng.randint(1, 15),
+                }
+
+
+def generate(users=3, workouts=200, exercises=5, sets=4, seed=1):
+    """Creates `users` users named bench0, bench1, ... with `workouts`
+    workouts of `exercises` exercises of `sets` sets each, returns the
+    users"""
+    rng = random.Random(seed)
+    password = make_password(PASSWORD)
+    created = AdvUser.objects.bulk_create([
+        AdvUser(username='bench%d' % i,
+                email='bench%d@example.com' % i,
+                password=password,
+                is_activated=True) for i in range(users)
+    ])
+    created = list(AdvUser.objects.filter(
+        username__in=[user.username for user in created]).order_by('pk'))
+    exercises = min(exercises, len(EXERCISE_NAMES))
+    for user in created:
+        report = Importer(user).run(
+            diary_rows(rng, workouts, exercises, sets))
+        if report.error_count:
+            raise ValueError('Generated rows are invalid: %s' %
+                             report.errors[:3])
+    return created
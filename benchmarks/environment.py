@@ -0,0 +1,27 @@
+"""Django set up against a fresh database file for benchmarks that need
+several connections at once (the test database lives in memory)"""
+import os
+
+
+def setup(directory, conn_max_age=None, **overrides):
+    """Configures Django with a migrated database in `directory`; the
+    keyword arguments override settings before apps are loaded"""
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'workout_diary.settings'
+    import django
+    from django.conf import settings
+
+    settings.DATABASES['default']['NAME'] = os.path.join(
+        directory, 'benchmark.sqlite3')
+    if conn_max_age is not None:
+        settings.DATABASES['default']['CONN_MAX_AGE'] = conn_max_age
+    settings.DATABASES['replica'] = dict(settings.DATABASES['default'])
+    settings.PROFILING_SAMPLE_RATE = 0
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+    django.setup()
+
+    from django.core.management import call_command
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    call_command('migrate', verbosity=0)
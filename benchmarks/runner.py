@@ -0,0 +1,86 @@
+"""Runs scenarios and compares the results with a saved baseline.
+
+Every scenario is timed `repeat` times after `warmup` untimed runs; one
+more run with query capturing and tracemalloc switched on gives the query
+count and the peak of memory allocated while handling the request, so the
+tracing overhead does not distort the timings.
+"""
+import json
+import math
+import time
+import tracemalloc
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from main import caching
+
+
+def percentile(ordered, fraction):
+    return ordered[max(1, math.ceil(fraction * len(ordered))) - 1]
+
+
+def measure(scenario, client, context, repeat=30, warmup=3, cold=True):
+    def run():
+        if cold:
+            caching.get_cache().clear()
+        url, data = scenario.prepare(context)
+        start = time.perf_counter()
+        scenario.run(client, url, data)
+        return time.perf_counter() - start
+
+    for _ in range(warmup):
+        run()
+    timings = sorted(run() for _ in range(repeat))
+
+    if cold:
+        caching.get_cache().clear()
+    url, data = scenario.prepare(context)
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            scenario.run(client, url, data)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'p50_ms': round(percentile(timings, 0.5) * 1000, 3),
+        'p90_ms': round(percentile(timings, 0.9) * 1000, 3),
+        'p99_ms': round(percentile(timings, 0.99) * 1000, 3),
+        'max_ms': round(timings[-1] * 1000, 3),
+        'queries': len(queries),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def compare(results, baseline, threshold=0.2):
+    """Lines describing every scenario against the baseline and the list of
+    regressions: p50 slower by more than `threshold` or more queries"""
+    lines, regressions = [], []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            lines.append('%-20s new' % name)
+            continue
+        ratio = result['p50_ms'] / before['p50_ms'] if before['p50_ms'] else 1
+        queries = result['queries'] - before['queries']
+        line = '%-20s p50 %8.2f ms (%+.0f%%)  queries %3d (%+d)' % (
+            name, result['p50_ms'], (ratio - 1) * 100, result['queries'],
+            queries)
+        if ratio > 1 + threshold or queries > 0:
+            regressions.append(name)
+            line += '  REGRESSION'
+        lines.append(line)
+    return lines, regressions
+
+
+def save(path, meta, results):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump({'meta': meta, 'results': results}, file, indent=2,
+                  ensure_ascii=False)
+
+
+def load(path):
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
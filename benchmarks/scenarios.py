@@ -0,0 +1,132 @@
+"""Timed scenarios: one request each against the generated data"""
+import io
+
+from django.urls import reverse
+
+from main.models import Exercise, Workout
+
+
+class Scenario:
+    def __init__(self, name, url, method='get', data=None, status=200):
+        self.name = name
+        self.url = url
+        self.method = method
+        self.data = data
+        self.status = status
+
+    def prepare(self, context):
+        """Resolves the URL (and the form data) for the generated data"""
+        url = self.url(context) if callable(self.url) else self.url
+        return url, self.data(context) if self.data else None
+
+    def run(self, client, url, data):
+        if self.method == 'post':
+            response = client.post(url, data)
+        else:
+            response = client.get(url)
+        if response.status_code != self.status:
+            raise AssertionError('%s: %s returned %s' %
+                                 (self.name, url, response.status_code))
+        # Streaming responses only do their work when consumed
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        return response
+
+
+class Context:
+    """Ids the scenarios point at: the newest workout of the first user and
+    its first exercise"""
+    def __init__(self, user):
+        self.user = user
+        self.workout = Workout.objects.filter(owner=user).order_by(
+            '-created_at', '-id').first()
+        self.exercise = Exercise.objects.filter(
+            workout=self.workout).order_by('pk').first()
+
+
+def workout_form(context):
+    data = {
+        'name': 'Тренировка',
+        'created_at': '18/11/2021',
+        'comment': '',
+        'exercise_set-TOTAL_FORMS': '6',
+        'exercise_set-INITIAL_FORMS': '0',
+        'exercise_set-MIN_NUM_FORMS': '0',
+        'exercise_set-MAX_NUM_FORMS': '1000',
+    }
+    for i, name in enumerate(('Жим лёжа', 'Разводка', 'Отжимания')):
+        data['exercise_set-%d-name' % i] = name
+        prefix = 'exercise_set-%d-sets' % i
+        data.update({
+            prefix + '-TOTAL_FORMS': '3',
+            prefix + '-INITIAL_FORMS': '0',
+            prefix + '-MIN_NUM_FORMS': '0',
+            prefix + '-MAX_NUM_FORMS': '1000',
+        })
+        for number in range(3):
+            data['%s-%d-number' % (prefix, number)] = str(number + 1)
+            data['%s-%d-weight' % (prefix, number)] = '50'
+            data['%s-%d-repeats' % (prefix, number)] = '10'
+    return data
+
+
+def import_file(context):
+    rows = ['date,workout,comment,exercise,number,weight,repeats']
+    for number in range(1, 6):
+        rows.append('2021-11-18,Импорт,,Присед,%d,80,5' % number)
+    upload = io.BytesIO('\n'.join(rows).encode())
+    upload.name = 'log.csv'
+    return {'file': upload}
+
+
+def url(name, **kwargs):
+    """Lazily reversed URL; callable kwargs get the scenario context"""
+    def resolve(context):
+        return reverse(name, kwargs={
+            key: value(context) if callable(value) else value
+            for key, value in kwargs.items()
+        })
+    return resolve
+
+
+def workout_pk(context):
+    return context.workout.pk
+
+
+def exercise_pk(context):
+    return context.exercise.pk
+
+
+def api_url(path):
+    return lambda context: '/api/' + path.format(workout=context.workout.pk,
+                                                 exercise=context.exercise.pk)
+
+
+SCENARIOS = [
+    Scenario('index', url('main:index')),
+    Scenario('workouts', url('main:workouts')),
+    Scenario('workouts_keyword',
+             lambda context: url('main:workouts')(context) + '?keyword=жим'),
+    Scenario('workout_detail', url('main:workout', pk=workout_pk)),
+    Scenario('workout_create',
+             url('main:workout_add'),
+             method='post',
+             data=workout_form,
+             status=302),
+    Scenario('stats', url('main:stats')),
+    Scenario('api_workouts', api_url('workouts/')),
+    Scenario('api_workouts_dates',
+             api_url('workouts/?from=2020-06-01&to=2020-12-31&limit=50')),
+    Scenario('api_workout_detail', api_url('workouts/{workout}/')),
+    Scenario('api_exercises', api_url('workouts/{workout}/exercises/')),
+    Scenario('api_sets',
+             api_url('workouts/{workout}/exercises/{exercise}/sets/')),
+    Scenario('api_search', api_url('search/?q=жим')),
+    Scenario('api_stats', api_url('stats/')),
+    Scenario('api_analytics', api_url('analytics/?window=28')),
+    Scenario('api_import',
+             api_url('import/'),
+             method='post',
+             data=import_file),
+]
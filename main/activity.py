@@ -0,0 +1,112 @@
+"""Daily training activity behind the calendar.
+
+A DailyActivity row holds the number of workouts and sets and the volume of
+one user on one day, summed from the summary columns (main.summaries) of
+that day's workouts. A write re-sums only the days of the workouts it
+touched, which reads those workouts through the (owner, created_at) index,
+and the calendar of any date window is one range scan of the (user, day)
+unique index.
+"""
+import datetime
+import math
+
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from .models import DailyActivity, Workout
+
+LEVELS = 4
+
+
+def totals(workouts):
+    """{day: (sessions, set count, volume)} of a queryset of workouts"""
+    rows = workouts.order_by().values('created_at').annotate(
+        sessions=Count('pk'), sets=Sum('set_count'),
+        volume=Sum('total_volume')).values_list('created_at', 'sessions',
+                                                'sets', 'volume')
+    return {day: (sessions, sets, volume) for day, sessions, sets, volume
+            in rows}
+
+
+def refresh(pairs, using='default'):
+    """Re-sums the activity of (user id, day) pairs"""
+    days = {}
+    for user_id, day in pairs:
+        if day is not None:
+            days.setdefault(user_id, set()).add(day)
+    with transaction.atomic(using=using, savepoint=False):
+        for user_id, user_days in days.items():
+            found = totals(
+                Workout.objects.using(using).filter(
+                    owner_id=user_id, created_at__in=user_days))
+            rows = DailyActivity.objects.using(using).filter(user_id=user_id)
+            if len(found) < len(user_days):
+                rows.filter(day__in=user_days - set(found)).delete()
+            existing = set(
+                rows.filter(day__in=found).values_list('day', flat=True))
+            for day in existing:
+                sessions, sets, volume = found.pop(day)
+                rows.filter(day=day).update(sessions=sessions,
+                                            set_count=sets,
+                                            volume=volume)
+            DailyActivity.objects.using(using).bulk_create([
+                DailyActivity(user_id=user_id,
+                              day=day,
+                              sessions=sessions,
+                              set_count=sets,
+                              volume=volume)
+                for day, (sessions, sets, volume) in found.items()
+            ])
+
+
+def workouts_changed(workout_ids, using='default'):
+    """Re-sums the days of workouts written in bulk"""
+    refresh(
+        Workout.objects.using(using).filter(pk__in=workout_ids).values_list(
+            'owner_id', 'created_at').distinct(), using)
+
+
+def rebuild_user(user_id):
+    """Recomputes every day of one user"""
+    found = totals(Workout.objects.filter(owner_id=user_id))
+    with transaction.atomic():
+        DailyActivity.objects.filter(user_id=user_id).delete()
+        DailyActivity.objects.bulk_create([
+            DailyActivity(user_id=user_id,
+                          day=day,
+                          sessions=sessions,
+                          set_count=sets,
+                          volume=volume)
+            for day, (sessions, sets, volume) in found.items()
+        ])
+
+
+def window(user_id, start, end):
+    """The user's days with activity from `start` to `end`, oldest first"""
+    return DailyActivity.objects.filter(user_id=user_id,
+                                        day__range=(start, end))
+
+
+def calendar_rows(start, end, days):
+    """Seven rows, Monday to Sunday, of one cell per week from `start` to
+    `end`: {'day', 'activity', 'level'} dicts, None outside the window.
+    `level` grades the volume from 1 to LEVELS, 0 without a workout."""
+    activity = {row.day: row for row in days}
+    top = max([row.volume for row in activity.values()], default=0)
+    monday = start - datetime.timedelta(days=start.weekday())
+    rows = [[] for _ in range(7)]
+    while monday <= end:
+        for weekday, cells in enumerate(rows):
+            day = monday + datetime.timedelta(days=weekday)
+            if not start <= day <= end:
+                cells.append(None)
+                continue
+            row = activity.get(day)
+            level = 0
+            if row is not None:
+                level = 1
+                if top:
+                    level = max(level, math.ceil(LEVELS * row.volume / top))
+            cells.append({'day': day, 'activity': row, 'level': level})
+        monday += datetime.timedelta(days=7)
+    return rows
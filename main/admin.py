@@ -2,16 +2,19 @@ from django.contrib import admin
 
 import datetime
 
+from django.utils import timezone
 
-from .models import AdvUser, Exercise, SetDescription, Workout 
+from . import movements
+from .models import (AdvUser, Exercise, Letter, Movement, MovementAlias,
+                     SetDescription, Workout)
 from .utilities import send_activation_notification
 
 
 def send_activation_notifications(modeladmin, request, queryset):
-    for rec in queryset:
-        if not rec.is_activated:
-            send_activation_notification(rec)
-        modeladmin.message_user(request, "Письма с требованиями отправлены")
+    for rec in queryset.filter(is_activated=False):
+        send_activation_notification(rec)
+    modeladmin.message_user(request,
+                            "Письма с требованиями поставлены в очередь")
 
 
 send_activation_notifications.short_description = "Отправка писем с требованием активации"
@@ -60,7 +63,9 @@ class ExerciseInline(admin.TabularInline):
 
 
 class WorkoutsAdmin(admin.ModelAdmin):
-    list_display = ('__str__', 'created_at')
+    list_display = ('__str__', 'owner', 'created_at')
+    list_select_related = ('owner', )
+    raw_id_fields = ('owner', )
     inlines = (ExerciseInline, )
 
 
@@ -74,9 +79,64 @@ class ExerciseAdmin(admin.ModelAdmin):
 
 
 
+def merge_movements(modeladmin, request, queryset):
+    if queryset.values('owner').distinct().count() != 1:
+        modeladmin.message_user(request,
+                                "Выберите движения одного спортсмена",
+                                level='error')
+        return
+    selected = list(queryset.order_by('pk'))
+    movements.merge(selected[0], selected[1:])
+    modeladmin.message_user(request,
+                            "Движения объединены в «%s»" % selected[0])
+
+
+merge_movements.short_description = "Объединить в первое из выбранных"
+
+
+class MovementAliasInline(admin.TabularInline):
+    model = MovementAlias
+    readonly_fields = ('key', )
+    exclude = ('owner', )
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+class MovementAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'owner')
+    list_select_related = ('owner', )
+    raw_id_fields = ('owner', )
+    search_fields = ('name', 'owner__username')
+    inlines = (MovementAliasInline, )
+    actions = (merge_movements, )
+
+
+def retry_letters(modeladmin, request, queryset):
+    queryset.exclude(status=Letter.SENT).update(status=Letter.PENDING,
+                                                attempts=0,
+                                                next_attempt_at=timezone.now())
+    modeladmin.message_user(request, "Письма поставлены в очередь повторно")
+
+
+retry_letters.short_description = "Отправить повторно"
+
+
+class LetterAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'status', 'attempts', 'created_at', 'sent_at')
+    list_filter = ('status', )
+    search_fields = ('recipient', 'subject')
+    raw_id_fields = ('user', )
+    actions = (retry_letters, )
+
+
 admin.site.register(AdvUser, AdvUserAdmin)
 admin.site.register(Workout, WorkoutsAdmin)
 admin.site.register(Exercise, ExerciseAdmin)
+admin.site.register(Movement, MovementAdmin)
 admin.site.register(SetDescription)
+admin.site.register(Letter, LetterAdmin)
 
 
@@ -0,0 +1,120 @@
+"""Vectorized progress analytics over a user's whole set history.
+
+The history is read with a single values_list() query straight into NumPy
+columns, so no model instances are created and every computation below is
+an array operation instead of a Python loop over sets.
+"""
+import numpy as np
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+
+from .models import SetDescription
+from .stats import exercise_key
+
+HISTORY_COLUMNS = ('exercise__workout__created_at', 'exercise__name',
+                   'weight_value', 'repeats')
+
+
+class History:
+    """A user's sets as parallel arrays, oldest first"""
+    def __init__(self, days, names, weights, repeats):
+        self.days = np.asarray(days, dtype='datetime64[D]')
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.repeats = np.asarray(repeats, dtype=np.float64)
+        raw_names, name_codes = np.unique(np.asarray(names, dtype=object),
+                                          return_inverse=True)
+        # Spellings of one exercise collapse into a single code
+        keys = [exercise_key(name) for name in raw_names]
+        self.exercises, key_codes = np.unique(np.asarray(keys, dtype=object),
+                                              return_inverse=True)
+        self.exercise_codes = key_codes[name_codes]
+        self.display_names = {}
+        for raw_code, key_code in enumerate(key_codes):
+            self.display_names.setdefault(key_code, raw_names[raw_code])
+
+    @classmethod
+    def for_user(cls, user_id):
+        rows = SetDescription.objects.filter(
+            exercise__workout__owner_id=user_id).annotate(
+                weight_value=Cast('weight', FloatField())).order_by(
+                    'exercise__workout__created_at').values_list(
+                        *HISTORY_COLUMNS)
+        columns = list(zip(*rows.iterator(chunk_size=5000))) or [[]] * 4
+        return cls(*columns)
+
+    def __len__(self):
+        return len(self.days)
+
+    @property
+    def volume(self):
+        return self.weights * self.repeats
+
+    @property
+    def e1rm(self):
+        """Epley estimate per set, sets of one repeat are their own max"""
+        estimate = self.weights * (1 + self.repeats / 30)
+        estimate = np.where(self.repeats == 1, self.weights, estimate)
+        return np.where(self.repeats > 0, estimate, 0.0)
+
+
+def daily_volume(history, window=7):
+    """Volume per training day and its rolling sum over `window` days"""
+    training_days, day_codes = np.unique(history.days, return_inverse=True)
+    volume = np.bincount(day_codes, weights=history.volume,
+                         minlength=len(training_days))
+    if not len(training_days):
+        return training_days, volume, volume
+    # Rolling sums are taken over the calendar, not over training days
+    offsets = (training_days - training_days[0]).astype(np.int64)
+    calendar = np.zeros(offsets[-1] + 1)
+    calendar[offsets] = volume
+    cumulative = np.concatenate(([0.0], np.cumsum(calendar)))
+    starts = np.maximum(offsets + 1 - window, 0)
+    rolling = cumulative[offsets + 1] - cumulative[starts]
+    return training_days, volume, rolling
+
+
+def progression(history):
+    """Best e1RM per exercise and day, plus its running maximum.
+
+    Yields (exercise code, day indexes, daily best, all-time best) where
+    day indexes point into the sorted unique training days.
+    """
+    training_days, day_codes = np.unique(history.days, return_inverse=True)
+    if not len(history):
+        return
+    pairs = history.exercise_codes * len(training_days) + day_codes
+    order = np.argsort(pairs, kind='stable')
+    pairs, e1rm = pairs[order], history.e1rm[order]
+    starts = np.flatnonzero(np.r_[True, pairs[1:] != pairs[:-1]])
+    best = np.maximum.reduceat(e1rm, starts)
+    exercises, days = np.divmod(pairs[starts], len(training_days))
+    bounds = np.flatnonzero(np.r_[True, exercises[1:] != exercises[:-1],
+                                  True])
+    for begin, end in zip(bounds[:-1], bounds[1:]):
+        series = best[begin:end]
+        yield (exercises[begin], days[begin:end], series,
+               np.maximum.accumulate(series))
+
+
+def rounded(values):
+    return np.round(values, 1).tolist()
+
+
+def progress_report(user_id, window=7):
+    """Compact JSON-ready arrays describing the user's progress"""
+    history = History.for_user(user_id)
+    days, volume, rolling = daily_volume(history, window)
+    return {
+        'days': [str(day) for day in days],
+        'volume': rounded(volume),
+        'rolling_volume': rounded(rolling),
+        'window': window,
+        'exercises': [{
+            'name': history.display_names[code],
+            'days': day_indexes.tolist(),
+            'e1rm': rounded(daily_best),
+            'best_e1rm': rounded(running_best),
+        } for code, day_indexes, daily_best, running_best in progression(
+            history)],
+    }
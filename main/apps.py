@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 from django.dispatch import Signal
 
 from .utilities import send_activation_notification
@@ -12,8 +13,46 @@ def user_registered_dispatcher(sender, *args, **kwargs):
 
 user_registered.connect(user_registered_dispatcher)
 
+# Every bulk signal below also gets `using`, the alias of the database that
+# was written to.
+
+# Sent after workouts (with their exercises and sets) were written with
+# bulk queries that bypass the model signals. Arguments: owner_id,
+# workout_ids.
+workouts_bulk_changed = Signal()
+
+# Sent after new workouts (with their exercises and sets) were inserted with
+# bulk queries and their summaries, before the transaction commits. Unlike
+# workouts_bulk_changed it lets derived data be updated incrementally.
+# Arguments: owner_id, workout_ids, days (their training dates),
+# exercise_ids and set_ids, (id, workout id) pairs of the new exercises and
+# sets, and sets, the main.stats.CONTRIBUTION_FIELDS rows of the new sets.
+workouts_bulk_created = Signal()
+
+# Sent after sets of one workout were inserted, updated or deleted with bulk
+# queries, before the transaction commits. Arguments: owner_id, workout_id,
+# exercise_id (the exercise inserted with the sets, or None), saved and
+# deleted (set ids), old and new: the main.stats.CONTRIBUTION_FIELDS rows of
+# the changed sets before and after the change.
+sets_bulk_saved = Signal()
+
+# Sent after workouts were deleted with set-based queries, before the
+# transaction commits. Arguments: owner_id, workout_ids, days (their
+# training dates) and sets, the main.stats.CONTRIBUTION_FIELDS rows of the
+# deleted sets.
+workouts_bulk_deleted = Signal()
+
 
 class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
     verbose_name = 'Дневник тренировок'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .database import configure_connection
+        connection_created.connect(configure_connection,
+                                   dispatch_uid='main.configure_connection')
+        from .profiling import install_recorder
+        connection_created.connect(install_recorder,
+                                   dispatch_uid='main.install_recorder')
@@ -0,0 +1,124 @@
+"""Writes whole workouts (exercises with their sets) in one transaction.
+
+Each level is inserted with a single bulk query instead of a save() per
+row, and derived data is updated once from the workouts_bulk_created and
+sets_bulk_saved signals. Used by the batched write API and the workout and
+set formsets.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from . import summaries
+from .apps import sets_bulk_saved, workouts_bulk_created
+from .models import Exercise, SetDescription, Workout
+from .movements import resolve as resolve_movements
+from .stats import CONTRIBUTION_FIELDS
+from .utilities import bulk_create_with_pks, reserve_pks
+
+
+def create_workouts(owner, trees, using='default'):
+    """Creates workouts from validated dicts of Workout fields with an
+    'exercises' list of dicts of Exercise fields, each with a 'sets' list of
+    dicts of SetDescription fields. Returns the saved Workout objects with
+    `exercises` lists of saved Exercise objects with `sets` lists."""
+    workouts = []
+    for tree in trees:
+        tree = dict(tree)
+        exercises = tree.pop('exercises', [])
+        workout = Workout(owner=owner, **tree)
+        workout.exercises = []
+        for exercise_data in exercises:
+            exercise_data = dict(exercise_data)
+            sets = exercise_data.pop('sets', [])
+            exercise = Exercise(**exercise_data)
+            exercise.sets = [SetDescription(**data) for data in sets]
+            workout.exercises.append(exercise)
+        summaries.fill(workout, workout.exercises)
+        workouts.append(workout)
+
+    exercises = [e for workout in workouts for e in workout.exercises]
+    sets = [s for exercise in exercises for s in exercise.sets]
+    with transaction.atomic(using=using):
+        # One statement for the ids of all three tables where the inserts
+        # can't return them
+        reserve_pks([(Workout, workouts), (Exercise, exercises),
+                     (SetDescription, sets)], using)
+        bulk_create_with_pks(Workout, workouts, using)
+        for workout in workouts:
+            for exercise in workout.exercises:
+                exercise.workout_id = workout.pk
+        movement_ids = resolve_movements(
+            owner.pk, {exercise.name for exercise in exercises}, using)
+        for exercise in exercises:
+            exercise.movement_id = movement_ids[exercise.name]
+        bulk_create_with_pks(Exercise, exercises, using)
+        contributions = []
+        for workout in workouts:
+            for exercise in workout.exercises:
+                for set_description in exercise.sets:
+                    set_description.exercise_id = exercise.pk
+                    contributions.append(
+                        (set_description.weight, set_description.repeats,
+                         exercise.name, owner.pk, workout.created_at))
+        bulk_create_with_pks(SetDescription, sets, using)
+        set_ids = [(s.pk, exercise.workout_id) for exercise in exercises
+                   for s in exercise.sets]
+        workouts_bulk_created.send(
+            sender=Workout,
+            owner_id=owner.pk,
+            workout_ids=[w.pk for w in workouts],
+            days={w.created_at for w in workouts},
+            exercise_ids=[(e.pk, e.workout_id) for e in exercises],
+            set_ids=set_ids,
+            sets=contributions,
+            using=using)
+    return workouts
+
+
+def save_sets(exercise, created=(), updated=(), fields=(), deleted=(),
+              using='default'):
+    """Inserts, updates (`fields` of `updated`) and deletes sets of an
+    exercise with one query each; an unsaved exercise is inserted with its
+    new sets"""
+    created, updated, deleted = list(created), list(updated), list(deleted)
+    new_exercise = exercise.pk is None
+    if not (new_exercise or created or updated or deleted):
+        return
+    owner_id, day = Workout.objects.using(using).filter(
+        pk=exercise.workout_id).values_list('owner_id', 'created_at').get()
+    with transaction.atomic(using=using, savepoint=False):
+        if new_exercise:
+            if exercise.movement_id is None:
+                exercise.movement_id = resolve_movements(
+                    owner_id, [exercise.name], using)[exercise.name]
+            reserve_pks([(Exercise, [exercise]), (SetDescription, created)],
+                        using)
+            bulk_create_with_pks(Exercise, [exercise], using)
+        old = list(
+            SetDescription.objects.using(using).filter(
+                pk__in=[s.pk for s in updated + deleted]).values_list(
+                    *CONTRIBUTION_FIELDS))
+        if deleted:
+            SetDescription.objects.using(using).filter(
+                pk__in=[s.pk for s in deleted])._raw_delete(using)
+        if updated:
+            # bulk_update() leaves auto_now fields alone
+            now = timezone.now()
+            for set_description in updated:
+                set_description.updated_at = now
+            SetDescription.objects.using(using).bulk_update(
+                updated, list(fields) + ['updated_at'])
+        for set_description in created:
+            set_description.exercise_id = exercise.pk
+        bulk_create_with_pks(SetDescription, created, using)
+        sets_bulk_saved.send(
+            sender=SetDescription,
+            owner_id=owner_id,
+            workout_id=exercise.workout_id,
+            exercise_id=exercise.pk if new_exercise else None,
+            saved=[s.pk for s in created + updated],
+            deleted=[s.pk for s in deleted],
+            old=old,
+            new=[(s.weight, s.repeats, exercise.name, owner_id, day)
+                 for s in created + updated],
+            using=using)
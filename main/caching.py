@@ -0,0 +1,168 @@
+"""Per-user cache of data and pages derived from a user's workouts.
+
+Keys embed version numbers stored per user and per workout. Signals bump
+the user's version when the list of workouts or anything searchable in it
+changes, and a workout's version when anything shown on its page changes.
+Pages listing workouts also depend on a per-user lists version, bumped when
+the summary of one of the workouts changes,
+so stale entries are never read again and age out of the cache on their own
+instead of being deleted one by one.
+
+The cache alias is set by WORKOUT_CACHE_ALIAS. With the locmem backend
+MAX_ENTRIES bounds the size and the least recently used entries are evicted
+first.
+"""
+import functools
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+
+TIMEOUT = 60 * 60
+
+# Per process, like the locmem cache itself
+counters = Counter()
+counters_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[getattr(settings, 'WORKOUT_CACHE_ALIAS', 'default')]
+
+
+def count(event):
+    with counters_lock:
+        counters[event] += 1
+
+
+def cache_stats():
+    with counters_lock:
+        hits, misses, bypassed = (counters['hit'], counters['miss'],
+                                  counters['bypass'])
+    lookups = hits + misses
+    alias = getattr(settings, 'WORKOUT_CACHE_ALIAS', 'default')
+    return {
+        'alias': alias,
+        'backend': settings.CACHES[alias]['BACKEND'],
+        'hits': hits,
+        'misses': misses,
+        'bypassed': bypassed,
+        'hit_ratio': round(hits / lookups, 3) if lookups else None,
+    }
+
+
+def version_key(scope, pk):
+    return 'workouts:%s:%s:version' % (scope, pk)
+
+
+def new_version():
+    # Not 1: a version key evicted and seeded again must not bring back the
+    # entries stored under an earlier version
+    return time.time_ns()
+
+
+def get_version(scope, pk):
+    return get_cache().get_or_set(version_key(scope, pk), new_version, None)
+
+
+def bump(scope, pk):
+    cache = get_cache()
+    try:
+        cache.incr(version_key(scope, pk))
+    except ValueError:
+        # Nothing cached for it yet, or evicted
+        cache.add(version_key(scope, pk), new_version(), None)
+
+
+def user_version(user_id):
+    return get_version('user', user_id)
+
+
+def bump_user(user_id):
+    bump('user', user_id)
+
+
+def bump_lists(user_id):
+    bump('lists', user_id)
+
+
+def bump_workouts(workout_ids):
+    for pk in workout_ids:
+        bump('workout', pk)
+
+
+def user_key(user_id, name):
+    return 'workouts:%s:%s:%s' % (user_id, user_version(user_id), name)
+
+
+def get_or_set(user_id, name, compute, timeout=TIMEOUT):
+    """Cached result of compute() for the current version of the user's
+    workouts"""
+    cache = get_cache()
+    key = user_key(user_id, name)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, timeout)
+    return value
+
+
+def page_key(request, workout_pk=None, lists=False):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    name = 'page:%s' % path
+    if workout_pk is not None:
+        name += ':%s' % get_version('workout', workout_pk)
+    if lists:
+        name += ':lists%s' % get_version('lists', request.user.pk)
+    return user_key(request.user.pk, name)
+
+
+def has_pending_messages(request):
+    # len() does not mark the messages as shown
+    return bool(len(messages.get_messages(request)))
+
+
+def cache_user_page(view=None, workout_kwarg=None, lists=False):
+    """Caches the pages a view renders for a signed in user.
+
+    With workout_kwarg the page also depends on the version of the workout
+    whose pk is passed in that URL argument, with lists on the version of
+    the workout summaries. Pages carrying one-off flash messages are neither
+    served from nor stored in the cache.
+    """
+    if view is None:
+        return functools.partial(cache_user_page,
+                                 workout_kwarg=workout_kwarg,
+                                 lists=lists)
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if (request.method != 'GET' or not request.user.is_authenticated
+                or has_pending_messages(request)):
+            count('bypass')
+            return view(request, *args, **kwargs)
+        cache = get_cache()
+        key = page_key(request,
+                       kwargs[workout_kwarg] if workout_kwarg else None,
+                       lists)
+        cached = cache.get(key)
+        if cached is not None:
+            count('hit')
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+        else:
+            count('miss')
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                cache.set(key, (response.content, response['Content-Type']),
+                          TIMEOUT)
+        patch_vary_headers(response, ('Cookie',))
+        patch_cache_control(response, private=True)
+        return response
+
+    return wrapper
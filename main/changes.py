@@ -0,0 +1,125 @@
+"""Change log of the diary for incremental sync of offline clients.
+
+Every workout, exercise and set has at most one Change row, holding the
+sequence number (the row id) of its latest change and whether it was
+deleted. A write replaces the row with a new one, so the log stays as large
+as the diary, and a client that has seen everything up to some sequence
+number asks only for the rows after it (api.views.sync). Deleting a workout
+or an exercise leaves one tombstone for it: clients remove its contents
+along with it.
+
+Sequence numbers are ids, which PostgreSQL hands out when a transaction
+inserts, not when it commits: a client could sync between the commits of
+ids 101 and 100 and never see 100. Writers of one user's log therefore lock
+the user row first, so each gets its ids only after the previous one
+committed. SQLite has a single writer anyway.
+"""
+from django.db import connections, transaction
+from django.db.models import Q
+
+from .models import AdvUser, Change, Exercise, SetDescription
+
+
+def lock_log(user_id, using='default'):
+    """Serializes writes to the user's change log until the transaction
+    ends"""
+    if connections[using].features.has_select_for_update:
+        # NO KEY: rows referencing the user can still be inserted
+        list(
+            AdvUser.objects.using(using).select_for_update(
+                no_key=True).filter(pk=user_id).values_list('pk'))
+
+
+BATCH_SIZE = 500
+
+
+def record(user_id, kind, rows, deleted=False, using='default'):
+    """Replaces the changes of objects of one kind given as (object id,
+    workout id) pairs with new ones"""
+    record_all(user_id, [(kind, pk, workout_id, deleted)
+                         for pk, workout_id in rows], using=using)
+
+
+def record_all(user_id, entries, using='default', new=False):
+    """Replaces the changes of (kind, object id, workout id, deleted)
+    entries with new ones, numbered in the given order, with one DELETE and
+    one INSERT per batch whatever the kinds. `new` objects were just
+    created, so they have no changes to replace."""
+    entries = list(entries)
+    for start in range(0, len(entries), BATCH_SIZE):
+        chunk = entries[start:start + BATCH_SIZE]
+        with transaction.atomic(using=using, savepoint=False):
+            lock_log(user_id, using)
+            if not new:
+                ids = {}
+                for kind, pk, _, _ in chunk:
+                    ids.setdefault(kind, []).append(pk)
+                replaced = Q()
+                for kind, pks in ids.items():
+                    replaced |= Q(kind=kind, object_id__in=pks)
+                Change.objects.using(using).filter(replaced).delete()
+            Change.objects.using(using).bulk_create([
+                Change(user_id=user_id,
+                       kind=kind,
+                       object_id=pk,
+                       workout_id=workout_id,
+                       deleted=deleted)
+                for kind, pk, workout_id, deleted in chunk
+            ])
+
+
+def workouts_changed(user_id, workout_ids, using='default'):
+    """Records whole workouts written in bulk, parents before children"""
+    workout_ids = list(workout_ids)
+    for start in range(0, len(workout_ids), BATCH_SIZE):
+        chunk = workout_ids[start:start + BATCH_SIZE]
+        exercises = Exercise.objects.using(using).filter(
+            workout_id__in=chunk).values_list('pk', 'workout_id')
+        sets = SetDescription.objects.using(using).filter(
+            exercise__workout_id__in=chunk).values_list(
+                'pk', 'exercise__workout_id')
+        record_all(user_id, tree_entries(chunk, exercises, sets),
+                   using=using)
+
+
+def tree_entries(workout_ids, exercises, sets):
+    """Entries of whole workouts for record_all(), parents before children;
+    `exercises` and `sets` are (id, workout id) pairs"""
+    return ([(Change.WORKOUT, pk, pk, False) for pk in workout_ids]
+            + [(Change.EXERCISE, pk, workout_id, False)
+               for pk, workout_id in exercises]
+            + [(Change.SET, pk, workout_id, False)
+               for pk, workout_id in sets])
+
+
+def workouts_deleted(user_id, workout_ids, using='default'):
+    workout_ids = list(workout_ids)
+    with transaction.atomic(using=using, savepoint=False):
+        # Their exercises and sets are covered by the workouts' tombstones
+        Change.objects.using(using).filter(
+            workout_id__in=workout_ids,
+            kind__in=(Change.EXERCISE, Change.SET)).delete()
+        record(user_id, Change.WORKOUT, [(pk, pk) for pk in workout_ids],
+               deleted=True, using=using)
+
+
+def exercise_deleted(user_id, exercise_id, workout_id, using='default'):
+    with transaction.atomic(using=using, savepoint=False):
+        # The exercise's sets may have been deleted without signals; their
+        # rows go, tombstones of sets of other exercises stay
+        Change.objects.using(using).filter(
+            kind=Change.SET, workout_id=workout_id, deleted=False).exclude(
+                object_id__in=SetDescription.objects.using(using).filter(
+                    exercise__workout_id=workout_id).values('pk')).delete()
+        record(user_id, Change.EXERCISE, [(exercise_id, workout_id)],
+               deleted=True, using=using)
+
+
+def since(user_id, sequence, limit, using='default'):
+    """Up to `limit` (sequence, kind, object id, deleted) changes after
+    `sequence`, oldest first, and whether there are more"""
+    rows = list(
+        Change.objects.using(using).filter(
+            user_id=user_id, pk__gt=sequence).order_by('pk').values_list(
+                'pk', 'kind', 'object_id', 'deleted')[:limit + 1])
+    return rows[:limit], len(rows) > limit
@@ -0,0 +1,37 @@
+"""Per-connection database tuning.
+
+SQLITE_PRAGMAS from the settings are applied to every new SQLite
+connection. The defaults suit a few web workers sharing one database file:
+WAL lets readers work while a writer commits, synchronous=NORMAL only
+syncs at checkpoints (safe with WAL, a power loss may lose the last
+transactions but never corrupts the file) and the busy timeout makes a
+writer wait for the lock instead of failing with "database is locked".
+"""
+import re
+
+from django.conf import settings
+
+PRAGMA_NAME = re.compile(r'^[a-z_]+$')
+PRAGMA_VALUE = re.compile(r'^(-?\d+|[A-Za-z_]+)$')
+
+
+def pragma_statements(pragmas):
+    statements = []
+    for name, value in pragmas.items():
+        value = str(value)
+        if not PRAGMA_NAME.match(name) or not PRAGMA_VALUE.match(value):
+            raise ValueError('Invalid SQLite pragma %s = %r' % (name, value))
+        statements.append('PRAGMA %s = %s' % (name, value))
+    return statements
+
+
+def configure_connection(sender, connection, **kwargs):
+    """connection_created receiver"""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    if not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for statement in pragma_statements(pragmas):
+            cursor.execute(statement)
@@ -0,0 +1,130 @@
+"""Set-based deletes of workouts with their exercises and sets.
+
+Django's collector loads every exercise and set and sends signals for each
+of them before deleting, which holds the write lock for as long as that
+takes. Here each level goes in a single DELETE statement inside one
+transaction, and derived data is updated once from the workouts_bulk_deleted
+signal.
+
+Accounts with many workouts are only marked for deletion and deactivated;
+`manage.py purge_deleted_users` removes them later in small transactions
+(ACCOUNT_PURGE_CHUNK workouts each), so other writers get the database in
+between.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import caching, search, stats
+from .apps import workouts_bulk_deleted
+from .models import AdvUser, Exercise, SetDescription, Workout
+from .stats import CONTRIBUTION_FIELDS
+
+OWNER = CONTRIBUTION_FIELDS.index('exercise__workout__owner_id')
+
+
+def raw_delete_tree(workout_ids, using):
+    """Deletes sets, exercises and workouts of `workout_ids` (ids or a
+    values('pk') queryset) with three statements, without signals"""
+    SetDescription.objects.using(using).filter(
+        exercise__workout__in=workout_ids)._raw_delete(using)
+    Exercise.objects.using(using).filter(
+        workout__in=workout_ids)._raw_delete(using)
+    Workout.objects.using(using).filter(pk__in=workout_ids)._raw_delete(using)
+
+
+def delete_workouts(workouts):
+    """Deletes the workouts of a queryset with everything in them"""
+    using = workouts.db
+    with transaction.atomic(using=using):
+        owners, days = {}, {}
+        for pk, owner_id, day in workouts.values_list('pk', 'owner_id',
+                                                      'created_at'):
+            owners.setdefault(owner_id, []).append(pk)
+            days.setdefault(owner_id, set()).add(day)
+        if not owners:
+            return 0
+        ids = [pk for pks in owners.values() for pk in pks]
+        sets = list(
+            SetDescription.objects.using(using).filter(
+                exercise__workout__in=ids).values_list(*CONTRIBUTION_FIELDS))
+        raw_delete_tree(ids, using)
+        for owner_id, pks in owners.items():
+            workouts_bulk_deleted.send(
+                sender=Workout,
+                owner_id=owner_id,
+                workout_ids=pks,
+                days=days[owner_id],
+                sets=[row for row in sets if row[OWNER] == owner_id],
+                using=using)
+    return len(ids)
+
+
+def delete_exercise(exercise):
+    """Deletes an exercise, its sets with one statement"""
+    with transaction.atomic():
+        sets = SetDescription.objects.filter(exercise=exercise)
+        rows = list(sets.values_list(*CONTRIBUTION_FIELDS))
+        sets._raw_delete(sets.db)
+        exercise.delete()
+        stats.sets_deleted(rows)
+
+
+def delete_user_data(user, using='default'):
+    """Removes all workouts of a user with a constant number of statements.
+
+    No workouts_bulk_deleted is sent: the statistics, activity, change log
+    and catalogue rows belong to the user row and go with it, which the
+    caller deletes in the same transaction (AdvUser.delete()).
+    """
+    with transaction.atomic(using=using):
+        search.remove_owner(user.pk, using=using)
+        raw_delete_tree(
+            Workout.objects.using(using).filter(owner=user).values('pk'),
+            using)
+    caching.bump_user(user.pk)
+
+
+def should_defer(user):
+    threshold = getattr(settings, 'ACCOUNT_SOFT_DELETE_WORKOUTS', 500)
+    return Workout.objects.filter(owner=user).count() >= threshold
+
+
+def request_deletion(user):
+    """Deactivates the account at once and leaves the data to
+    purge_deleted_users"""
+    user.is_active = False
+    user.deletion_requested = timezone.now()
+    user.save(update_fields=['is_active', 'deletion_requested'])
+
+
+def purge_user(user, chunk_size=None):
+    """Deletes a user's workouts chunk by chunk, then the user.
+
+    As in delete_user_data() the user's derived rows are not updated per
+    chunk; the account is already deactivated and they cascade with the
+    user row at the end.
+    """
+    if chunk_size is None:
+        chunk_size = getattr(settings, 'ACCOUNT_PURGE_CHUNK', 200)
+    using = user._state.db or 'default'
+    while True:
+        with transaction.atomic(using=using):
+            ids = list(
+                Workout.objects.using(using).filter(owner=user).values_list(
+                    'pk', flat=True)[:chunk_size])
+            if not ids:
+                break
+            search.remove_workouts(ids, using)
+            raw_delete_tree(ids, using)
+    user.delete(using=using)
+
+
+def purge_deleted_users(chunk_size=None):
+    """Purges every account marked for deletion, returns their number"""
+    users = AdvUser.objects.filter(deletion_requested__isnull=False)
+    count = 0
+    for user in users.iterator():
+        purge_user(user, chunk_size)
+        count += 1
+    return count
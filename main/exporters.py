@@ -0,0 +1,57 @@
+"""Streaming export of a user's whole diary.
+
+Rows come from one LEFT JOINed values_list() query read with iterator(),
+so neither model instances nor the full result are ever held in memory.
+The columns are the ones main.importers reads, so an export can be
+imported back.
+"""
+import csv
+import json
+
+from .importers import COLUMNS
+from .models import Workout
+
+EXPORT_FIELDS = ('created_at', 'name', 'comment', 'exercise__name',
+                 'exercise__setdescription__number',
+                 'exercise__setdescription__weight',
+                 'exercise__setdescription__repeats')
+
+CHUNK_SIZE = 2000
+
+
+def diary_rows(owner):
+    """One tuple per set; exercises without sets and workouts without
+    exercises come with empty set (and exercise) columns"""
+    return Workout.objects.filter(owner=owner).order_by(
+        'created_at', 'pk', 'exercise__pk', 'exercise__setdescription__number',
+        'exercise__setdescription__pk').values_list(
+            *EXPORT_FIELDS).iterator(chunk_size=CHUNK_SIZE)
+
+
+class Echo:
+    """File-like object handing back what csv.writer writes to it"""
+    def write(self, value):
+        return value
+
+
+def csv_lines(owner):
+    writer = csv.writer(Echo())
+    yield writer.writerow(COLUMNS)
+    for row in diary_rows(owner):
+        yield writer.writerow(['' if value is None else value
+                               for value in row])
+
+
+def ndjson_lines(owner):
+    for row in diary_rows(owner):
+        record = dict(zip(COLUMNS, row))
+        record['date'] = record['date'].isoformat()
+        if record['weight'] is not None:
+            record['weight'] = str(record['weight'])
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+FORMATS = {
+    'csv': (csv_lines, 'text/csv; charset=utf-8'),
+    'ndjson': (ndjson_lines, 'application/x-ndjson; charset=utf-8'),
+}
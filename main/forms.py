@@ -1,10 +1,10 @@
 from django import forms
 from django.contrib.auth import password_validation
 from django.core.exceptions import ValidationError
-from django.forms.models import inlineformset_factory
-from extra_views.advanced import InlineFormSetFactory
+from django.forms.models import BaseInlineFormSet, inlineformset_factory
 
 from .apps import user_registered
+from . import batch
 
 from .models import AdvUser, Exercise, SetDescription, Workout
 
@@ -74,36 +74,124 @@ class DateTimeInput(forms.DateTimeInput):
 class WorkoutForm(forms.ModelForm):
     class Meta:
         model = Workout
-        exclude = ('sportsman_name', )
+        exclude = ('owner', )
         widgets = {'created_at': DateTimeInput()}
 
 
-class SetDescriptionFormInline(InlineFormSetFactory):
-    model = SetDescription
-    fields = ('__all__')
-    factory_kwargs = {'extra': 5}
-
-
 class SetDescriptionForm(forms.ModelForm):
     class Meta:
         model = SetDescription
         fields = ('__all__')
 
 
-SetDescriptionFormSet = inlineformset_factory(Exercise,
-                                              SetDescription,
-                                              form=SetDescriptionForm,
-                                              extra=5)
+class BulkSetDescriptionFormSet(BaseInlineFormSet):
+    """Set formset saving all its rows with one query per operation.
+
+    Extra forms the user left empty never reach validation (Django skips
+    unchanged extra forms) and are not saved; the filled ones are inserted
+    with one bulk_create, the changed initial ones updated with one
+    bulk_update and the ones marked for deletion removed with one DELETE,
+    by batch.save_sets() inside a single transaction.
+    """
+    def filled_forms(self):
+        """Valid forms that create or change an object, and forms that
+        delete one"""
+        for i, form in enumerate(self.forms):
+            if self.can_delete and self._should_delete_form(form):
+                if i < self.initial_form_count():
+                    yield form
+            elif form.has_changed():
+                yield form
 
-
-class ExerciseInline(InlineFormSetFactory):
-    model = Exercise
-    fields = ['name']
-    factory_kwargs = {'extra': 6, 'can_delete': False}
+    def save(self, commit=True):
+        if not commit:
+            return super().save(commit=False)
+        created, updated, deleted, fields = [], [], [], set()
+        for form in self.filled_forms():
+            obj = form.instance
+            if self.can_delete and self._should_delete_form(form):
+                deleted.append(obj)
+            elif obj.pk is None:
+                obj = form.save(commit=False)
+                setattr(obj, self.fk.name, self.instance)
+                created.append(obj)
+            else:
+                updated.append(form.save(commit=False))
+                fields.update(form.changed_data)
+        self.new_objects, self.deleted_objects = created, deleted
+        self.changed_objects = [(obj, list(fields)) for obj in updated]
+        batch.save_sets(self.instance, created, updated, sorted(fields),
+                        deleted)
+        return created + updated
+
+    def trees(self):
+        """Field dicts of the filled forms for batch.create_workouts()"""
+        sets = []
+        for form in self.filled_forms():
+            if not (self.can_delete and self._should_delete_form(form)):
+                sets.append({
+                    name: form.cleaned_data[name]
+                    for name in ('number', 'weight', 'repeats')
+                })
+        return sets
+
+
+SetDescriptionFormSet = inlineformset_factory(
+    Exercise,
+    SetDescription,
+    form=SetDescriptionForm,
+    formset=BulkSetDescriptionFormSet,
+    extra=5)
+
+
+class NestedExerciseFormSet(BaseInlineFormSet):
+    """Exercises of a new workout, each form with its own set formset
+    (form.sets, prefixed with the form's prefix).
+
+    A nested formset whose management form wasn't posted counts as empty,
+    so a page may send exercises only.
+    """
+    def add_fields(self, form, index):
+        super().add_fields(form, index)
+        prefix = '%s-sets' % form.prefix
+        data = self.data if ('%s-TOTAL_FORMS' % prefix) in self.data else None
+        form.sets = SetDescriptionFormSet(data,
+                                          instance=form.instance,
+                                          prefix=prefix)
+
+    def is_valid(self):
+        valid = super().is_valid()
+        for form in self.forms:
+            if form.sets.is_bound:
+                if form.has_changed():
+                    valid = form.sets.is_valid() and valid
+                elif form.sets.has_changed():
+                    form.add_error('name', 'Укажите упражнение')
+                    valid = False
+        return valid
+
+    def trees(self):
+        """Field dicts of the filled exercise forms with their sets"""
+        exercises = []
+        for form in self.forms:
+            if form.has_changed():
+                exercises.append({
+                    'name': form.cleaned_data['name'],
+                    'sets': form.sets.trees() if form.sets.is_bound else [],
+                })
+        return exercises
+
+
+ExerciseFormSet = inlineformset_factory(Workout,
+                                        Exercise,
+                                        fields=('name', ),
+                                        formset=NestedExerciseFormSet,
+                                        extra=6,
+                                        can_delete=False)
 
 
 class SearchForm(forms.Form):
     keyword = forms.CharField(required=False,
                               max_length=20,
                               label='',
-                              help_text='Будьте внимательны, регистр важен')
+                              help_text='Название, комментарий или упражнение')
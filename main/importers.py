@@ -0,0 +1,233 @@
+"""Bulk import of training logs from CSV or newline-delimited JSON.
+
+Every input row describes one set:
+
+    date, workout, comment, exercise, number, weight, repeats
+
+Consecutive rows with the same date, workout name and comment belong to one
+workout, consecutive rows with the same exercise name to one exercise. A row
+with empty set columns adds the exercise (or, with an empty exercise, the
+workout) without sets. The input is read line by line and written in chunks
+with bulk_create, each chunk in its own transaction, so memory use does not
+depend on the size of the file.
+"""
+import codecs
+import csv
+import functools
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .apps import workouts_bulk_changed
+from .models import Exercise, SetDescription, Workout
+from .movements import resolve as resolve_movements
+from .utilities import bulk_create_with_pks
+
+COLUMNS = ('date', 'workout', 'comment', 'exercise', 'number', 'weight',
+           'repeats')
+
+MAX_REPORTED_ERRORS = 1000
+
+# Skips the byte order mark of Excel exports
+ENCODING = 'utf-8-sig'
+
+
+class RowError(Exception):
+    pass
+
+
+class ImportReport:
+    def __init__(self):
+        self.workouts = 0
+        self.exercises = 0
+        self.sets = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def as_dict(self):
+        return {
+            'workouts': self.workouts,
+            'exercises': self.exercises,
+            'sets': self.sets,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+
+def check_encoding(chunks):
+    """Raises UnicodeDecodeError unless the byte chunks are ENCODING text.
+
+    Rows are written as they are read, so a file has to be checked before
+    its import rather than fail halfway through it.
+    """
+    decoder = codecs.getincrementaldecoder(ENCODING)()
+    for chunk in chunks:
+        decoder.decode(chunk)
+    decoder.decode(b'', final=True)
+
+
+def csv_rows(lines):
+    """(line number, row dict) pairs of a CSV file with a header line"""
+    reader = csv.DictReader(lines)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def ndjson_rows(lines):
+    """(line number, row dict) pairs of a file with one JSON object a line"""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield number, RowError('Invalid JSON: %s' % error)
+            continue
+        if not isinstance(row, dict):
+            yield number, RowError('Expected a JSON object')
+            continue
+        yield number, row
+
+
+PARSERS = {'csv': csv_rows, 'ndjson': ndjson_rows, 'jsonl': ndjson_rows}
+
+
+@functools.lru_cache(maxsize=4096)
+def clean_value(model, name, value):
+    # Logs repeat the same dates, names and weights on many lines, so
+    # validated values are memoized
+    return model._meta.get_field(name).clean(value, None)
+
+
+def clean_field(model, name, value, label):
+    if isinstance(value, str):
+        value = value.strip()
+    if value is None:
+        value = ''
+    if not isinstance(value, (str, int, float)):
+        value = str(value)
+    try:
+        return clean_value(model, name, value)
+    except ValidationError as error:
+        raise RowError('%s: %s' % (label, ' '.join(error.messages)))
+
+
+def clean_row(row):
+    """Validates one row against the model fields, returns a tuple
+    (workout key, exercise name, set values or None)"""
+    def raw(name):
+        value = row.get(name)
+        return '' if value is None else value
+
+    day = clean_field(Workout, 'created_at', raw('date'), 'date')
+    name = clean_field(Workout, 'name', raw('workout'), 'workout')
+    comment = str(raw('comment')).strip() or None
+    exercise = str(raw('exercise')).strip()
+    set_values = [raw(column) for column in ('number', 'weight', 'repeats')]
+    if not any(str(value).strip() for value in set_values):
+        if exercise:
+            exercise = clean_field(Exercise, 'name', exercise, 'exercise')
+        return (day, name, comment), exercise or None, None
+    exercise = clean_field(Exercise, 'name', exercise, 'exercise')
+    number = clean_field(SetDescription, 'number', set_values[0], 'number')
+    weight = clean_field(SetDescription, 'weight', set_values[1], 'weight')
+    repeats = set_values[2]
+    repeats = clean_field(SetDescription, 'repeats',
+                          0 if str(repeats).strip() == '' else repeats,
+                          'repeats')
+    return (day, name, comment), exercise, (number, weight, repeats)
+
+
+class Importer:
+    """Streams rows into the database for one owner"""
+    def __init__(self, owner, chunk_size=2000, using='default'):
+        self.owner = owner
+        self.chunk_size = chunk_size
+        self.using = using
+        self.report = ImportReport()
+        self.workout_ids = []
+        self.pending = []  # [(workout, [(exercise, [set, ...]), ...]), ...]
+        self.pending_rows = 0
+        self.last_key = None
+
+    def run(self, rows):
+        try:
+            for line, row in rows:
+                try:
+                    if isinstance(row, RowError):
+                        raise row
+                    self.add(*clean_row(row))
+                except RowError as error:
+                    self.report.add_error(line, str(error))
+        finally:
+            self.flush()
+            if self.workout_ids:
+                workouts_bulk_changed.send(sender=Workout,
+                                           owner_id=self.owner.pk,
+                                           workout_ids=self.workout_ids,
+                                           using=self.using)
+        return self.report
+
+    def add(self, key, exercise_name, set_values):
+        if key != self.last_key:
+            # Chunks end on workout boundaries only
+            if self.pending_rows >= self.chunk_size:
+                self.flush()
+            day, name, comment = key
+            self.pending.append((Workout(owner=self.owner,
+                                         created_at=day,
+                                         name=name,
+                                         comment=comment), []))
+            self.last_key = key
+        exercises = self.pending[-1][1]
+        if exercise_name is not None and (not exercises or
+                                          exercises[-1][0].name !=
+                                          exercise_name):
+            exercises.append((Exercise(name=exercise_name), []))
+        if set_values is not None:
+            number, weight, repeats = set_values
+            exercises[-1][1].append(
+                SetDescription(number=number, weight=weight, repeats=repeats))
+        self.pending_rows += 1
+
+    def flush(self):
+        if not self.pending:
+            return
+        with transaction.atomic(using=self.using):
+            workouts = bulk_create_with_pks(
+                Workout, [workout for workout, _ in self.pending], self.using)
+            exercises = []
+            for workout, children in self.pending:
+                for exercise, _ in children:
+                    exercise.workout_id = workout.pk
+                    exercises.append(exercise)
+            movement_ids = resolve_movements(
+                self.owner.pk, {exercise.name for exercise in exercises},
+                self.using)
+            for exercise in exercises:
+                exercise.movement_id = movement_ids[exercise.name]
+            bulk_create_with_pks(Exercise, exercises, self.using)
+            sets = []
+            for _, children in self.pending:
+                for exercise, exercise_sets in children:
+                    for set_description in exercise_sets:
+                        set_description.exercise_id = exercise.pk
+                        sets.append(set_description)
+            SetDescription.objects.using(self.using).bulk_create(sets)
+        self.workout_ids.extend(workout.pk for workout in workouts)
+        self.report.workouts += len(workouts)
+        self.report.exercises += len(exercises)
+        self.report.sets += len(sets)
+        self.pending = []
+        self.pending_rows = 0
+
+
+def import_rows(owner, lines, format='csv', chunk_size=2000):
+    """Imports text `lines` in the given format, returns an ImportReport"""
+    return Importer(owner, chunk_size).run(PARSERS[format](lines))
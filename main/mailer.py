@@ -0,0 +1,84 @@
+"""Outbox worker: sends queued letters over one pooled SMTP connection.
+
+Run it with `manage.py send_queued_mail`. A letter that fails is retried
+with exponential backoff (MAILER_RETRY_DELAY seconds, doubled on every
+attempt) until MAILER_MAX_ATTEMPTS is reached and it is marked as failed.
+"""
+import datetime
+import logging
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+
+from .models import Letter
+
+logger = logging.getLogger(__name__)
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def due_letters(batch_size):
+    return list(
+        Letter.objects.filter(status=Letter.PENDING,
+                              next_attempt_at__lte=timezone.now()).order_by(
+                                  'next_attempt_at', 'pk')[:batch_size])
+
+
+def retry_later(letter, error, now):
+    max_attempts = get_setting('MAILER_MAX_ATTEMPTS', 5)
+    retry_delay = get_setting('MAILER_RETRY_DELAY', 60)
+    letter.attempts += 1
+    letter.last_error = str(error)
+    if letter.attempts >= max_attempts:
+        letter.status = Letter.FAILED
+    else:
+        delay = retry_delay * 2**(letter.attempts - 1)
+        letter.next_attempt_at = now + datetime.timedelta(seconds=delay)
+
+
+def send_queued(batch_size=None, connection=None):
+    """Sends one batch of due letters, returns (sent, failed) counts"""
+    if batch_size is None:
+        batch_size = get_setting('MAILER_BATCH_SIZE', 100)
+    letters = due_letters(batch_size)
+    if not letters:
+        return 0, 0
+    connection = connection or get_connection()
+    now = timezone.now()
+    sent = failed = 0
+    try:
+        connection.open()
+    except Exception as error:
+        logger.warning('Mail server unavailable: %s', error)
+        for letter in letters:
+            retry_later(letter, error, now)
+        failed = len(letters)
+    else:
+        try:
+            for letter in letters:
+                message = EmailMessage(letter.subject,
+                                       letter.body,
+                                       settings.DEFAULT_FROM_EMAIL,
+                                       [letter.recipient],
+                                       connection=connection)
+                try:
+                    message.send()
+                except Exception as error:
+                    logger.warning('Letter %s not sent: %s', letter.pk, error)
+                    retry_later(letter, error, now)
+                    failed += 1
+                else:
+                    letter.status = Letter.SENT
+                    letter.sent_at = timezone.now()
+                    letter.attempts += 1
+                    letter.last_error = ''
+                    sent += 1
+        finally:
+            connection.close()
+    Letter.objects.bulk_update(letters, [
+        'status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at'
+    ])
+    return sent, failed
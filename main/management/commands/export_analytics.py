@@ -0,0 +1,33 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.analytics import progress_report
+from main.models import AdvUser
+
+
+class Command(BaseCommand):
+    help = "Prints a user's volume and e1RM progress arrays as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--window',
+                            type=int,
+                            default=7,
+                            help='Rolling volume window in days')
+        parser.add_argument('--output', help='File to write instead of stdout')
+
+    def handle(self, *args, **options):
+        if options['window'] < 1:
+            raise CommandError('--window must be a positive number of days')
+        try:
+            user = AdvUser.objects.get(username=options['username'])
+        except AdvUser.DoesNotExist:
+            raise CommandError('No such user: %s' % options['username'])
+        report = progress_report(user.pk, options['window'])
+        data = json.dumps(report, ensure_ascii=False, separators=(',', ':'))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                output.write(data)
+        else:
+            self.stdout.write(data)
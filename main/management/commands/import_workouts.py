@@ -0,0 +1,39 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.importers import (ENCODING, PARSERS, check_encoding,
+                            import_rows)
+from main.models import AdvUser
+
+
+class Command(BaseCommand):
+    help = 'Imports a training log from a CSV or newline-delimited JSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('path')
+        parser.add_argument('--format',
+                            choices=sorted(PARSERS),
+                            help='Taken from the file extension by default')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        try:
+            user = AdvUser.objects.get(username=options['username'])
+        except AdvUser.DoesNotExist:
+            raise CommandError('No such user: %s' % options['username'])
+        format = options['format'] or os.path.splitext(
+            options['path'])[1].lstrip('.').lower()
+        if format not in PARSERS:
+            raise CommandError('Unknown format, use --format')
+        with open(options['path'], 'rb') as file:
+            try:
+                check_encoding(file)
+            except UnicodeDecodeError as error:
+                raise CommandError('The file is not UTF-8 text: %s' % error)
+        with open(options['path'], encoding=ENCODING, newline='') as lines:
+            report = import_rows(user, lines, format, options['chunk_size'])
+        self.stdout.write(
+            json.dumps(report.as_dict(), ensure_ascii=False, indent=2))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.deletion import purge_deleted_users
+
+
+class Command(BaseCommand):
+    help = 'Deletes the data of accounts marked for deletion'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size',
+                            type=int,
+                            default=None,
+                            help='Workouts deleted per transaction')
+        parser.add_argument('--loop',
+                            action='store_true',
+                            help='Keep polling instead of exiting')
+        parser.add_argument('--interval',
+                            type=float,
+                            default=60,
+                            help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            purged = purge_deleted_users(options['chunk_size'])
+            if purged:
+                self.stdout.write('Purged accounts: %d' % purged)
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from main.activity import rebuild_user
+from main.models import AdvUser
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the daily activity of the training calendar from ' \
+           'the workout summaries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames',
+                            nargs='*',
+                            help='Only these users (all users by default)')
+
+    def handle(self, *args, **options):
+        users = AdvUser.objects.order_by('pk')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+        count = 0
+        for user_id in users.values_list('pk', flat=True).iterator():
+            rebuild_user(user_id)
+            count += 1
+        self.stdout.write(
+            self.style.SUCCESS('Activity rebuilt for %d users' % count))
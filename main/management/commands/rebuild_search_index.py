@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from main.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text workout search index from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if connections[using].vendor != 'sqlite':
+            raise CommandError('The search index needs SQLite with FTS5')
+        rebuild_index(using=using)
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from main.models import AdvUser
+from main.stats import rebuild_user
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the training statistics from the set history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames',
+                            nargs='*',
+                            help='Only these users (all users by default)')
+
+    def handle(self, *args, **options):
+        users = AdvUser.objects.order_by('pk')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+        count = 0
+        for user_id in users.values_list('pk', flat=True).iterator():
+            rebuild_user(user_id)
+            count += 1
+        self.stdout.write(
+            self.style.SUCCESS('Statistics rebuilt for %d users' % count))
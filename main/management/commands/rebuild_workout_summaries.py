@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from main.summaries import BATCH_SIZE, rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the exercise and set counts, tonnage and top weight ' \
+           'of every workout'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size',
+                            type=int,
+                            default=BATCH_SIZE,
+                            help='Workouts updated per transaction')
+
+    def handle(self, *args, **options):
+        count = rebuild(options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS('Summaries rebuilt for %d workouts' % count))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.mailer import send_queued
+
+
+class Command(BaseCommand):
+    help = 'Sends letters waiting in the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--loop',
+                            action='store_true',
+                            help='Keep polling the outbox instead of exiting')
+        parser.add_argument('--interval',
+                            type=float,
+                            default=5,
+                            help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            while True:
+                sent, failed = send_queued(options['batch_size'])
+                if sent or failed:
+                    self.stdout.write('Sent: %d, failed: %d' % (sent, failed))
+                if not sent:
+                    break
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -1,21 +1,176 @@
+import asyncio
+import random
+import time
+
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject, cached_property
+
+from . import caching
 from .models import Workout
+from .profiling import QueryRecorder, get_setting, profiler, recording
+from .routers import STICKY_COOKIE, new_state, request_state
+
+RECENT_WORKOUTS = 5
+
+
+class UserWorkouts:
+    """The current user's workouts as seen by templates.
+
+    Nothing is queried until a template reads an attribute, each attribute
+    is computed at most once per request and is shared between requests
+    through the per-user cache.
+    """
+    def __init__(self, user):
+        self.user_id = user.pk if user.is_authenticated else None
+
+    @cached_property
+    def count(self):
+        if self.user_id is None:
+            return 0
+        return caching.get_or_set(
+            self.user_id, 'count',
+            Workout.objects.filter(owner_id=self.user_id).count)
+
+    @cached_property
+    def recent(self):
+        """(pk, name, created_at) of the latest workouts"""
+        if self.user_id is None:
+            return []
+
+        def compute():
+            return list(
+                Workout.objects.filter(owner_id=self.user_id).order_by(
+                    '-created_at', '-id').values_list(
+                        'pk', 'name', 'created_at')[:RECENT_WORKOUTS])
+
+        return caching.get_or_set(self.user_id, 'recent', compute)
+
+
+def query_fragments(request):
+    """?keyword=...&cursor=... of the current request for links back to it"""
+    keyword = request.GET.get('keyword', '')
+    cursor = request.GET.get('cursor', '')
+    fragments = {'keyword': '', 'all': ''}
+    if keyword:
+        fragments['keyword'] = '?keyword=' + keyword
+        fragments['all'] = fragments['keyword']
+    if cursor:
+        if fragments['all']:
+            fragments['all'] += '&cursor=' + cursor
+        else:
+            fragments['all'] = '?cursor=' + cursor
+    return fragments
+
 
 def workout_context_proccessor(request):
-    context = {}
-    context['workouts'] = Workout.objects.filter(sportsman_name=request.user.pk)
-    context['keyword'] = ''
-    context['all'] = ''
-    if 'keyword' in request.GET:
-        keyword = request.GET['keyword']
-        if keyword:
-            context['keyword'] = '?keyword=' + keyword
-            context['all'] = context['keyword']
-    if 'page' in request.GET:
-        page = request.GET['page']
-        if page != '1':
-            if context['all']:
-                context['all'] += '&page=' + page
-            else:
-                context['all'] = '?page=' + page
-    return context
+    # Installed for every template, so nothing here may touch the database
+    # or do work up front: the values are evaluated on first use
+    fragments = SimpleLazyObject(lambda: query_fragments(request))
+    return {
+        'user_workouts': SimpleLazyObject(lambda: UserWorkouts(request.user)),
+        'keyword': SimpleLazyObject(lambda: fragments['keyword']),
+        'all': SimpleLazyObject(lambda: fragments['all']),
+    }
+
+
+class AsyncCapableMiddleware:
+    """Runs in the mode of the handler: under ASGI, __call__ returns the
+    coroutine of __acall__, so a request doesn't hold the single thread
+    sync_to_async(thread_sensitive=True) gives sync middleware"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Mark the instance as a coroutine function, like
+            # django.utils.deprecation.MiddlewareMixin
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return self.call(request)
+
+
+class ProfilingMiddleware(AsyncCapableMiddleware):
+    """Records wall time and SQL queries of a sample of requests per URL
+    name, see main.profiling"""
+    @staticmethod
+    def sampled():
+        rate = get_setting('PROFILING_SAMPLE_RATE', 0)
+        return rate and random.random() < rate
+
+    def call(self, request):
+        if not self.sampled():
+            return self.get_response(request)
+        recorder = QueryRecorder()
+        token = recording.set(recorder)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            recording.reset(token)
+        self.record(request, time.perf_counter() - start, recorder)
+        return response
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+        recorder = QueryRecorder()
+        token = recording.set(recorder)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            recording.reset(token)
+        self.record(request, time.perf_counter() - start, recorder)
+        return response
+
+    def record(self, request, wall, recorder):
+        match = request.resolver_match
+        name = match.view_name if match else 'unresolved'
+        profiler.record(name, wall, recorder)
+
+
+class ReplicaRoutingMiddleware(AsyncCapableMiddleware):
+    """Lets GET requests to REPLICA_READ_VIEWS read from the replica and
+    keeps clients that just wrote something on the primary, see
+    main.routers"""
+    def call(self, request):
+        state = new_state()
+        token = request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_state.reset(token)
+        return self.stick(request, state, response)
+
+    async def __acall__(self, request):
+        state = new_state()
+        token = request_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_state.reset(token)
+        return self.stick(request, state, response)
+
+    def stick(self, request, state, response):
+        # Writes to an explicitly chosen alias bypass the router, so any
+        # unsafe request counts as one
+        if state['wrote'] or request.method not in ('GET', 'HEAD',
+                                                    'OPTIONS'):
+            response.set_cookie(STICKY_COOKIE,
+                                '1',
+                                max_age=settings.REPLICA_STICKY_SECONDS,
+                                httponly=True,
+                                samesite='Lax')
+        return response
 
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = request_state.get(None)
+        if (state is not None and request.method in ('GET', 'HEAD')
+                and STICKY_COOKIE not in request.COOKIES
+                and request.resolver_match.view_name
+                in settings.REPLICA_READ_VIEWS):
+            state['replica'] = True
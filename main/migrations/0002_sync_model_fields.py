@@ -0,0 +1,38 @@
+# Generated by Django 3.2.9 on 2026-10-18 15:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='advuser',
+            name='is_activated',
+            field=models.BooleanField(default=True, verbose_name='Прошел активацию?'),
+        ),
+        migrations.AlterField(
+            model_name='exercise',
+            name='name',
+            field=models.CharField(db_index=True, max_length=150, verbose_name=''),
+        ),
+        migrations.AlterField(
+            model_name='setdescription',
+            name='number',
+            field=models.PositiveSmallIntegerField(db_index=True, verbose_name='№ подхода'),
+        ),
+        migrations.AlterField(
+            model_name='setdescription',
+            name='weight',
+            field=models.DecimalField(decimal_places=1, max_digits=3, verbose_name='Вес'),
+        ),
+        migrations.AlterField(
+            model_name='workout',
+            name='created_at',
+            field=models.DateField(db_index=True, verbose_name='Дата тренировки'),
+        ),
+    ]
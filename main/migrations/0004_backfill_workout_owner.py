@@ -0,0 +1,91 @@
+"""Fills Workout.owner from the old sportsman_name string.
+
+sportsman_name held either the username (CreateWorkoutView stored
+str(request.user)) or, for some rows, the user's pk. Rows are processed in
+short pk-ordered batches, each in its own transaction, so the table is never
+write-locked for the whole run.
+
+The owner column becomes mandatory in the next migration, so a workout whose
+sportsman_name matches no user stops the migration with a list of them: the
+missing users can be created before migrating again. With
+DELETE_ORPHAN_WORKOUTS=1 in the environment those workouts, which no view
+could reach, are deleted instead.
+"""
+import os
+
+from django.db import migrations, transaction
+
+BATCH_SIZE = 500
+
+
+def backfill_owner(apps, schema_editor):
+    AdvUser = apps.get_model('main', 'AdvUser')
+    Workout = apps.get_model('main', 'Workout')
+    db = schema_editor.connection.alias
+    by_username = dict(AdvUser.objects.using(db).values_list('username', 'pk'))
+    pks = set(by_username.values())
+    delete_orphans = os.environ.get('DELETE_ORPHAN_WORKOUTS', '') in ('1',
+                                                                    'true')
+    orphans = {}
+
+    last_pk = 0
+    while True:
+        with transaction.atomic(using=db):
+            batch = list(
+                Workout.objects.using(db).filter(pk__gt=last_pk).order_by(
+                    'pk').only('pk', 'sportsman_name')[:BATCH_SIZE])
+            if not batch:
+                break
+            matched, unmatched = [], []
+            for workout in batch:
+                name = workout.sportsman_name
+                owner_id = by_username.get(name)
+                if owner_id is None and name.isdigit() and int(name) in pks:
+                    owner_id = int(name)
+                if owner_id is None:
+                    unmatched.append(workout.pk)
+                    orphans[workout.pk] = name
+                else:
+                    workout.owner_id = owner_id
+                    matched.append(workout)
+            Workout.objects.using(db).bulk_update(matched, ['owner'])
+            if unmatched and delete_orphans:
+                Workout.objects.using(db).filter(pk__in=unmatched).delete()
+            last_pk = batch[-1].pk
+    if orphans and not delete_orphans:
+        raise RuntimeError(
+            '%d workouts have a sportsman_name that matches no user: %s. '
+            'Create those users and migrate again, or set '
+            'DELETE_ORPHAN_WORKOUTS=1 to delete the workouts.' %
+            (len(orphans), ', '.join(
+                'id %s (%r)' % item for item in sorted(orphans.items()))))
+
+
+def restore_sportsman_name(apps, schema_editor):
+    Workout = apps.get_model('main', 'Workout')
+    db = schema_editor.connection.alias
+    last_pk = 0
+    while True:
+        with transaction.atomic(using=db):
+            batch = list(
+                Workout.objects.using(db).filter(pk__gt=last_pk).order_by(
+                    'pk').select_related('owner')[:BATCH_SIZE])
+            if not batch:
+                break
+            for workout in batch:
+                workout.sportsman_name = workout.owner.username
+            Workout.objects.using(db).bulk_update(batch, ['sportsman_name'])
+            last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('main', '0003_workout_owner'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_owner, restore_sportsman_name),
+    ]
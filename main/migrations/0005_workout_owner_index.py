@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_backfill_workout_owner'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='workout',
+            name='sportsman_name',
+        ),
+        migrations.AlterField(
+            model_name='workout',
+            name='owner',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Спортсмен'),
+        ),
+        migrations.AddIndex(
+            model_name='workout',
+            index=models.Index(fields=['owner', '-created_at', '-id'], name='workout_owner_created_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+"""FTS5 index over workout names, comments and exercise names.
+
+Only created on SQLite builds that ship FTS5; elsewhere main.search falls
+back to LIKE lookups.
+"""
+from django.db import migrations, OperationalError
+
+FTS_TABLE = 'main_workout_fts'
+
+NORMALIZE = "replace(replace({}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def create_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE %s USING fts5(name, comment, exercises, "
+                "tokenize='unicode61 remove_diacritics 2')" % FTS_TABLE)
+        except OperationalError:
+            return
+        cursor.execute(
+            'INSERT INTO {table} (rowid, name, comment, exercises) '
+            'SELECT w.id, {name}, {comment}, '
+            '(SELECT group_concat({exercise}, \' \') FROM main_exercise e '
+            'WHERE e.workout_id = w.id) FROM main_workout w'.format(
+                table=FTS_TABLE,
+                name=NORMALIZE.format('w.name'),
+                comment=NORMALIZE.format("coalesce(w.comment, '')"),
+                exercise=NORMALIZE.format('e.name')))
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS %s' % FTS_TABLE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_workout_owner_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
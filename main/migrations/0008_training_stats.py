@@ -0,0 +1,59 @@
+# Generated by Django 3.2.9 on 2026-10-18 15:20
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_letter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeeklyTonnage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('week', models.DateField(verbose_name='Неделя')),
+                ('set_count', models.PositiveIntegerField(default=0, verbose_name='Подходов')),
+                ('volume', models.DecimalField(decimal_places=1, default=0, max_digits=14, verbose_name='Тоннаж')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Спортсмен')),
+            ],
+            options={
+                'verbose_name': 'Недельный тоннаж',
+                'verbose_name_plural': 'Недельный тоннаж',
+                'ordering': ['-week'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ExerciseStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('exercise_key', models.CharField(max_length=150, verbose_name='Ключ упражнения')),
+                ('name', models.CharField(max_length=150, verbose_name='Упражнение')),
+                ('set_count', models.PositiveIntegerField(default=0, verbose_name='Подходов')),
+                ('total_repeats', models.PositiveIntegerField(default=0, verbose_name='Повторений')),
+                ('total_volume', models.DecimalField(decimal_places=1, default=0, max_digits=14, verbose_name='Тоннаж')),
+                ('best_weight', models.DecimalField(decimal_places=1, default=0, max_digits=3, verbose_name='Рекордный вес')),
+                ('best_weight_at', models.DateField(blank=True, null=True, verbose_name='Дата рекорда веса')),
+                ('best_e1rm', models.DecimalField(decimal_places=1, default=0, max_digits=6, verbose_name='Расчетный максимум')),
+                ('best_e1rm_at', models.DateField(blank=True, null=True, verbose_name='Дата рекорда максимума')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Спортсмен')),
+            ],
+            options={
+                'verbose_name': 'Статистика упражнения',
+                'verbose_name_plural': 'Статистика упражнений',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='weeklytonnage',
+            constraint=models.UniqueConstraint(fields=('user', 'week'), name='weeklytonnage_user_week_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='exercisestats',
+            constraint=models.UniqueConstraint(fields=('user', 'exercise_key'), name='exercisestats_user_key_uniq'),
+        ),
+    ]
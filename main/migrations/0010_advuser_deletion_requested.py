@@ -0,0 +1,18 @@
+# Generated by Django 3.2.9 on 2026-10-18 15:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_workout_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='advuser',
+            name='deletion_requested',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Удаление запрошено'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 3.2.9 on 2026-10-18 15:47
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_advuser_deletion_requested'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Movement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=150, verbose_name='Название')),
+            ],
+            options={
+                'verbose_name': 'Движение',
+                'verbose_name_plural': 'Движения',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MovementAlias',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=150, verbose_name='Написание')),
+            ],
+            options={
+                'verbose_name': 'Синоним движения',
+                'verbose_name_plural': 'Синонимы движений',
+            },
+        ),
+        migrations.AddField(
+            model_name='movementalias',
+            name='movement',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aliases', to='main.movement', verbose_name='Движение'),
+        ),
+        migrations.AddField(
+            model_name='movementalias',
+            name='owner',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Спортсмен'),
+        ),
+        migrations.AddField(
+            model_name='movement',
+            name='owner',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Спортсмен'),
+        ),
+        migrations.AddField(
+            model_name='exercise',
+            name='movement',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='main.movement', verbose_name='Движение'),
+        ),
+        migrations.AddIndex(
+            model_name='exercise',
+            index=models.Index(fields=['movement', 'workout'], name='exercise_movement_workout_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='movementalias',
+            constraint=models.UniqueConstraint(fields=('owner', 'key'), name='movementalias_owner_key_uniq'),
+        ),
+    ]
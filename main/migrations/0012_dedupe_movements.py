@@ -0,0 +1,59 @@
+"""Builds every user's movement catalogue from their exercise names.
+
+Spellings that differ only in case, "ё" and spacing become one movement,
+named after its most frequent spelling. Users are processed one at a time,
+each in its own transaction.
+"""
+import re
+from collections import Counter
+
+from django.db import migrations, transaction
+from django.db.models import Count
+
+
+def exercise_key(name):
+    # main.stats.exercise_key() as of this migration
+    return re.sub(r'\s+', ' ', name.casefold().replace('ё', 'е')).strip()
+
+
+def build_catalogue(apps, schema_editor):
+    AdvUser = apps.get_model('main', 'AdvUser')
+    Exercise = apps.get_model('main', 'Exercise')
+    Movement = apps.get_model('main', 'Movement')
+    MovementAlias = apps.get_model('main', 'MovementAlias')
+    db = schema_editor.connection.alias
+    owners = AdvUser.objects.using(db).filter(
+        workout__exercise__isnull=False).values_list('pk',
+                                                     flat=True).distinct()
+    for owner_id in list(owners):
+        with transaction.atomic(using=db):
+            spellings = {}
+            for name, count in Exercise.objects.using(db).filter(
+                    workout__owner_id=owner_id).values_list('name').annotate(
+                        count=Count('pk')):
+                spellings.setdefault(exercise_key(name),
+                                     Counter())[name] += count
+            for key, names in spellings.items():
+                # The most frequent spelling, the first one on a tie
+                name = min(names, key=lambda n: (-names[n], n))
+                movement = Movement.objects.using(db).create(owner_id=owner_id,
+                                                             name=name)
+                MovementAlias.objects.using(db).create(owner_id=owner_id,
+                                                       key=key,
+                                                       movement=movement)
+                Exercise.objects.using(db).filter(
+                    workout__owner_id=owner_id,
+                    name__in=list(names)).update(movement=movement)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('main', '0011_movements'),
+    ]
+
+    operations = [
+        migrations.RunPython(build_catalogue, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+"""Records one change for every existing workout, exercise and set, so the
+first sync of a client gets the whole diary. Parents get lower sequence
+numbers than their children."""
+from django.db import migrations, transaction
+
+BATCH_SIZE = 2000
+
+
+def backfill_changes(apps, schema_editor):
+    Change = apps.get_model('main', 'Change')
+    db = schema_editor.connection.alias
+    sources = (
+        ('workout', apps.get_model('main', 'Workout'),
+         ('pk', 'owner_id', 'pk')),
+        ('exercise', apps.get_model('main', 'Exercise'),
+         ('pk', 'workout__owner_id', 'workout_id')),
+        ('set', apps.get_model('main', 'SetDescription'),
+         ('pk', 'exercise__workout__owner_id', 'exercise__workout_id')),
+    )
+    for kind, model, fields in sources:
+        last_pk = 0
+        while True:
+            with transaction.atomic(using=db):
+                rows = list(
+                    model.objects.using(db).filter(pk__gt=last_pk).order_by(
+                        'pk').values_list(*fields)[:BATCH_SIZE])
+                if not rows:
+                    break
+                Change.objects.using(db).bulk_create([
+                    Change(user_id=user_id,
+                           kind=kind,
+                           object_id=pk,
+                           workout_id=workout_id)
+                    for pk, user_id, workout_id in rows
+                ])
+                last_pk = rows[-1][0]
+
+
+def remove_changes(apps, schema_editor):
+    apps.get_model('main', 'Change').objects.using(
+        schema_editor.connection.alias).all().delete()
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('main', '0013_change_tracking'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_changes, remove_changes),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.9 on 2026-10-18 15:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_backfill_changes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workout',
+            name='exercise_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Упражнений'),
+        ),
+        migrations.AddField(
+            model_name='workout',
+            name='set_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Подходов'),
+        ),
+        migrations.AddField(
+            model_name='workout',
+            name='top_weight',
+            field=models.DecimalField(decimal_places=1, default=0, editable=False, max_digits=3, verbose_name='Максимальный вес'),
+        ),
+        migrations.AddField(
+            model_name='workout',
+            name='total_volume',
+            field=models.DecimalField(decimal_places=1, default=0, editable=False, max_digits=12, verbose_name='Тоннаж'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+"""Computes the summary columns of existing workouts, one transaction per
+batch of workouts."""
+from django.db import migrations, models, transaction
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 500
+
+
+def backfill_summaries(apps, schema_editor):
+    Workout = apps.get_model('main', 'Workout')
+    Exercise = apps.get_model('main', 'Exercise')
+    SetDescription = apps.get_model('main', 'SetDescription')
+    db = schema_editor.connection.alias
+
+    def aggregate(queryset, group_by, value, field):
+        rows = queryset.order_by().values(group_by).annotate(
+            value=value).values('value')
+        return Coalesce(models.Subquery(rows, output_field=field), 0,
+                        output_field=field)
+
+    integer = models.PositiveIntegerField()
+    volume = Workout._meta.get_field('total_volume')
+    weight = Workout._meta.get_field('top_weight')
+    sets = SetDescription.objects.using(db).filter(
+        exercise__workout=models.OuterRef('pk'))
+    columns = {
+        'exercise_count': aggregate(
+            Exercise.objects.using(db).filter(workout=models.OuterRef('pk')),
+            'workout', models.Count('pk'), integer),
+        'set_count': aggregate(sets, 'exercise__workout', models.Count('pk'),
+                               integer),
+        'total_volume': aggregate(
+            sets, 'exercise__workout',
+            models.Sum(models.F('weight') * models.F('repeats'),
+                       output_field=volume), volume),
+        'top_weight': aggregate(sets, 'exercise__workout',
+                                models.Max('weight'), weight),
+    }
+    last_pk = 0
+    while True:
+        with transaction.atomic(using=db):
+            pks = list(
+                Workout.objects.using(db).filter(pk__gt=last_pk).order_by(
+                    'pk').values_list('pk', flat=True)[:BATCH_SIZE])
+            if not pks:
+                break
+            Workout.objects.using(db).filter(pk__in=pks).update(**columns)
+            last_pk = pks[-1]
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('main', '0015_workout_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.9 on 2026-10-18 16:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_backfill_workout_summaries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('sessions', models.PositiveIntegerField(default=0, verbose_name='Тренировок')),
+                ('set_count', models.PositiveIntegerField(default=0, verbose_name='Подходов')),
+                ('volume', models.DecimalField(decimal_places=1, default=0, max_digits=14, verbose_name='Тоннаж')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Спортсмен')),
+            ],
+            options={
+                'verbose_name': 'Активность за день',
+                'verbose_name_plural': 'Активность по дням',
+                'ordering': ['day'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailyactivity',
+            constraint=models.UniqueConstraint(fields=('user', 'day'), name='dailyactivity_user_day_uniq'),
+        ),
+    ]
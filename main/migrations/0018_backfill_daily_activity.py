@@ -0,0 +1,46 @@
+"""Sums the workout summaries of every user into DailyActivity, one
+transaction per user."""
+from django.db import migrations, transaction
+from django.db.models import Count, Sum
+
+
+def backfill_activity(apps, schema_editor):
+    AdvUser = apps.get_model('main', 'AdvUser')
+    Workout = apps.get_model('main', 'Workout')
+    DailyActivity = apps.get_model('main', 'DailyActivity')
+    db = schema_editor.connection.alias
+    for user_id in AdvUser.objects.using(db).order_by('pk').values_list(
+            'pk', flat=True).iterator():
+        rows = Workout.objects.using(db).filter(
+            owner_id=user_id).order_by().values('created_at').annotate(
+                sessions=Count('pk'),
+                sets=Sum('set_count'),
+                volume=Sum('total_volume')).values_list(
+                    'created_at', 'sessions', 'sets', 'volume')
+        with transaction.atomic(using=db):
+            DailyActivity.objects.using(db).bulk_create([
+                DailyActivity(user_id=user_id,
+                              day=day,
+                              sessions=sessions,
+                              set_count=sets,
+                              volume=volume)
+                for day, sessions, sets, volume in rows
+            ])
+
+
+def remove_activity(apps, schema_editor):
+    apps.get_model('main', 'DailyActivity').objects.using(
+        schema_editor.connection.alias).all().delete()
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('main', '0017_daily_activity'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_activity, remove_activity),
+    ]
@@ -0,0 +1,33 @@
+"""Computes ExerciseStats and WeeklyTonnage from the existing sets, one
+transaction per user. 0008 created the tables empty, and the incremental
+updates only add the sets written after it."""
+from django.db import migrations
+
+from main.stats import rebuild_user
+
+
+def backfill_stats(apps, schema_editor):
+    AdvUser = apps.get_model('main', 'AdvUser')
+    db = schema_editor.connection.alias
+    for user_id in AdvUser.objects.using(db).order_by('pk').values_list(
+            'pk', flat=True).iterator():
+        rebuild_user(user_id, db, apps)
+
+
+def remove_stats(apps, schema_editor):
+    db = schema_editor.connection.alias
+    apps.get_model('main', 'ExerciseStats').objects.using(db).all().delete()
+    apps.get_model('main', 'WeeklyTonnage').objects.using(db).all().delete()
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('main', '0018_backfill_daily_activity'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_stats, remove_stats),
+    ]
@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 from datetime import datetime
 
 from django.contrib.auth.models import AbstractUser
@@ -9,20 +10,36 @@ class AdvUser(AbstractUser):
                                        verbose_name='Прошел активацию?')
     send_messages = models.BooleanField(
         default=True, verbose_name='Слать оповещения о новых комментариях?')
+    deletion_requested = models.DateTimeField(
+        null=True, blank=True, verbose_name='Удаление запрошено')
 
     def delete(self, *args, **kwargs):
-        for workout in self.workout_set.all():
-            workout.delete()
-        super().delete(*args, **kwargs)
+        from .deletion import delete_user_data
+
+        using = kwargs.get('using') or self._state.db or 'default'
+        with transaction.atomic(using=using):
+            delete_user_data(self, using=using)
+            return super().delete(*args, **kwargs)
 
     class Meta(AbstractUser.Meta):
         pass
 
 
+class WorkoutQuerySet(models.QuerySet):
+    def with_tree(self):
+        """Prefetches exercises and their sets in the order they are shown"""
+        sets = SetDescription.objects.order_by('number', 'pk')
+        exercises = Exercise.objects.order_by('pk').prefetch_related(
+            models.Prefetch('setdescription_set', queryset=sets))
+        return self.prefetch_related(
+            models.Prefetch('exercise_set', queryset=exercises))
+
+
 class Workout(models.Model):
     """"Workout description"""
-    sportsman_name = models.CharField(max_length=50,
-                                      verbose_name='Имя спортсмена')
+    owner = models.ForeignKey(AdvUser,
+                              on_delete=models.CASCADE,
+                              verbose_name='Спортсмен')
 
     name = models.CharField(max_length=150, verbose_name='Название')
     created_at = models.DateField(auto_now=False,
@@ -32,14 +49,95 @@ class Workout(models.Model):
     comment = models.TextField(null=True,
                                blank=True,
                                verbose_name='Комментарий')
+    # Also bumped when one of the workout's exercises or sets changes
+    updated_at = models.DateTimeField(auto_now=True,
+                                      verbose_name='Изменена')
+    # Summary of the exercises and sets, maintained by main.summaries
+    exercise_count = models.PositiveIntegerField(default=0,
+                                                 editable=False,
+                                                 verbose_name='Упражнений')
+    set_count = models.PositiveIntegerField(default=0,
+                                            editable=False,
+                                            verbose_name='Подходов')
+    total_volume = models.DecimalField(max_digits=12,
+                                       decimal_places=1,
+                                       default=0,
+                                       editable=False,
+                                       verbose_name='Тоннаж')
+    top_weight = models.DecimalField(max_digits=3,
+                                     decimal_places=1,
+                                     default=0,
+                                     editable=False,
+                                     verbose_name='Максимальный вес')
+
+    objects = WorkoutQuerySet.as_manager()
+
+    SUMMARY_FIELDS = ('exercise_count', 'set_count', 'total_volume',
+                      'top_weight')
 
     class Meta:
         verbose_name = "Тренировка"
         verbose_name_plural = "Тренировки"
+        indexes = [
+            # "My workouts, newest first"; id is the keyset tie-breaker
+            models.Index(fields=['owner', '-created_at', '-id'],
+                         name='workout_owner_created_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # The summary may have changed since this instance was loaded
+        if (not self._state.adding and not args
+                and not kwargs.get('force_insert')
+                and kwargs.get('update_fields') is None):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.SUMMARY_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+
+class Movement(models.Model):
+    """One entry of a user's exercise catalogue, see main.movements"""
+    owner = models.ForeignKey(AdvUser,
+                              on_delete=models.CASCADE,
+                              verbose_name='Спортсмен')
+    name = models.CharField(max_length=150, verbose_name='Название')
+
+    class Meta:
+        verbose_name = 'Движение'
+        verbose_name_plural = 'Движения'
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+
+class MovementAlias(models.Model):
+    """A spelling of a movement, stored as main.stats.exercise_key()"""
+    owner = models.ForeignKey(AdvUser,
+                              on_delete=models.CASCADE,
+                              verbose_name='Спортсмен')
+    key = models.CharField(max_length=150, verbose_name='Написание')
+    movement = models.ForeignKey(Movement,
+                                 on_delete=models.CASCADE,
+                                 related_name='aliases',
+                                 verbose_name='Движение')
+
+    class Meta:
+        verbose_name = 'Синоним движения'
+        verbose_name_plural = 'Синонимы движений'
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'key'],
+                                    name='movementalias_owner_key_uniq'),
+        ]
+
+    def __str__(self):
+        return self.key
+
 
 class Exercise(models.Model):
     """Exercise model that is connected to workout model"""
@@ -52,10 +150,24 @@ class Exercise(models.Model):
                             verbose_name='',
                             db_index=True,
                             editable=True)
+    # Follows the name, set by main.movements
+    movement = models.ForeignKey(Movement,
+                                 on_delete=models.SET_NULL,
+                                 null=True,
+                                 editable=False,
+                                 db_index=False,
+                                 verbose_name='Движение')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Изменено')
 
     class Meta:
         verbose_name = "Упражнение"
         verbose_name_plural = "Упражнения"
+        indexes = [
+            # History of one movement; workout_id comes with the index, so
+            # the table is only read for the rows that are returned
+            models.Index(fields=['movement', 'workout'],
+                         name='exercise_movement_workout_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -70,6 +182,7 @@ class SetDescription(models.Model):
     weight = models.DecimalField(max_digits=3, decimal_places=1,verbose_name='Вес')
     repeats = models.PositiveSmallIntegerField(default=0,
                                                verbose_name='Повторения')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Изменен')
 
     class Meta:
         verbose_name = 'Описание подхода'
@@ -78,3 +191,195 @@ class SetDescription(models.Model):
 
     def __str__(self):
         return ('Подход № ' + str(self.number) + " " + str(self.exercise))
+
+
+
+class Letter(models.Model):
+    """Outgoing email waiting in the outbox for the mail worker"""
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'Ожидает отправки'),
+        (SENT, 'Отправлено'),
+        (FAILED, 'Не доставлено'),
+    )
+
+    user = models.ForeignKey(AdvUser,
+                             null=True,
+                             blank=True,
+                             on_delete=models.SET_NULL,
+                             verbose_name='Пользователь')
+    recipient = models.EmailField(verbose_name='Адрес')
+    subject = models.CharField(max_length=255, verbose_name='Тема')
+    body = models.TextField(verbose_name='Текст')
+    status = models.CharField(max_length=10,
+                              choices=STATUSES,
+                              default=PENDING,
+                              verbose_name='Состояние')
+    attempts = models.PositiveSmallIntegerField(default=0,
+                                                verbose_name='Попыток')
+    next_attempt_at = models.DateTimeField(default=timezone.now,
+                                           verbose_name='Следующая попытка')
+    last_error = models.TextField(blank=True,
+                                  verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(auto_now_add=True,
+                                      verbose_name='Создано')
+    sent_at = models.DateTimeField(null=True,
+                                   blank=True,
+                                   verbose_name='Отправлено')
+
+    class Meta:
+        verbose_name = 'Письмо'
+        verbose_name_plural = 'Исходящие письма'
+        indexes = [
+            # The worker's "what is due" query
+            models.Index(fields=['status', 'next_attempt_at'],
+                         name='letter_due_idx'),
+        ]
+
+    def __str__(self):
+        return '%s: %s' % (self.recipient, self.subject)
+
+
+class ExerciseStats(models.Model):
+    """Running totals of one user's sets of one exercise, see main.stats"""
+    user = models.ForeignKey(AdvUser,
+                             on_delete=models.CASCADE,
+                             verbose_name='Спортсмен')
+    exercise_key = models.CharField(max_length=150,
+                                    verbose_name='Ключ упражнения')
+    name = models.CharField(max_length=150, verbose_name='Упражнение')
+    set_count = models.PositiveIntegerField(default=0,
+                                            verbose_name='Подходов')
+    total_repeats = models.PositiveIntegerField(default=0,
+                                                verbose_name='Повторений')
+    total_volume = models.DecimalField(max_digits=14,
+                                       decimal_places=1,
+                                       default=0,
+                                       verbose_name='Тоннаж')
+    best_weight = models.DecimalField(max_digits=3,
+                                      decimal_places=1,
+                                      default=0,
+                                      verbose_name='Рекордный вес')
+    best_weight_at = models.DateField(null=True,
+                                      blank=True,
+                                      verbose_name='Дата рекорда веса')
+    best_e1rm = models.DecimalField(max_digits=6,
+                                    decimal_places=1,
+                                    default=0,
+                                    verbose_name='Расчетный максимум')
+    best_e1rm_at = models.DateField(null=True,
+                                    blank=True,
+                                    verbose_name='Дата рекорда максимума')
+
+    class Meta:
+        verbose_name = 'Статистика упражнения'
+        verbose_name_plural = 'Статистика упражнений'
+        ordering = ['name']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'exercise_key'],
+                                    name='exercisestats_user_key_uniq'),
+        ]
+
+    def __str__(self):
+        return '%s: %s' % (self.user, self.name)
+
+
+class WeeklyTonnage(models.Model):
+    """Total volume one user lifted in one week, keyed by its Monday"""
+    user = models.ForeignKey(AdvUser,
+                             on_delete=models.CASCADE,
+                             verbose_name='Спортсмен')
+    week = models.DateField(verbose_name='Неделя')
+    set_count = models.PositiveIntegerField(default=0,
+                                            verbose_name='Подходов')
+    volume = models.DecimalField(max_digits=14,
+                                 decimal_places=1,
+                                 default=0,
+                                 verbose_name='Тоннаж')
+
+    class Meta:
+        verbose_name = 'Недельный тоннаж'
+        verbose_name_plural = 'Недельный тоннаж'
+        ordering = ['-week']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'week'],
+                                    name='weeklytonnage_user_week_uniq'),
+        ]
+
+    def __str__(self):
+        return '%s: %s' % (self.user, self.week)
+
+
+class DailyActivity(models.Model):
+    """Workouts, sets and volume of one user on one day, see main.activity"""
+    user = models.ForeignKey(AdvUser,
+                             on_delete=models.CASCADE,
+                             verbose_name='Спортсмен')
+    day = models.DateField(verbose_name='День')
+    sessions = models.PositiveIntegerField(default=0,
+                                           verbose_name='Тренировок')
+    set_count = models.PositiveIntegerField(default=0,
+                                            verbose_name='Подходов')
+    volume = models.DecimalField(max_digits=14,
+                                 decimal_places=1,
+                                 default=0,
+                                 verbose_name='Тоннаж')
+
+    class Meta:
+        verbose_name = 'Активность за день'
+        verbose_name_plural = 'Активность по дням'
+        ordering = ['day']
+        constraints = [
+            # Also the index of calendar range scans
+            models.UniqueConstraint(fields=['user', 'day'],
+                                    name='dailyactivity_user_day_uniq'),
+        ]
+
+    def __str__(self):
+        return '%s: %s' % (self.user, self.day)
+
+
+class Change(models.Model):
+    """Latest change of one diary object, see main.changes.
+
+    The id is the change sequence: every write replaces the object's row
+    with a new one, so a client that has seen changes up to some id only
+    needs the rows after it.
+    """
+    WORKOUT = 'workout'
+    EXERCISE = 'exercise'
+    SET = 'set'
+    KINDS = (
+        (WORKOUT, 'Тренировка'),
+        (EXERCISE, 'Упражнение'),
+        (SET, 'Подход'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(AdvUser,
+                             on_delete=models.CASCADE,
+                             verbose_name='Спортсмен')
+    kind = models.CharField(max_length=10, choices=KINDS, verbose_name='Тип')
+    object_id = models.BigIntegerField(verbose_name='Объект')
+    # The object's workout (the workout itself for workouts), so deleting a
+    # workout can drop the rows of everything in it
+    workout_id = models.BigIntegerField(verbose_name='Тренировка')
+    deleted = models.BooleanField(default=False, verbose_name='Удален')
+
+    class Meta:
+        verbose_name = 'Изменение'
+        verbose_name_plural = 'Изменения'
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'],
+                                    name='change_kind_object_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'id'], name='change_user_seq_idx'),
+            models.Index(fields=['workout_id', 'kind'],
+                         name='change_workout_idx'),
+        ]
+
+    def __str__(self):
+        return '%s %s #%s' % (self.id, self.kind, self.object_id)
@@ -0,0 +1,103 @@
+"""Per-user exercise catalogue.
+
+Exercise names are free text, so one movement is logged under several
+spellings. Every spelling, normalized with stats.exercise_key(), is an alias
+of exactly one Movement of its user, and every Exercise points to the
+movement of its name. The history of a movement is then an index lookup on
+Exercise.movement instead of a scan over names. Merging two movements makes
+their spellings aliases of one.
+"""
+from django.db import IntegrityError, transaction
+
+from . import caching
+from .models import (Exercise, Movement, MovementAlias, SetDescription,
+                     Workout)
+from .stats import exercise_key
+from .utilities import bulk_create_with_pks
+
+
+def _movement_ids(owner_id, keys, using):
+    return dict(
+        MovementAlias.objects.using(using).filter(
+            owner_id=owner_id,
+            key__in=set(keys)).values_list('key', 'movement_id'))
+
+
+def resolve(owner_id, names, using='default'):
+    """Maps exercise names to the ids of their movements, creating
+    movements for spellings the user hasn't used before"""
+    keys = {name: exercise_key(name) for name in names}
+    movement_ids = _movement_ids(owner_id, keys.values(), using)
+    new = {}
+    for name, key in keys.items():
+        if key not in movement_ids and key not in new:
+            new[key] = Movement(owner_id=owner_id, name=name)
+    if new:
+        try:
+            _create(owner_id, new, using)
+        except IntegrityError:
+            # Another request added one of the spellings first: take its
+            # movements and create the rest
+            movement_ids.update(_movement_ids(owner_id, new, using))
+            new = {key: Movement(owner_id=owner_id, name=movement.name)
+                   for key, movement in new.items()
+                   if key not in movement_ids}
+            _create(owner_id, new, using)
+        movement_ids.update(
+            (key, movement.pk) for key, movement in new.items())
+    return {name: movement_ids[key] for name, key in keys.items()}
+
+
+def _create(owner_id, new, using):
+    """Creates the movements and aliases of {key: Movement}; a savepoint, so
+    a conflicting alias rolls back only these rows"""
+    with transaction.atomic(using=using):
+        bulk_create_with_pks(Movement, new.values(), using)
+        MovementAlias.objects.using(using).bulk_create([
+            MovementAlias(owner_id=owner_id, key=key, movement=movement)
+            for key, movement in new.items()
+        ])
+
+
+# Newest session first, sets in the order they were done; unique for keyset
+# pagination
+HISTORY_ORDERING = ('-exercise__workout__created_at', '-exercise_id',
+                    'number', 'id')
+
+
+def history(movement):
+    """Every set of a movement with its exercise and workout"""
+    return SetDescription.objects.filter(
+        exercise__movement=movement).select_related('exercise__workout')
+
+
+def exercise_saving(instance, old_name=None):
+    """Points an exercise about to be saved at the movement of its name;
+    nothing to look up when the key of `old_name`, its stored name, stays"""
+    if (instance.movement_id is not None and old_name is not None
+            and exercise_key(old_name) == exercise_key(instance.name)):
+        return
+    using = instance._state.db or 'default'
+    owner_id = Workout.objects.using(using).filter(
+        pk=instance.workout_id).values_list('owner_id', flat=True).first()
+    if owner_id is not None:
+        instance.movement_id = resolve(owner_id, [instance.name],
+                                       using)[instance.name]
+
+
+def merge(target, movements):
+    """Makes the spellings and exercises of `movements` those of `target`
+    and deletes them"""
+    movements = Movement.objects.filter(
+        owner_id=target.owner_id,
+        pk__in=[movement.pk for movement in movements]).exclude(pk=target.pk)
+    with transaction.atomic():
+        exercises = Exercise.objects.filter(movement__in=movements)
+        workout_ids = list(exercises.values_list('workout_id', flat=True))
+        MovementAlias.objects.filter(movement__in=movements).update(
+            movement=target)
+        exercises.update(movement=target)
+        _, deleted = movements.delete()
+    caching.bump_user(target.owner_id)
+    caching.bump_workouts(workout_ids)
+    return deleted.get(Movement._meta.label, 0)
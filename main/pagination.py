@@ -0,0 +1,141 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class KeysetPage:
+    """One page of a keyset paginated queryset"""
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+
+class KeysetPaginator:
+    """Cursor pagination over a unique ordering, e.g. ('-created_at', '-id').
+
+    Unlike Paginator it never counts rows and never uses OFFSET: every page
+    is a range condition on the ordering fields, so deep pages cost the same
+    as the first one. Cursors are opaque urlsafe strings; a malformed cursor
+    simply yields the first page.
+    """
+    def __init__(self, queryset, per_page, ordering=('-created_at', '-id')):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = [o.lstrip('-') for o in self.ordering]
+
+    def get_page(self, cursor=None):
+        position = self.decode_cursor(cursor) if cursor else None
+        if position is not None:
+            values, direction = position
+            queryset = self.queryset.filter(
+                self._seek(values, reverse=direction == 'prev'))
+        else:
+            rows = list(self.queryset.order_by(*self.ordering)
+                        [:self.per_page + 1])
+            return self._forward_page(rows, from_start=True)
+        if direction == 'prev':
+            rows = list(queryset.order_by(*self._reversed_ordering())
+                        [:self.per_page + 1])
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            return KeysetPage(
+                rows,
+                next_cursor=self._cursor_for(rows[-1], 'next') if rows else None,
+                previous_cursor=(self._cursor_for(rows[0], 'prev')
+                                 if has_previous else None))
+        rows = list(queryset.order_by(*self.ordering)[:self.per_page + 1])
+        return self._forward_page(rows, from_start=False)
+
+    def _forward_page(self, rows, from_start):
+        has_next = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        return KeysetPage(
+            rows,
+            next_cursor=self._cursor_for(rows[-1], 'next') if has_next else None,
+            previous_cursor=(self._cursor_for(rows[0], 'prev')
+                             if rows and not from_start else None))
+
+    def _reversed_ordering(self):
+        return [o[1:] if o.startswith('-') else '-' + o for o in self.ordering]
+
+    def _seek(self, values, reverse=False):
+        """Condition selecting rows strictly after `values` in the ordering"""
+        condition = Q()
+        equal = {}
+        for ordering, field, value in zip(self.ordering, self.fields, values):
+            descending = ordering.startswith('-') != reverse
+            lookup = '%s__%s' % (field, 'lt' if descending else 'gt')
+            condition |= Q(**equal, **{lookup: value})
+            equal[field] = value
+        return condition
+
+    def _cursor_for(self, row, direction):
+        values = []
+        for field in self.fields:
+            value = row
+            for attr in field.split('__'):
+                value = (value[attr] if isinstance(value, dict)
+                         else getattr(value, attr))
+            values.append(str(value))
+        return self.encode_cursor(values, direction)
+
+    @staticmethod
+    def encode_cursor(values, direction):
+        data = json.dumps([values, direction], separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            values, direction = json.loads(base64.urlsafe_b64decode(padded))
+        except (TypeError, ValueError):
+            return None
+        if (direction not in ('next', 'prev')
+                or not isinstance(values, list)
+                or len(values) != len(self.fields)
+                or not all(isinstance(v, str) for v in values)):
+            return None
+        try:
+            values = [self._field(path).to_python(value)
+                      for path, value in zip(self.fields, values)]
+        except ValidationError:
+            return None
+        return values, direction
+
+    def _field(self, path):
+        """The model field at the end of an ordering path like
+        'exercise__workout__created_at'"""
+        model = self.queryset.model
+        for name in path.split('__'):
+            field = model._meta.get_field(name)
+            model = field.related_model
+        return field
+
+
+def cursor_url(request, cursor):
+    """Query string of the current request pointing at another page"""
+    params = request.GET.copy()
+    params['cursor'] = cursor
+    return '?' + params.urlencode()
@@ -0,0 +1,162 @@
+"""In-process request profiling used by ProfilingMiddleware.
+
+For a sample of requests (PROFILING_SAMPLE_RATE, 0 to 1) the wall time,
+the number and total time of SQL queries and the queries repeated within
+the request are recorded under the request's URL name. Every URL name keeps
+its last PROFILING_WINDOW samples, so the report shows rolling percentiles
+in bounded memory. The numbers belong to one process.
+
+Every connection carries the record_query() execute wrapper, which times
+the query for the recorder of the current context, if any. Context
+variables follow sync_to_async into worker threads, so the queries an
+async view runs in other threads count toward its request too.
+"""
+import contextvars
+import math
+import re
+import threading
+import time
+from collections import Counter, deque
+
+from django.conf import settings
+
+MAX_DUPLICATES = 50
+
+# Literals and placeholder lists that differ between otherwise identical
+# queries, e.g. IN (%s, %s) against IN (%s, %s, %s)
+NORMALIZE = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+recording = contextvars.ContextVar('profiling_recorder', default=None)
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def normalize_sql(sql):
+    for pattern, replacement in NORMALIZE:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not ordered:
+        return None
+    return ordered[max(1, math.ceil(fraction * len(ordered))) - 1]
+
+
+class QueryRecorder:
+    """Wrapper for connection.execute_wrapper() timing every query"""
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+        # The threads of one async request record concurrently
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            with self.lock:
+                self.duration += duration
+                self.count += 1
+                self.statements[sql] += 1
+
+    def duplicates(self):
+        """{normalized sql: times} of the queries run more than once"""
+        normalized = Counter()
+        for sql, times in self.statements.items():
+            normalized[normalize_sql(sql)] += times
+        return {sql: times for sql, times in normalized.items() if times > 1}
+
+
+def record_query(execute, sql, params, many, context):
+    recorder = recording.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_recorder(sender, connection, **kwargs):
+    """connection_created receiver"""
+    # The same wrapper object reconnects after a close
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class ViewProfile:
+    def __init__(self, window):
+        self.requests = 0
+        self.wall = deque(maxlen=window)
+        self.queries = deque(maxlen=window)
+        self.sql = deque(maxlen=window)
+        self.duplicates = Counter()
+
+    def add(self, wall, recorder):
+        self.requests += 1
+        self.wall.append(wall)
+        self.queries.append(recorder.count)
+        self.sql.append(recorder.duration)
+        for sql, times in recorder.duplicates().items():
+            self.duplicates[sql] = max(self.duplicates[sql], times)
+        if len(self.duplicates) > MAX_DUPLICATES:
+            self.duplicates = Counter(
+                dict(self.duplicates.most_common(MAX_DUPLICATES // 2)))
+
+    def report(self):
+        def summary(values, scale=1):
+            ordered = sorted(values)
+            return {
+                'p50': percentile(ordered, 0.5) * scale,
+                'p90': percentile(ordered, 0.9) * scale,
+                'p99': percentile(ordered, 0.99) * scale,
+                'max': ordered[-1] * scale,
+            }
+
+        return {
+            'requests': self.requests,
+            'samples': len(self.wall),
+            'wall_ms': summary(self.wall, 1000),
+            'queries': summary(self.queries),
+            'sql_ms': summary(self.sql, 1000),
+            'duplicate_queries': [{
+                'sql': sql,
+                'times': times
+            } for sql, times in self.duplicates.most_common(10)],
+        }
+
+
+class Profiler:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def record(self, name, wall, recorder):
+        with self.lock:
+            profile = self.views.get(name)
+            if profile is None:
+                profile = self.views[name] = ViewProfile(
+                    get_setting('PROFILING_WINDOW', 1000))
+            profile.add(wall, recorder)
+
+    def report(self):
+        with self.lock:
+            return {name: profile.report()
+                    for name, profile in sorted(self.views.items())}
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+
+
+profiler = Profiler()
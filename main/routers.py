@@ -0,0 +1,63 @@
+"""Primary/replica routing of the diary tables.
+
+ReplicaRoutingMiddleware marks a request as replica-safe; while it is
+handled, reads of the models in REPLICA_MODELS go to the 'replica' alias.
+Everything else, and every write, goes to the primary. A request that
+writes marks its client to read from the primary for a while, so users see
+their own changes even when the replica lags behind.
+"""
+import contextvars
+
+from django.conf import settings
+
+REPLICA = 'replica'
+
+# Users and sessions always come from the primary: a session created a
+# moment ago may not have reached the replica yet
+REPLICA_MODELS = {
+    'main.workout',
+    'main.exercise',
+    'main.setdescription',
+    'main.movement',
+    'main.movementalias',
+    'main.exercisestats',
+    'main.weeklytonnage',
+    'main.dailyactivity',
+}
+
+STICKY_COOKIE = 'read_primary'
+
+# A dict rather than flags, so that changes made in a copied context (code
+# run by sync_to_async) are seen by the middleware
+request_state = contextvars.ContextVar('database_request_state')
+
+
+def new_state():
+    return {'replica': False, 'wrote': False}
+
+
+def replica_enabled():
+    return getattr(settings, 'USE_REPLICA', False)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = request_state.get(None)
+        if (state and state['replica'] and replica_enabled()
+                and model._meta.label_lower in REPLICA_MODELS):
+            return REPLICA
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        state = request_state.get(None)
+        if state is not None:
+            state['wrote'] = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
@@ -0,0 +1,144 @@
+import re
+
+from django.db import connections, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Workout
+
+FTS_TABLE = 'main_workout_fts'
+
+# Workouts per statement, well below SQLite's bound parameter limit
+BATCH_SIZE = 500
+
+# One row per workout, rowid = Workout.id. unicode61 folds case for Cyrillic
+# as well as Latin; "ё" is not a diacritic for it, so it is folded to "е"
+# both here and in queries.
+CREATE_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5("
+    "name, comment, exercises, tokenize='unicode61 remove_diacritics 2')"
+    % FTS_TABLE)
+
+REINDEX_SQL = """
+    INSERT INTO {table} (rowid, name, comment, exercises)
+    SELECT w.id, {name}, {comment},
+           (SELECT group_concat({exercise}, ' ')
+              FROM main_exercise e WHERE e.workout_id = w.id)
+      FROM main_workout w
+""".format(table=FTS_TABLE,
+           name="replace(replace(w.name, 'ё', 'е'), 'Ё', 'Е')",
+           comment="replace(replace(coalesce(w.comment, ''), 'ё', 'е'), "
+           "'Ё', 'Е')",
+           exercise="replace(replace(e.name, 'ё', 'е'), 'Ё', 'Е')")
+
+_available = {}
+
+
+def is_available(using='default'):
+    """Whether the FTS5 index exists on this database"""
+    if using not in _available:
+        connection = connections[using]
+        _available[using] = (connection.vendor == 'sqlite' and FTS_TABLE
+                             in connection.introspection.table_names())
+    return _available[using]
+
+
+def normalize(text):
+    return text.replace('ё', 'е').replace('Ё', 'Е')
+
+
+def match_expression(keyword):
+    """FTS5 query where every word of `keyword` is a prefix, all required"""
+    words = re.findall(r'\w+', normalize(keyword))
+    return ' '.join('"%s"*' % word for word in words)
+
+
+def batches(ids, size=BATCH_SIZE):
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def index_workouts(workout_ids, using='default'):
+    """(Re)indexes the given workouts, dropping the ones that are gone"""
+    if not is_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        for batch in batches(workout_ids):
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute(
+                'DELETE FROM %s WHERE rowid IN (%s)' %
+                (FTS_TABLE, placeholders), batch)
+            cursor.execute(
+                REINDEX_SQL + ' WHERE w.id IN (%s)' % placeholders, batch)
+
+
+def remove_workouts(workout_ids, using='default'):
+    if not is_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        for batch in batches(workout_ids):
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute(
+                'DELETE FROM %s WHERE rowid IN (%s)' %
+                (FTS_TABLE, placeholders), batch)
+
+
+def remove_owner(owner_id, using='default'):
+    """Drops every workout of one owner from the index in one statement"""
+    if not is_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM %s WHERE rowid IN '
+            '(SELECT id FROM main_workout WHERE owner_id = %%s)' % FTS_TABLE,
+            [owner_id])
+
+
+def rebuild_index(using='default'):
+    """Drops and refills the whole index in one pass over the workouts"""
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS %s' % FTS_TABLE)
+        cursor.execute(CREATE_SQL)
+        cursor.execute(REINDEX_SQL)
+    _available[using] = True
+
+
+def filter_workouts(queryset, keyword):
+    """Restricts `queryset` to workouts matching `keyword`.
+
+    The queryset keeps its own ordering, so it can still be paginated by
+    date. Without the FTS index this falls back to LIKE lookups.
+    """
+    expression = match_expression(keyword)
+    if not expression:
+        return queryset
+    if is_available(queryset.db):
+        return queryset.filter(pk__in=RawSQL(
+            'SELECT rowid FROM {0} WHERE {0} MATCH %s'.format(FTS_TABLE),
+            [expression]))
+    q = (Q(name__icontains=keyword) | Q(comment__icontains=keyword)
+         | Q(exercise__name__icontains=keyword))
+    return queryset.filter(
+        pk__in=Workout.objects.filter(q).values('pk'))
+
+
+def search_workouts(owner, keyword, limit=50):
+    """Owner's workouts matching `keyword`, best matches first"""
+    expression = match_expression(keyword)
+    if not expression:
+        return []
+    queryset = Workout.objects.filter(owner=owner)
+    if not is_available(queryset.db):
+        return list(filter_workouts(queryset, keyword)
+                    .order_by('-created_at', '-id')[:limit])
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(
+            'SELECT f.rowid FROM {0} f '
+            'JOIN main_workout w ON w.id = f.rowid '
+            'WHERE {0} MATCH %s AND w.owner_id = %s '
+            'ORDER BY f.rank LIMIT %s'.format(FTS_TABLE),
+            [expression, owner.pk, limit])
+        ids = [row[0] for row in cursor.fetchall()]
+    workouts = queryset.in_bulk(ids)
+    return [workouts[pk] for pk in ids if pk in workouts]
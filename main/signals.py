@@ -0,0 +1,179 @@
+"""Receivers keeping derived data in step with the diary models.
+
+Connected from MainConfig.ready().
+"""
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import (activity, caching, changes, movements, search, stats,
+               summaries)
+from .apps import (sets_bulk_saved, workouts_bulk_changed,
+                   workouts_bulk_created, workouts_bulk_deleted)
+from .models import Change, Exercise, SetDescription, Workout
+
+
+def touch_workouts(using='default', changed=(), **lookups):
+    """Bumps updated_at, recomputes the summary and the day's activity,
+    records a change and bumps the cache versions of the workouts whose
+    exercises or sets changed and of the lists showing their summaries,
+    returns {workout id: owner id}.
+
+    `changed`, (kind, object id, deleted) of the exercises or sets that
+    changed, is recorded with the workout's own change in one pass; the
+    lookups then select a single workout.
+    """
+    rows = list(Workout.objects.using(using).filter(**lookups).values_list(
+        'pk', 'owner_id', 'created_at'))
+    owners = {pk: owner_id for pk, owner_id, _ in rows}
+    Workout.objects.using(using).filter(pk__in=owners).update(
+        updated_at=timezone.now(), **summaries.columns())
+    activity.refresh(((owner_id, day) for _, owner_id, day in rows), using)
+    # Synced clients get the new summary with the workout
+    for owner_id in set(owners.values()):
+        entries = []
+        for pk in owners:
+            if owners[pk] == owner_id:
+                entries.append((Change.WORKOUT, pk, pk, False))
+                entries.extend((kind, object_id, pk, deleted)
+                               for kind, object_id, deleted in changed)
+        changes.record_all(owner_id, entries, using=using)
+    caching.bump_workouts(list(owners))
+    for owner_id in set(owners.values()):
+        caching.bump_lists(owner_id)
+    return owners
+
+
+def exercise_touched(instance, using, changed=()):
+    # Exercise names are searchable, so they change the owner's lists too
+    owners = touch_workouts(using, changed, pk=instance.workout_id)
+    for owner_id in set(owners.values()):
+        caching.bump_user(owner_id)
+    return owners
+
+
+@receiver(pre_save, sender=Workout)
+def workout_saving(sender, instance, **kwargs):
+    stats.workout_changing(instance)
+
+
+@receiver(post_save, sender=Workout)
+def workout_saved(sender, instance, using, **kwargs):
+    search.index_workouts([instance.pk], using=using)
+    stats.workout_changed(instance)
+    # The previous date was read by stats.workout_changing()
+    activity.refresh([(instance.owner_id,
+                       getattr(instance, '_stats_old_day', None)),
+                      (instance.owner_id, instance.created_at)], using)
+    changes.record(instance.owner_id, Change.WORKOUT,
+                   [(instance.pk, instance.pk)], using=using)
+    caching.bump_user(instance.owner_id)
+    caching.bump_workouts([instance.pk])
+
+
+@receiver(post_delete, sender=Workout)
+def workout_deleted(sender, instance, using, **kwargs):
+    search.remove_workouts([instance.pk], using=using)
+    activity.refresh([(instance.owner_id, instance.created_at)], using)
+    changes.workouts_deleted(instance.owner_id, [instance.pk], using=using)
+    caching.bump_user(instance.owner_id)
+    caching.bump_workouts([instance.pk])
+
+
+@receiver(pre_save, sender=Exercise)
+def exercise_saving(sender, instance, **kwargs):
+    stats.exercise_changing(instance)
+    movements.exercise_saving(instance, instance._stats_old_name)
+
+
+@receiver(post_save, sender=Exercise)
+def exercise_saved(sender, instance, using, **kwargs):
+    exercise_touched(instance, using,
+                     [(Change.EXERCISE, instance.pk, False)])
+    search.index_workouts([instance.workout_id], using=using)
+    stats.exercise_changed(instance)
+
+
+@receiver(post_delete, sender=Exercise)
+def exercise_deleted(sender, instance, using, **kwargs):
+    for owner_id in exercise_touched(instance, using).values():
+        changes.exercise_deleted(owner_id, instance.pk, instance.workout_id,
+                                 using=using)
+    search.index_workouts([instance.workout_id], using=using)
+
+
+@receiver(pre_save, sender=SetDescription)
+def set_saving(sender, instance, **kwargs):
+    stats.set_changing(instance)
+
+
+@receiver(post_save, sender=SetDescription)
+def set_saved(sender, instance, using, **kwargs):
+    touch_workouts(using, [(Change.SET, instance.pk, False)],
+                   exercise=instance.exercise_id)
+    stats.set_changed(instance)
+
+
+@receiver(pre_delete, sender=SetDescription)
+def set_deleting(sender, instance, **kwargs):
+    stats.set_deleting(instance)
+
+
+@receiver(post_delete, sender=SetDescription)
+def set_deleted(sender, instance, using, **kwargs):
+    touch_workouts(using, [(Change.SET, instance.pk, True)],
+                   exercise=instance.exercise_id)
+    stats.set_deleted(instance)
+
+
+@receiver(sets_bulk_saved)
+def sets_saved_in_bulk(sender, owner_id, workout_id, saved, deleted, old, new,
+                       exercise_id=None, using='default', **kwargs):
+    changed = [(Change.SET, pk, False) for pk in saved]
+    changed += [(Change.SET, pk, True) for pk in deleted]
+    if exercise_id is not None:
+        changed.insert(0, (Change.EXERCISE, exercise_id, False))
+        search.index_workouts([workout_id], using=using)
+    touch_workouts(using, changed, pk=workout_id)
+    stats.sets_deleted(old, using)
+    stats.sets_added(new, using)
+    if exercise_id is not None:
+        caching.bump_user(owner_id)
+
+
+@receiver(workouts_bulk_changed)
+def workouts_changed_in_bulk(sender, owner_id, workout_ids, using='default',
+                             **kwargs):
+    search.index_workouts(workout_ids, using)
+    summaries.refresh(workout_ids, using)
+    activity.workouts_changed(workout_ids, using)
+    stats.rebuild_user(owner_id, using)
+    changes.workouts_changed(owner_id, workout_ids, using)
+    caching.bump_user(owner_id)
+    caching.bump_workouts(workout_ids)
+
+
+@receiver(workouts_bulk_created)
+def workouts_created_in_bulk(sender, owner_id, workout_ids, days,
+                             exercise_ids, set_ids, sets, using='default',
+                             **kwargs):
+    search.index_workouts(workout_ids, using)
+    activity.refresh(((owner_id, day) for day in days), using)
+    stats.sets_added(sets, using)
+    changes.record_all(
+        owner_id, changes.tree_entries(workout_ids, exercise_ids, set_ids),
+        using=using, new=True)
+    caching.bump_user(owner_id)
+    caching.bump_workouts(workout_ids)
+
+
+@receiver(workouts_bulk_deleted)
+def workouts_deleted_in_bulk(sender, owner_id, workout_ids, days, sets,
+                             using='default', **kwargs):
+    search.remove_workouts(workout_ids, using)
+    activity.refresh(((owner_id, day) for day in days), using)
+    stats.sets_deleted(sets, using)
+    changes.workouts_deleted(owner_id, workout_ids, using)
+    caching.bump_user(owner_id)
+    caching.bump_workouts(workout_ids)
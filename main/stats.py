@@ -0,0 +1,400 @@
+"""Per-user training statistics kept up to date on every write.
+
+Every set contributes to two aggregates: the ExerciseStats row of its
+(user, exercise) and the WeeklyTonnage row of its (user, week). Saving or
+deleting a set applies the difference between its old and new contribution,
+so reads never have to scan the training history. Records (best weight and
+estimated 1RM) only need a rescan of one exercise when the set holding the
+record is lowered or removed.
+"""
+import datetime
+import re
+from collections import namedtuple
+from decimal import Decimal
+
+from django.apps import apps as global_apps
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import ExerciseStats, SetDescription, WeeklyTonnage, Workout
+
+TENTH = Decimal('0.1')
+
+CONTRIBUTION_FIELDS = ('weight', 'repeats', 'exercise__name',
+                       'exercise__workout__owner_id',
+                       'exercise__workout__created_at')
+
+
+def exercise_key(name):
+    """Groups spellings of one exercise: case, "ё" and spacing are ignored"""
+    return re.sub(r'\s+', ' ', name.casefold().replace('ё', 'е')).strip()
+
+
+def week_start(day):
+    return day - datetime.timedelta(days=day.weekday())
+
+
+def estimated_1rm(weight, repeats):
+    """Epley formula; a set of one repeat is its own maximum"""
+    if not repeats:
+        return Decimal(0)
+    if repeats == 1:
+        return Decimal(weight)
+    return (Decimal(weight) * (1 + Decimal(repeats) / 30)).quantize(TENTH)
+
+
+class Contribution(
+        namedtuple('Contribution',
+                   'user_id name day weight repeats')):
+    """What one set adds to the aggregates"""
+    @classmethod
+    def from_row(cls, row):
+        weight, repeats, name, user_id, day = row
+        return cls(user_id, name, day, Decimal(weight), repeats)
+
+    @property
+    def key(self):
+        return exercise_key(self.name)
+
+    @property
+    def volume(self):
+        return self.weight * self.repeats
+
+    @property
+    def e1rm(self):
+        return estimated_1rm(self.weight, self.repeats)
+
+
+def contribution(set_pk):
+    row = SetDescription.objects.filter(pk=set_pk).values_list(
+        *CONTRIBUTION_FIELDS).first()
+    return Contribution.from_row(row) if row else None
+
+
+def add(contrib):
+    stats, _ = ExerciseStats.objects.get_or_create(
+        user_id=contrib.user_id,
+        exercise_key=contrib.key,
+        defaults={'name': contrib.name})
+    changes = {
+        'name': contrib.name,
+        'set_count': F('set_count') + 1,
+        'total_repeats': F('total_repeats') + contrib.repeats,
+        'total_volume': F('total_volume') + contrib.volume,
+    }
+    if contrib.weight > stats.best_weight:
+        changes.update(best_weight=contrib.weight, best_weight_at=contrib.day)
+    if contrib.e1rm > stats.best_e1rm:
+        changes.update(best_e1rm=contrib.e1rm, best_e1rm_at=contrib.day)
+    ExerciseStats.objects.filter(pk=stats.pk).update(**changes)
+
+    week, _ = WeeklyTonnage.objects.get_or_create(
+        user_id=contrib.user_id, week=week_start(contrib.day))
+    WeeklyTonnage.objects.filter(pk=week.pk).update(
+        set_count=F('set_count') + 1, volume=F('volume') + contrib.volume)
+
+
+def remove(contrib):
+    stats = ExerciseStats.objects.filter(user_id=contrib.user_id,
+                                         exercise_key=contrib.key).first()
+    if stats is not None:
+        ExerciseStats.objects.filter(pk=stats.pk).update(
+            set_count=F('set_count') - 1,
+            total_repeats=F('total_repeats') - contrib.repeats,
+            total_volume=F('total_volume') - contrib.volume)
+        if stats.set_count <= 1:
+            # The exercise's last set
+            ExerciseStats.objects.filter(pk=stats.pk,
+                                         set_count__lte=0).delete()
+        elif (contrib.weight >= stats.best_weight
+                or contrib.e1rm >= stats.best_e1rm):
+            recompute_records(contrib.user_id, contrib.key)
+    week = WeeklyTonnage.objects.filter(user_id=contrib.user_id,
+                                        week=week_start(contrib.day))
+    week.update(set_count=F('set_count') - 1,
+                volume=F('volume') - contrib.volume)
+    week.filter(set_count__lte=0).delete()
+
+
+def exercise_names(user_id, key, using='default'):
+    """The user's exercise spellings that share `key`"""
+    names = SetDescription.objects.using(using).filter(
+        exercise__workout__owner_id=user_id).values_list(
+            'exercise__name', flat=True).distinct()
+    return [name for name in names if exercise_key(name) == key]
+
+
+def set_rows(user_id, key, using='default'):
+    return SetDescription.objects.using(using).filter(
+        exercise__workout__owner_id=user_id,
+        exercise__name__in=exercise_names(user_id, key, using)).values_list(
+            *CONTRIBUTION_FIELDS)
+
+
+def accumulate(stats, contrib, times=1):
+    """Adds a set to an unsaved ExerciseStats, sets must come oldest first"""
+    stats.name = contrib.name
+    stats.set_count += times
+    stats.total_repeats += contrib.repeats * times
+    stats.total_volume += contrib.volume * times
+    if contrib.weight > stats.best_weight:
+        stats.best_weight, stats.best_weight_at = contrib.weight, contrib.day
+    if contrib.e1rm > stats.best_e1rm:
+        stats.best_e1rm, stats.best_e1rm_at = contrib.e1rm, contrib.day
+
+
+def recompute_records(user_id, key, using='default'):
+    """Rescans one exercise of one user for its best weight and 1RM"""
+    best_weight = best_e1rm = Decimal(0)
+    best_weight_at = best_e1rm_at = None
+    for row in set_rows(user_id, key, using).order_by(
+            'exercise__workout__created_at'):
+        contrib = Contribution.from_row(row)
+        if contrib.weight > best_weight:
+            best_weight, best_weight_at = contrib.weight, contrib.day
+        if contrib.e1rm > best_e1rm:
+            best_e1rm, best_e1rm_at = contrib.e1rm, contrib.day
+    ExerciseStats.objects.using(using).filter(
+        user_id=user_id, exercise_key=key).update(
+            best_weight=best_weight,
+            best_weight_at=best_weight_at,
+            best_e1rm=best_e1rm,
+            best_e1rm_at=best_e1rm_at)
+
+
+def recompute_exercise(user_id, key):
+    """Rebuilds one ExerciseStats row from the user's history"""
+    stats = ExerciseStats(user_id=user_id, exercise_key=key)
+    for row in set_rows(user_id, key).order_by(
+            'exercise__workout__created_at'):
+        accumulate(stats, Contribution.from_row(row))
+    with transaction.atomic():
+        ExerciseStats.objects.filter(user_id=user_id,
+                                     exercise_key=key).delete()
+        if stats.set_count:
+            stats.save()
+
+
+def recompute_week(user_id, week):
+    """Rebuilds one WeeklyTonnage row from the user's history"""
+    sets = SetDescription.objects.filter(
+        exercise__workout__owner_id=user_id,
+        exercise__workout__created_at__range=(week, week +
+                                              datetime.timedelta(days=6)))
+    count, volume = 0, Decimal(0)
+    for weight, repeats in sets.values_list('weight', 'repeats'):
+        count += 1
+        volume += Decimal(weight) * repeats
+    with transaction.atomic():
+        WeeklyTonnage.objects.filter(user_id=user_id, week=week).delete()
+        if count:
+            WeeklyTonnage.objects.create(user_id=user_id,
+                                         week=week,
+                                         set_count=count,
+                                         volume=volume)
+
+
+def rebuild_user(user_id, using='default', apps=global_apps):
+    """Recomputes every aggregate of one user in a single pass.
+
+    Identical sets of one exercise on one day are counted by the database,
+    so Python only sees one row per distinct (day, exercise, weight,
+    repeats). A data migration passes its historical `apps`.
+    """
+    sets = apps.get_model('main', 'SetDescription').objects.using(using)
+    stats_model = apps.get_model('main', 'ExerciseStats')
+    week_model = apps.get_model('main', 'WeeklyTonnage')
+    exercises, weeks, keys = {}, {}, {}
+    rows = sets.filter(exercise__workout__owner_id=user_id).values_list(
+        *CONTRIBUTION_FIELDS).annotate(times=Count('pk')).order_by(
+            'exercise__workout__created_at')
+    for row in rows.iterator(chunk_size=2000):
+        contrib = Contribution.from_row(row[:-1])
+        times = row[-1]
+        key = keys.get(contrib.name)
+        if key is None:
+            key = keys[contrib.name] = contrib.key
+        accumulate(
+            exercises.setdefault(
+                key, stats_model(user_id=user_id, exercise_key=key)),
+            contrib, times)
+        monday = week_start(contrib.day)
+        week = weeks.setdefault(monday,
+                                week_model(user_id=user_id, week=monday))
+        week.set_count += times
+        week.volume += contrib.volume * times
+    with transaction.atomic(using=using):
+        stats_model.objects.using(using).filter(user_id=user_id).delete()
+        week_model.objects.using(using).filter(user_id=user_id).delete()
+        stats_model.objects.using(using).bulk_create(exercises.values())
+        week_model.objects.using(using).bulk_create(weeks.values())
+
+
+# Hooks called by main.signals
+
+def set_changing(instance):
+    instance._stats_old = contribution(instance.pk) if instance.pk else None
+
+
+def set_changed(instance):
+    with transaction.atomic():
+        if getattr(instance, '_stats_old', None):
+            remove(instance._stats_old)
+        new = contribution(instance.pk)
+        if new:
+            add(new)
+
+
+def set_deleting(instance):
+    instance._stats_old = contribution(instance.pk)
+
+
+def set_deleted(instance):
+    if getattr(instance, '_stats_old', None):
+        with transaction.atomic():
+            remove(instance._stats_old)
+
+
+def sets_added(rows, using='default'):
+    """Adds many new sets (CONTRIBUTION_FIELDS rows) at once: aggregates
+    the user doesn't have yet are inserted with one query, existing ones get
+    one update each"""
+    exercises, weeks = {}, {}
+    for row in sorted(rows, key=lambda row: row[-1]):
+        contrib = Contribution.from_row(row)
+        accumulate(
+            exercises.setdefault(
+                (contrib.user_id, contrib.key),
+                ExerciseStats(user_id=contrib.user_id,
+                              exercise_key=contrib.key)), contrib)
+        monday = week_start(contrib.day)
+        week = weeks.setdefault(
+            (contrib.user_id, monday),
+            WeeklyTonnage(user_id=contrib.user_id, week=monday))
+        week.set_count += 1
+        week.volume += contrib.volume
+    with transaction.atomic(using=using, savepoint=False):
+        for user_id in {user_id for user_id, _ in exercises}:
+            existing = ExerciseStats.objects.using(using).filter(
+                user_id=user_id,
+                exercise_key__in=[
+                    key for owner_id, key in exercises if owner_id == user_id
+                ])
+            for stats in existing:
+                added = exercises.pop((user_id, stats.exercise_key))
+                changes = {
+                    'name': added.name,
+                    'set_count': F('set_count') + added.set_count,
+                    'total_repeats': F('total_repeats') + added.total_repeats,
+                    'total_volume': F('total_volume') + added.total_volume,
+                }
+                if added.best_weight > stats.best_weight:
+                    changes.update(best_weight=added.best_weight,
+                                   best_weight_at=added.best_weight_at)
+                if added.best_e1rm > stats.best_e1rm:
+                    changes.update(best_e1rm=added.best_e1rm,
+                                   best_e1rm_at=added.best_e1rm_at)
+                ExerciseStats.objects.using(using).filter(
+                    pk=stats.pk).update(**changes)
+            existing = WeeklyTonnage.objects.using(using).filter(
+                user_id=user_id,
+                week__in=[
+                    monday for owner_id, monday in weeks
+                    if owner_id == user_id
+                ])
+            for week in existing:
+                added = weeks.pop((user_id, week.week))
+                WeeklyTonnage.objects.using(using).filter(pk=week.pk).update(
+                    set_count=F('set_count') + added.set_count,
+                    volume=F('volume') + added.volume)
+        ExerciseStats.objects.using(using).bulk_create(exercises.values())
+        WeeklyTonnage.objects.using(using).bulk_create(weeks.values())
+
+
+def sets_deleted(rows, using='default'):
+    """Subtracts many deleted sets (CONTRIBUTION_FIELDS rows) at once: one
+    update per affected exercise and week, records are rescanned only for
+    exercises that lost a set at or above them; aggregates left without
+    sets are deleted"""
+    exercises, weeks = {}, {}
+    for row in rows:
+        contrib = Contribution.from_row(row)
+        accumulate(
+            exercises.setdefault((contrib.user_id, contrib.key),
+                                 ExerciseStats()), contrib)
+        week = weeks.setdefault((contrib.user_id, week_start(contrib.day)),
+                                WeeklyTonnage())
+        week.set_count += 1
+        week.volume += contrib.volume
+    with transaction.atomic(using=using, savepoint=False):
+        for (user_id, key), removed in exercises.items():
+            stats = ExerciseStats.objects.using(using).filter(
+                user_id=user_id, exercise_key=key).first()
+            if stats is None:
+                continue
+            ExerciseStats.objects.using(using).filter(pk=stats.pk).update(
+                set_count=F('set_count') - removed.set_count,
+                total_repeats=F('total_repeats') - removed.total_repeats,
+                total_volume=F('total_volume') - removed.total_volume)
+            # Rows left without sets are deleted below
+            if (stats.set_count > removed.set_count
+                    and (removed.best_weight >= stats.best_weight
+                         or removed.best_e1rm >= stats.best_e1rm)):
+                recompute_records(user_id, key, using)
+        for (user_id, monday), removed in weeks.items():
+            WeeklyTonnage.objects.using(using).filter(
+                user_id=user_id, week=monday).update(
+                    set_count=F('set_count') - removed.set_count,
+                    volume=F('volume') - removed.volume)
+        for user_id in {user_id for user_id, _ in weeks}:
+            ExerciseStats.objects.using(using).filter(
+                user_id=user_id,
+                exercise_key__in=[
+                    key for owner_id, key in exercises if owner_id == user_id
+                ],
+                set_count__lte=0).delete()
+            WeeklyTonnage.objects.using(using).filter(
+                user_id=user_id,
+                week__in=[
+                    monday for owner_id, monday in weeks
+                    if owner_id == user_id
+                ],
+                set_count__lte=0).delete()
+
+
+def exercise_changing(instance):
+    instance._stats_old_name = None
+    if instance.pk:
+        instance._stats_old_name = type(instance).objects.filter(
+            pk=instance.pk).values_list('name', flat=True).first()
+
+
+def exercise_changed(instance):
+    """A renamed exercise moves its sets to another aggregate"""
+    old_name = getattr(instance, '_stats_old_name', None)
+    if old_name is None or exercise_key(old_name) == exercise_key(
+            instance.name):
+        return
+    user_id = Workout.objects.filter(pk=instance.workout_id).values_list(
+        'owner_id', flat=True).get()
+    recompute_exercise(user_id, exercise_key(old_name))
+    recompute_exercise(user_id, exercise_key(instance.name))
+
+
+def workout_changing(instance):
+    instance._stats_old_day = None
+    if instance.pk:
+        instance._stats_old_day = Workout.objects.filter(
+            pk=instance.pk).values_list('created_at', flat=True).first()
+
+
+def workout_changed(instance):
+    """A workout moved to another date changes weeks and record dates"""
+    old_day = getattr(instance, '_stats_old_day', None)
+    if old_day is None or old_day == instance.created_at:
+        return
+    recompute_week(instance.owner_id, week_start(old_day))
+    recompute_week(instance.owner_id, week_start(instance.created_at))
+    names = instance.exercise_set.values_list('name', flat=True)
+    for key in {exercise_key(name) for name in names}:
+        recompute_records(instance.owner_id, key)
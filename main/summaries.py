@@ -0,0 +1,86 @@
+"""Summary columns of workouts: exercise and set counts, tonnage, top weight.
+
+Workout lists show them for every row, so they are stored on Workout rather
+than aggregated per row on read. Whatever changes exercises or sets
+recomputes the summary of the workouts it touched with one UPDATE of
+correlated subqueries, in the same transaction as the change; the
+subqueries only read the rows of those workouts, through the foreign key
+indexes. Workouts created in bulk with their exercises and sets get their
+summary from fill() before the insert instead.
+"""
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import Count, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from .models import Exercise, SetDescription, Workout
+
+BATCH_SIZE = 500
+
+
+def _aggregate(queryset, group_by, aggregate, output_field):
+    rows = queryset.order_by().values(group_by).annotate(
+        value=aggregate).values('value')
+    return Coalesce(Subquery(rows, output_field=output_field), 0,
+                    output_field=output_field)
+
+
+def columns():
+    """Update expressions recomputing the summary of each updated workout"""
+    integer = models.PositiveIntegerField()
+    volume = Workout._meta.get_field('total_volume')
+    weight = Workout._meta.get_field('top_weight')
+    sets = SetDescription.objects.filter(exercise__workout=OuterRef('pk'))
+    return {
+        'exercise_count': _aggregate(
+            Exercise.objects.filter(workout=OuterRef('pk')), 'workout',
+            Count('pk'), integer),
+        'set_count': _aggregate(sets, 'exercise__workout', Count('pk'),
+                                integer),
+        'total_volume': _aggregate(
+            sets, 'exercise__workout',
+            Sum(models.F('weight') * models.F('repeats'),
+                output_field=volume), volume),
+        'top_weight': _aggregate(sets, 'exercise__workout', Max('weight'),
+                                 weight),
+    }
+
+
+def fill(workout, exercises):
+    """Sets the summary of an unsaved workout from its unsaved exercises,
+    each with a `sets` list, so a new workout needs no UPDATE"""
+    sets = [s for exercise in exercises for s in exercise.sets]
+    workout.exercise_count = len(exercises)
+    workout.set_count = len(sets)
+    workout.total_volume = sum(
+        (Decimal(s.weight) * s.repeats for s in sets), Decimal(0))
+    workout.top_weight = max((Decimal(s.weight) for s in sets),
+                             default=Decimal(0))
+
+
+def refresh(workout_ids, using='default'):
+    """Recomputes the summary of the given workouts"""
+    workout_ids = list(workout_ids)
+    with transaction.atomic(using=using, savepoint=False):
+        for start in range(0, len(workout_ids), BATCH_SIZE):
+            Workout.objects.using(using).filter(
+                pk__in=workout_ids[start:start + BATCH_SIZE]).update(
+                    **columns())
+
+
+def rebuild(batch_size=BATCH_SIZE, using='default'):
+    """Recomputes every summary, one transaction per batch of workouts;
+    returns the number of workouts"""
+    count = last_pk = 0
+    while True:
+        with transaction.atomic(using=using):
+            pks = list(
+                Workout.objects.using(using).filter(pk__gt=last_pk).order_by(
+                    'pk').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return count
+            Workout.objects.using(using).filter(pk__in=pks).update(
+                **columns())
+        count += len(pks)
+        last_pk = pks[-1]
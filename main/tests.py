@@ -1,3 +1,1435 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import io
+import tempfile
+import time
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, connections, models
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.http import HttpResponse
+from django.test import (AsyncClient, RequestFactory, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
+from django.utils import timezone
+
+from .apps import sets_bulk_saved, workouts_bulk_created
+from .database import pragma_statements
+from .mailer import send_queued
+from .middlewares import ProfilingMiddleware, ReplicaRoutingMiddleware
+from .models import (AdvUser, Change, DailyActivity, Exercise, ExerciseStats,
+                     Letter, Movement, MovementAlias, SetDescription,
+                     WeeklyTonnage, Workout)
+from .pagination import KeysetPaginator
+from .profiling import QueryRecorder, normalize_sql, percentile, profiler
+from .routers import STICKY_COOKIE
+from workout_diary.databases import parse_database_url
+from . import (activity, analytics, batch, caching, deletion, movements, search,
+               stats)
+from .importers import import_rows
+
+
+def make_workout(user, exercises=1, sets=1, **kwargs):
+    """Creates a workout with `exercises` exercises of `sets` sets each"""
+    kwargs.setdefault('name', 'Тренировка')
+    kwargs.setdefault('created_at', datetime.date(2021, 11, 18))
+    workout = Workout.objects.create(owner=user, **kwargs)
+    for i in range(exercises):
+        exercise = Exercise.objects.create(workout=workout,
+                                           name='Упражнение %d' % i)
+        for number in range(sets, 0, -1):
+            SetDescription.objects.create(exercise=exercise,
+                                          number=number,
+                                          weight=50,
+                                          repeats=10)
+    return workout
+
+
+class WorkoutDetailTests(TestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        self.user = AdvUser.objects.create_user('sportsman', password='pass')
+        self.client.force_login(self.user)
+
+    def query_count(self, workout):
+        url = reverse('main:workout', kwargs={'pk': workout.pk})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_tree_size(self):
+        small = make_workout(self.user, exercises=1, sets=1)
+        large = make_workout(self.user, exercises=12, sets=5)
+        self.assertEqual(self.query_count(small), self.query_count(large))
+
+    def test_sets_are_rendered_in_order(self):
+        workout = make_workout(self.user, exercises=1, sets=3)
+        response = self.client.get(
+            reverse('main:workout', kwargs={'pk': workout.pk}))
+        numbers = [s.number for e in response.context['exercises']
+                   for s in e.setdescription_set.all()]
+        self.assertEqual(numbers, [1, 2, 3])
+
+    def test_other_users_workout_is_not_found(self):
+        stranger = AdvUser.objects.create_user('stranger', password='pass')
+        workout = make_workout(stranger)
+        response = self.client.get(
+            reverse('main:workout', kwargs={'pk': workout.pk}))
+        self.assertEqual(response.status_code, 404)
+
+
+class KeysetPaginatorTests(TestCase):
+    def setUp(self):
+        self.user = AdvUser.objects.create_user('sportsman', password='pass')
+        # Two workouts per day so that the id tie-breaker matters
+        for day in range(1, 6):
+            for _ in range(2):
+                make_workout(self.user, exercises=0,
+                             created_at=datetime.date(2021, 11, day))
+        self.expected = list(
+            Workout.objects.order_by('-created_at', '-id'))
+
+    def walk(self, per_page):
+        paginator = KeysetPaginator(Workout.objects.all(), per_page)
+        page = paginator.get_page()
+        pages = [list(page)]
+        while page.has_next():
+            page = paginator.get_page(page.next_cursor)
+            pages.append(list(page))
+        return paginator, page, pages
+
+    def test_walks_forward_through_every_row_once(self):
+        for per_page in (1, 3, 4, 10, 20):
+            _, _, pages = self.walk(per_page)
+            self.assertEqual(sum(pages, []), self.expected)
+
+    def test_walks_backward_from_the_last_page(self):
+        paginator, page, pages = self.walk(3)
+        back = [list(page)]
+        while page.has_previous():
+            page = paginator.get_page(page.previous_cursor)
+            back.append(list(page))
+        self.assertEqual(back[::-1], pages)
+        self.assertFalse(page.has_previous())
+
+    def test_no_count_query(self):
+        paginator = KeysetPaginator(Workout.objects.all(), 3)
+        first = paginator.get_page()
+        with CaptureQueriesContext(connection) as queries:
+            paginator.get_page(first.next_cursor)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('COUNT(', queries[0]['sql'].upper())
+
+    def test_bad_cursor_gives_first_page(self):
+        paginator = KeysetPaginator(Workout.objects.all(), 3)
+        bad_date = paginator.encode_cursor(['tomorrow', '1'], 'next')
+        bad_id = paginator.encode_cursor(['2021-11-02', 'abc'], 'next')
+        for cursor in ('garbage', '', bad_date, bad_id):
+            page = paginator.get_page(cursor)
+            self.assertEqual(list(page), self.expected[:3])
+
+
+class WorkoutListTests(TestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        self.user = AdvUser.objects.create_user('sportsman', password='pass')
+        self.client.force_login(self.user)
+        for day in range(1, 6):
+            make_workout(self.user, exercises=0,
+                         created_at=datetime.date(2021, 11, day))
+
+    def test_renders_only_the_current_page(self):
+        response = self.client.get(reverse('main:workouts'))
+        self.assertEqual(len(response.context['page']), 2)
+        self.assertNotIn('previous_url', response.context)
+        response = self.client.get(reverse('main:workouts') +
+                                   response.context['next_url'])
+        self.assertEqual([w.created_at.day for w in response.context['page']],
+                         [3, 2])
+        self.assertIn('previous_url', response.context)
+
+    def test_bad_cursor_gives_first_page(self):
+        for values in (['2021-11-02', 'abc'], ['2021-13-45', '1']):
+            cursor = KeysetPaginator.encode_cursor(values, 'next')
+            response = self.client.get(reverse('main:workouts'),
+                                       {'cursor': cursor})
+            self.assertEqual(
+                [w.created_at.day for w in response.context['page']], [5, 4])
+
+    def test_lists_only_own_workouts(self):
+        stranger = AdvUser.objects.create_user('stranger', password='pass')
+        make_workout(stranger, exercises=0,
+                     created_at=datetime.date(2021, 12, 1))
+        response = self.client.get(reverse('main:index'))
+        self.assertEqual(len(response.context['workouts']), 5)
+        self.assertTrue(all(w.owner_id == self.user.pk
+                            for w in response.context['workouts']))
+
+
+class WorkoutContextTests(TestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        self.user = AdvUser.objects.create_user('sportsman', password='pass')
+        self.client.force_login(self.user)
+        make_workout(self.user, exercises=0)
+
+    def test_unrelated_pages_do_not_query_workouts(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('main:password_change'))
+        self.assertFalse(any('main_workout' in query['sql']
+                             for query in queries))
+
+    def test_cached_per_user(self):
+        response = self.client.get(reverse('main:profile'))
+        self.assertContains(response, 'Всего тренировок: 1')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('main:profile'))
+        self.assertFalse(any('main_workout' in query['sql']
+                             for query in queries))
+        make_workout(self.user, exercises=0, name='Спина')
+        response = self.client.get(reverse('main:profile'))
+        self.assertContains(response, 'Всего тренировок: 2')
+        self.assertContains(response, 'Спина')
+
+
+def formset_data(prefix, rows, initial=0):
+    """POST data of a formset with `rows` (dicts of field values)"""
+    data = {
+        prefix + '-TOTAL_FORMS': str(len(rows)),
+        prefix + '-INITIAL_FORMS': str(initial),
+        prefix + '-MIN_NUM_FORMS': '0',
+        prefix + '-MAX_NUM_FORMS': '1000',
+    }
+    for i, row in enumerate(rows):
+        for name, value in row.items():
+            data['%s-%d-%s' % (prefix, i, name)] = value
+    return data
+
+
+class WorkoutFormTests(TestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        self.user = AdvUser.objects.create_user('sportsman', password='pass')
+        self.client.force_login(self.user)
+
+    def workout_data(self, exercises):
+        """`exercises` maps names to lists of (weight, repeats); two empty
+        extra exercise forms and one empty set form each are added, as a
+        browser posts them (repeats keeps its initial 0)"""
+        data = {'name': 'Ноги', 'created_at': '18/11/2021', 'comment': ''}
+        names = list(exercises) + ['', '']
+        data.update(
+            formset_data('exercise_set', [{'name': name} for name in names]))
+        for i, name in enumerate(names):
+            sets = [{
+                'number': str(n),
+                'weight': str(weight),
+                'repeats': str(repeats)
+            } for n, (weight, repeats) in enumerate(
+                exercises.get(name, []), 1)] + [{'repeats': '0'}]
+            data.update(formset_data('exercise_set-%d-sets' % i, sets))
+        return data
+
+    def create(self, exercises):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('main:workout_add'),
+                                        self.workout_data(exercises))
+        self.assertRedirects(response, reverse('main:workouts'),
+                             fetch_redirect_response=False)
+        return len(queries)
+
+    def test_page_renders_nested_formsets(self):
+        response = self.client.get(reverse('main:workout_add'))
+        self.assertContains(response, 'name="exercise_set-5-name"')
+        self.assertContains(response, 'name="exercise_set-5-sets-4-weight"')
+
+    def test_create_workout_tree(self):
+        self.create({'Присед': [(80, 5), (90, 3)], 'Выпады': [(20, 12)]})
+        workout = Workout.objects.get(owner=self.user)
+        self.assertEqual(
+            sorted(workout.exercise_set.values_list('name', flat=True)),
+            ['Выпады', 'Присед'])
+        self.assertEqual(
+            list(SetDescription.objects.filter(
+                exercise__name='Присед').order_by('number').values_list(
+                    'weight', 'repeats')), [(80, 5), (90, 3)])
+        self.assertEqual(
+            ExerciseStats.objects.get(exercise_key='присед').best_weight, 90)
+
+    def test_statements_do_not_grow_with_sets(self):
+        self.create({'Присед': [(80, 5)], 'Выпады': [(20, 12)]})
+        self.assertEqual(
+            self.create({'Присед': [(80, 5)], 'Выпады': [(20, 12)]}),
+            self.create({
+                'Присед': [(80, 5)] * 10,
+                'Выпады': [(20, 12)] * 10
+            }))
+
+    def test_statement_bounds(self):
+        # The derived data of a bulk write is updated in one pass:
+        # one statement per table, whatever the number of rows
+        workout = make_workout(self.user, exercises=1)
+        with self.assertNumQueries(22):
+            batch.create_workouts(self.user, [{
+                'name': 'Спина',
+                'created_at': datetime.date(2021, 11, 20),
+                'exercises': [{
+                    'name': 'Тяга',
+                    'sets': [{'number': 1, 'weight': 80, 'repeats': 5}],
+                }],
+            }])
+        with self.assertNumQueries(24):
+            self.client.post(reverse('main:workout_add'),
+                             self.workout_data({'Присед': [(80, 5)]}))
+        data = {'workout': str(workout.pk), 'name': 'Жим'}
+        data.update(
+            formset_data('setdescription_set', [{
+                'number': '1',
+                'weight': '80',
+                'repeats': '5'
+            }]))
+        with self.assertNumQueries(29):
+            self.client.post(
+                reverse('main:set_add', kwargs={'workout_pk': workout.pk}),
+                data)
+
+    def test_sets_without_exercise_are_rejected(self):
+        data = self.workout_data({'Присед': [(80, 5)]})
+        data.update({
+            'exercise_set-1-sets-0-number': '1',
+            'exercise_set-1-sets-0-weight': '50',
+        })
+        response = self.client.post(reverse('main:workout_add'), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Укажите упражнение')
+        self.assertFalse(Workout.objects.exists())
+
+    def test_bulk_set_update(self):
+        workout = make_workout(self.user, exercises=1, sets=3)
+        exercise = workout.exercise_set.get()
+        sets = list(exercise.setdescription_set.order_by('number'))
+        rows = [{
+            'id': str(s.pk),
+            'number': str(s.number),
+            'weight': '50.0',
+            'repeats': '10'
+        } for s in sets]
+        rows[0]['weight'] = '70'
+        rows[1]['DELETE'] = 'on'
+        rows.append({'number': '4', 'weight': '60', 'repeats': '8'})
+        rows.append({'repeats': '0'})
+        url = reverse('main:sets_change',
+                      kwargs={
+                          'workout_pk': workout.pk,
+                          'exercise_id': exercise.pk
+                      })
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                url, formset_data('setdescription_set', rows, initial=3))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            list(exercise.setdescription_set.order_by('number').values_list(
+                'number', 'weight')), [(1, 70), (3, 50), (4, 60)])
+        updates = [q['sql'] for q in queries
+                   if q['sql'].startswith('UPDATE "main_setdescription"')]
+        self.assertEqual(len(updates), 1)
+        totals = ExerciseStats.objects.values_list('set_count',
+                                                   'total_volume',
+                                                   'best_weight').get()
+        stats.rebuild_user(self.user.pk)
+        self.assertEqual(
+            ExerciseStats.objects.values_list('set_count', 'total_volume',
+                                              'best_weight').get(), totals)
+        stranger = AdvUser.objects.create_user('stranger', password='pass')
+        self.client.force_login(stranger)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_add_exercise_with_sets(self):
+        workout = make_workout(self.user, exercises=0)
+        data = {'workout': str(workout.pk), 'name': 'Тяга'}
+        data.update(
+            formset_data('setdescription_set', [{
+                'number': '1',
+                'weight': '80',
+                'repeats': '5'
+            }, {'repeats': '0'}]))
+        response = self.client.post(
+            reverse('main:set_add', kwargs={'workout_pk': workout.pk}), data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            SetDescription.objects.get(exercise__name='Тяга').weight, 80)
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        caching.counters.clear()
+        self.user = AdvUser.objects.create_user('sportsman', password='pass')
+        self.client.force_login(self.user)
+        self.chest = make_workout(self.user, name='Грудь')
+        self.legs = make_workout(self.user, name='Ноги')
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        workout_queries = [q for q in queries if 'main_workout' in q['sql']]
+        return response, workout_queries
+
+    def test_detail_is_invalidated_per_workout(self):
+        chest_url = reverse('main:workout', kwargs={'pk': self.chest.pk})
+        legs_url = reverse('main:workout', kwargs={'pk': self.legs.pk})
+        self.get(chest_url)
+        self.get(legs_url)
+        response, queries = self.get(chest_url)
+        self.assertEqual(queries, [])
+        self.assertEqual(caching.cache_stats()['hits'], 1)
+        set_description = SetDescription.objects.get(
+            exercise__workout=self.chest)
+        set_description.repeats = 7
+        set_description.save()
+        response, queries = self.get(chest_url)
+        self.assertTrue(queries)
+        _, queries = self.get(legs_url)
+        self.assertEqual(queries, [])
+
+    def test_list_follows_new_workouts(self):
+        self.get(reverse('main:index'))
+        make_workout(self.user, name='Спина')
+        response, _ = self.get(reverse('main:index'))
+        self.assertContains(response, 'Спина')
+
+    def test_evicted_version_does_not_revive_old_pages(self):
+        url = reverse('main:index')
+        caching.get_cache().clear()
+        self.get(url)
+        Workout.objects.filter(pk=self.legs.pk).update(name='Спина')
+        # Evicted before the page entry, then seeded again
+        caching.get_cache().delete(caching.version_key('user', self.user.pk))
+        response, queries = self.get(url)
+        self.assertTrue(queries)
+        self.assertContains(response, 'Спина')
+
+    def test_pages_with_messages_are_not_cached(self):
+        url = reverse('main:workouts')
+        self.get(url)
+        response = self.client.post(
+            reverse('main:workout_delete',
+                    kwargs={'workout_pk': self.legs.pk}), follow=True)
+        self.assertContains(response, 'Тренировка удалена')
+        self.assertEqual(caching.cache_stats()['bypassed'], 1)
+        response, _ = self.get(url)
+        self.assertNotContains(response, 'Тренировка удалена')
+
+    def test_stats_endpoint_is_staff_only(self):
+        response = self.client.get(reverse('main:cache_stats'))
+        self.assertEqual(response.status_code, 302)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse('main:cache_stats'))
+        self.assertEqual(response.json()['alias'], 'workouts')
+
+
+@override_settings(PROFILING_SAMPLE_RATE=1)
+class ProfilingTests(TestCase):
+    def setUp(self):
+        profiler.reset()
+        self.user = AdvUser.objects.create_user('sportsman', password='pass',
+                                                is_staff=True)
+        self.client.force_login(self.user)
+
+    def test_normalized_duplicates(self):
+        self.assertEqual(
+            normalize_sql('SELECT * FROM t WHERE id IN (%s, %s) AND x = 5'),
+            normalize_sql('SELECT * FROM t WHERE id IN (%s)  AND x = 7'))
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for user in AdvUser.objects.all():
+                Workout.objects.filter(owner=user, pk__in=[1, 2]).count()
+                Workout.objects.filter(owner=user, pk__in=[3]).count()
+        self.assertEqual(recorder.count, 3)
+        self.assertEqual(list(recorder.duplicates().values()), [2])
+
+    def test_percentile(self):
+        self.assertEqual(percentile(list(range(1, 101)), 0.9), 90)
+        self.assertEqual(percentile([5], 0.99), 5)
+
+    def test_report_per_url_name(self):
+        for _ in range(3):
+            self.client.get(reverse('main:workouts'))
+        self.client.get('/api/workouts/')
+        report = self.client.get(reverse('main:profiling')).json()
+        self.assertEqual(report['main:workouts']['requests'], 3)
+        self.assertGreater(report['main:workouts']['queries']['p50'], 0)
+        self.assertIn('api:workouts', report)
+
+    @override_settings(PROFILING_SAMPLE_RATE=0)
+    def test_sampling_off(self):
+        self.client.get(reverse('main:workouts'))
+        self.assertEqual(profiler.report(), {})
+
+    def test_staff_only(self):
+        self.user.is_staff = False
+        self.user.save()
+        response = self.client.get(reverse('main:profiling'))
+        self.assertEqual(response.status_code, 302)
+
+
+async def sleep_view(request):
+    await asyncio.sleep(0.2)
+    return HttpResponse()
+
+
+# ROOT_URLCONF of AsyncMiddlewareTests
+urlpatterns = [path('sleep/', sleep_view)]
+
+
+@override_settings(PROFILING_SAMPLE_RATE=1)
+class AsyncMiddlewareTests(TransactionTestCase):
+    # The view queries from a worker thread with its own connection
+
+    def setUp(self):
+        profiler.reset()
+
+    def chain(self, view):
+        return ProfilingMiddleware(ReplicaRoutingMiddleware(view))
+
+    @override_settings(ROOT_URLCONF='main.tests')
+    async def test_requests_run_concurrently(self):
+        # Through the whole MIDDLEWARE stack: one sync middleware would
+        # run every request in the same thread, one after another
+        client = AsyncClient()
+        start = time.perf_counter()
+        await asyncio.gather(*[client.get('/sleep/') for _ in range(5)])
+        self.assertLess(time.perf_counter() - start, 0.6)
+
+    async def test_queries_in_worker_threads_are_profiled(self):
+        async def view(request):
+            await sync_to_async(Workout.objects.count,
+                                thread_sensitive=False)()
+            return HttpResponse()
+
+        response = await self.chain(view)(RequestFactory().post('/'))
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        self.assertEqual(profiler.report()['unresolved']['queries']['max'],
+                         1)
+
+
+class DatabaseUrlTests(TestCase):
+    def test_sqlite(self):
+        self.assertEqual(parse_database_url('sqlite:////srv/diary.sqlite3'),
+                         {'ENGINE': 'django.db.backends.sqlite3',
+                          'NAME': '/srv/diary.sqlite3',
+                          'CONN_MAX_AGE': 0})
+
+    def test_postgres_behind_pgbouncer(self):
+        config = parse_database_url(
+            'postgres://diary:p%40ss@db:6432/diary?sslmode=require'
+            '&pgbouncer=1', conn_max_age=60)
+        self.assertEqual(config['PASSWORD'], 'p@ss')
+        self.assertEqual(config['PORT'], '6432')
+        self.assertEqual(config['CONN_MAX_AGE'], 60)
+        self.assertEqual(config['OPTIONS'], {'sslmode': 'require'})
+        self.assertTrue(config['DISABLE_SERVER_SIDE_CURSORS'])
+
+    def test_unknown_scheme(self):
+        with self.assertRaises(ValueError):
+            parse_database_url('mysql://localhost/diary')
+
+
+class PragmaTests(TestCase):
+    def test_rejects_unsafe_names_and_values(self):
+        for pragmas in ({'journal_mode; DROP TABLE main_workout': 'wal'},
+                        {'Journal_Mode': 'wal'},
+                        {'journal_mode': 'wal; DROP TABLE main_workout'},
+                        {'journal_mode': "'wal'"},
+                        {'cache_size': '1.5'}):
+            with self.assertRaises(ValueError):
+                pragma_statements(pragmas)
+
+    @override_settings(SQLITE_PRAGMAS={'journal_mode': 'wal',
+                                       'synchronous': 'normal',
+                                       'busy_timeout': 2500})
+    def test_new_connection_is_configured(self):
+        # The test database lives in memory, where WAL is not available
+        with tempfile.TemporaryDirectory() as directory:
+            wrapper = DatabaseWrapper(
+                dict(connection.settings_dict,
+                     NAME='%s/diary.sqlite3' % directory), 'pragmas')
+            try:
+                with wrapper.cursor() as cursor:
+                    values = {}
+                    for name in ('journal_mode', 'synchronous',
+                                 'busy_timeout', 'foreign_keys'):
+                        cursor.execute('PRAGMA %s' % name)
+                        values[name] = cursor.fetchone()[0]
+            finally:
+                wrapper.close()
+        # synchronous=NORMAL reads back as 1
+        self.assertEqual(values, {'journal_mode': 'wal', 'synchronous': 1,
+                                  'busy_timeout': 2500, 'foreign_keys': 1})
+
+
+@override_settings(USE_REPLICA=True)
+class ReplicaRoutingTests(TransactionTestCase):
+    # In tests the replica alias is a second connection to the test
+    # database, so it sees committed data only: no wrapping transaction
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        caching.get_cache().clear()
+        self.user = AdvUser.objects.create_user('sportsman', password='pass')
+        self.workout = make_workout(self.user)
+        self.client.force_login(self.user)
+
+    def workout_reads(self, url):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        def reads(queries):
+            return len([q for q in queries
+                        if q['sql'].startswith('SELECT')
+                        and 'main_workout' in q['sql']])
+        return reads(primary), reads(replica)
+
+    def test_listed_views_read_from_replica(self):
+        primary, replica = self.workout_reads(
+            reverse('main:workout', kwargs={'pk': self.workout.pk}))
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+        primary, replica = self.workout_reads('/api/workouts/')
+        self.assertEqual(primary, 0)
+
+    def test_other_views_read_from_primary(self):
+        primary, replica = self.workout_reads(reverse('main:stats'))
+        self.assertEqual(replica, 0)
+
+    def test_reads_stick_to_primary_after_a_write(self):
+        response = self.client.post(reverse('main:workout_delete',
+                                            kwargs={'workout_pk':
+                                                    self.workout.pk}))
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        primary, replica = self.workout_reads(reverse('main:workouts'))
+        self.assertEqual(replica, 0)
+        self.assertGreater(primary, 0)
+
+    @override_settings(USE_REPLICA=False)
+    def test_disabled_without_replica(self):
+        primary, replica = self.workout_reads('/api/workouts/')
+        self.assertEqual(replica, 0)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = AdvUser.objects.create_user('sportsman', password='pass')
+        self.bench = make_workout(self.user, exercises=0, name='Грудь',
+                                  comment='Тяжело')
+        Exercise.objects.create(workout=self.bench, name='Жим лёжа')
+        self.legs = make_workout(self.user, exercises=0, name='Ноги',
+                                 comment='Присед и жим ногами')
+
+    def found(self, keyword):
+        workouts = Workout.objects.filter(owner=self.user)
+        return set(search.filter_workouts(workouts, keyword))
+
+    def test_index_is_available(self):
+        self.assertTrue(search.is_available())
+
+    def test_case_and_yo_folding_with_prefixes(self):
+        self.assertEqual(self.found('ЖИМ ЛЕЖ'), {self.bench})
+        self.assertEqual(self.found('грудь'), {self.bench})
+        self.assertEqual(self.found('жим'), {self.bench, self.legs})
+        self.assertEqual(self.found('прис'), {self.legs})
+        self.assertEqual(self.found('становая'), set())
+
+    def test_index_follows_changes(self):
+        Exercise.objects.create(workout=self.legs, name='Становая тяга')
+        self.assertEqual(self.found('станов'), {self.legs})
+        self.legs.name = 'Спина'
+        self.legs.save()
+        self.assertEqual(self.found('спина'), {self.legs})
+        self.legs.delete()
+        self.assertEqual(self.found('станов'), set())
+
+    def test_ranked_results_are_owner_scoped(self):
+        stranger = AdvUser.objects.create_user('stranger', password='pass')
+        make_workout(stranger, exercises=0, name='Жим')
+        self.assertEqual(search.search_workouts(self.user, 'жим')[0],
+                         self.bench)
+        self.assertEqual(len(search.search_workouts(self.user, 'жим')), 2)
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s' % search.FTS_TABLE)
+        self.assertEqual(self.found('жим'), set())
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(self.found('жим'), {self.bench, self.legs})
+
+
+class FlakyBackend(EmailBackend):
+    """Counts opened connections and fails for one recipient"""
+    opened = 0
+
+    def open(self):
+        FlakyBackend.opened += 1
+        return super().open()
+
+    def send_messages(self, messages):
+        if any('broken' in m.to[0] for m in messages):
+            raise OSError('Mailbox unavailable')
+        return super().send_messages(messages)
+
+
+class OutboxTests(TestCase):
+    def register(self, username):
+        return self.client.post(reverse('main:register'), {
+            'username': username,
+            'email': username + '@example.com',
+            'password1': 'Secret-pass-123',
+            'password2': 'Secret-pass-123',
+        })
+
+    def test_registration_only_queues_the_letter(self):
+        response = self.register('sportsman')
+        self.assertRedirects(response, reverse('main:register_done'))
+        self.assertEqual(len(mail.outbox), 0)
+        letter = Letter.objects.get()
+        self.assertEqual(letter.status, Letter.PENDING)
+        self.assertEqual(letter.recipient, 'sportsman@example.com')
+
+    def test_worker_sends_a_batch_over_one_connection(self):
+        for name in ('first', 'second', 'third'):
+            self.register(name)
+        FlakyBackend.opened = 0
+        self.assertEqual(send_queued(connection=FlakyBackend()), (3, 0))
+        self.assertEqual(FlakyBackend.opened, 1)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertFalse(
+            Letter.objects.exclude(status=Letter.SENT).exists())
+        self.assertEqual(send_queued(), (0, 0))
+
+    def test_failed_letters_are_retried_with_backoff(self):
+        self.register('broken')
+        with self.assertLogs('main.mailer', 'WARNING'):
+            self.assertEqual(send_queued(connection=FlakyBackend()), (0, 1))
+        letter = Letter.objects.get()
+        self.assertEqual(letter.attempts, 1)
+        self.assertEqual(letter.status, Letter.PENDING)
+        self.assertGreater(letter.next_attempt_at, timezone.now())
+        self.assertIn('Mailbox unavailable', letter.last_error)
+        # Not due yet
+        self.assertEqual(send_queued(connection=FlakyBackend()), (0, 0))
+        with self.settings(MAILER_MAX_ATTEMPTS=2):
+            Letter.objects.update(next_attempt_at=timezone.now())
+            with self.assertLogs('main.mailer', 'WARNING'):
+                send_queued(connection=FlakyBackend())
+        self.assertEqual(Letter.objects.get().status, Letter.FAILED)
+
+
+class StatsTests(TestCase):
+    def setUp(self):
+        self.user = AdvUser.objects.create_user('sportsman', password='pass')
+        self.monday = make_workout(self.user, exercises=0,
+                                   created_at=datetime.date(2021, 11, 15))
+        self.bench = Exercise.objects.create(workout=self.monday,
+                                             name='Жим лёжа')
+        self.heavy = SetDescription.objects.create(exercise=self.bench,
+                                                   number=1, weight=80,
+                                                   repeats=3)
+        SetDescription.objects.create(exercise=self.bench, number=2,
+                                      weight=60, repeats=10)
+        friday = make_workout(self.user, exercises=0,
+                              created_at=datetime.date(2021, 11, 19))
+        self.bench2 = Exercise.objects.create(workout=friday,
+                                              name='жим лежа ')
+        SetDescription.objects.create(exercise=self.bench2, number=1,
+                                      weight=70, repeats=5)
+
+    def snapshot(self):
+        exercises = list(ExerciseStats.objects.filter(
+            user=self.user).order_by('exercise_key').values(
+                'exercise_key', 'set_count', 'total_repeats', 'total_volume',
+                'best_weight', 'best_weight_at', 'best_e1rm',
+                'best_e1rm_at'))
+        weeks = list(WeeklyTonnage.objects.filter(
+            user=self.user).order_by('week').values(
+                'week', 'set_count', 'volume'))
+        return exercises, weeks
+
+    def assertConsistent(self):
+        incremental = self.snapshot()
+        stats.rebuild_user(self.user.pk)
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_aggregates(self):
+        row = ExerciseStats.objects.get(user=self.user)
+        self.assertEqual(row.exercise_key, 'жим лежа')
+        self.assertEqual(row.set_count, 3)
+        self.assertEqual(row.total_volume, 80 * 3 + 60 * 10 + 70 * 5)
+        self.assertEqual(row.best_weight, 80)
+        self.assertEqual(row.best_e1rm, 88)  # 80 * (1 + 3 / 30)
+        self.assertEqual(WeeklyTonnage.objects.get().volume, 1190)
+        self.assertConsistent()
+
+    def test_backfill_migration(self):
+        migration = __import__('main.migrations.0019_backfill_training_stats',
+                               fromlist=['backfill_stats'])
+        expected = self.snapshot()
+        ExerciseStats.objects.all().delete()
+        WeeklyTonnage.objects.all().delete()
+        migration.backfill_stats(apps, connection.schema_editor())
+        self.assertEqual(self.snapshot(), expected)
+
+    def test_updates_and_deletes(self):
+        self.heavy.weight = 90
+        self.heavy.save()
+        self.assertConsistent()
+        self.heavy.delete()
+        self.assertEqual(ExerciseStats.objects.get().best_weight, 70)
+        self.assertConsistent()
+        self.bench2.name = 'Присед'
+        self.bench2.save()
+        self.assertEqual(ExerciseStats.objects.count(), 2)
+        self.assertConsistent()
+        self.monday.created_at = datetime.date(2021, 11, 1)
+        self.monday.save()
+        self.assertConsistent()
+        self.monday.delete()
+        self.assertConsistent()
+
+    def test_bulk_deletes(self):
+        deletion.delete_exercise(self.bench2)
+        self.assertEqual(ExerciseStats.objects.get().set_count, 2)
+        self.assertConsistent()
+        deletion.delete_workouts(Workout.objects.filter(pk=self.monday.pk))
+        self.assertFalse(ExerciseStats.objects.exists())
+        self.assertFalse(WeeklyTonnage.objects.exists())
+        self.assertConsistent()
+
+    def test_exercise_without_sets_leaves_stats(self):
+        self.client.force_login(self.user)
+        self.bench2.name = 'Присед'
+        self.bench2.save()
+        self.bench2.setdescription_set.get().delete()
+        self.assertConsistent()
+        response = self.client.get('/api/stats/')
+        self.assertEqual([e['exercise_key'] for e in response.json()[
+            'exercises']], ['жим лежа'])
+        self.assertNotContains(self.client.get(reverse('main:stats')),
+                               'Присед')
+
+    def test_reads_do_not_scan_history(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/stats/')
+        self.assertEqual(response.json()['exercises'][0]['best_weight'],
+                         '80.0')
+        self.assertFalse(any('main_setdescription' in q['sql']
+                             for q in queries))
+        response = self.client.get(reverse('main:stats'))
+        self.assertContains(response, 'жим лежа')
+
+
+class DeletionTests(TestCase):
+    def setUp(self):
+        self.user = AdvUser.objects.create_user('sportsman', password='pass')
+
+    def deletes(self, function, *args):
+        with CaptureQueriesContext(connection) as queries:
+            function(*args)
+        return [q['sql'] for q in queries if q['sql'].startswith('DELETE')]
+
+    def test_constant_number_of_deletes(self):
+        small = make_workout(self.user, exercises=1, sets=1)
+        large = make_workout(self.user, exercises=10, sets=5,
+                             created_at=datetime.date(2021, 11, 19))
+        self.assertEqual(
+            len(self.deletes(deletion.delete_workouts,
+                             Workout.objects.filter(pk=small.pk))),
+            len(self.deletes(deletion.delete_workouts,
+                             Workout.objects.filter(pk=large.pk))))
+        self.assertFalse(Exercise.objects.exists())
+        self.assertFalse(SetDescription.objects.exists())
+
+    def test_user_delete(self):
+        for _ in range(3):
+            make_workout(self.user, exercises=3, sets=3)
+        stranger = AdvUser.objects.create_user('stranger', password='pass')
+        kept = make_workout(stranger, name='Жим')
+        statements = self.deletes(self.user.delete)
+        self.assertLess(len(statements), 16)
+        self.assertEqual(list(Workout.objects.all()), [kept])
+        self.assertEqual(SetDescription.objects.count(), 1)
+        self.assertEqual(ExerciseStats.objects.get().user, stranger)
+        self.assertEqual(search.search_workouts(stranger, 'жим'), [kept])
+        # The derived rows go with the user row
+        self.assertEqual(
+            set(Change.objects.values_list('user_id', flat=True)),
+            {stranger.pk})
+        self.assertEqual(
+            set(DailyActivity.objects.values_list('user_id', flat=True)),
+            {stranger.pk})
+
+    def test_failed_user_delete_keeps_the_data(self):
+        make_workout(self.user, exercises=2, sets=2)
+        with mock.patch.object(models.Model, 'delete',
+                               side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.user.delete()
+        self.assertEqual(SetDescription.objects.count(), 4)
+        self.assertTrue(AdvUser.objects.filter(pk=self.user.pk).exists())
+
+    @override_settings(ACCOUNT_SOFT_DELETE_WORKOUTS=3)
+    def test_large_accounts_are_purged_later(self):
+        for _ in range(3):
+            make_workout(self.user, exercises=2, sets=2)
+        self.client.force_login(self.user)
+        self.client.post(reverse('main:profile_delete'))
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertIsNotNone(self.user.deletion_requested)
+        self.assertEqual(Workout.objects.count(), 3)
+        call_command('purge_deleted_users', chunk_size=2,
+                     stdout=io.StringIO())
+        self.assertFalse(AdvUser.objects.exists())
+        self.assertFalse(SetDescription.objects.exists())
+
+    def test_small_accounts_are_deleted_at_once(self):
+        make_workout(self.user)
+        self.client.force_login(self.user)
+        self.client.post(reverse('main:profile_delete'))
+        self.assertFalse(AdvUser.objects.exists())
+        self.assertFalse(Workout.objects.exists())
+
+
+class MovementTests(TestCase):
+    def setUp(self):
+        self.user = AdvUser.objects.create_user('sportsman', password='pass')
+        self.client.force_login(self.user)
+
+    def exercise(self, name, day=18, weights=(50, )):
+        workout = Workout.objects.create(owner=self.user,
+                                         name='Тренировка',
+                                         created_at=datetime.date(
+                                             2021, 11, day))
+        exercise = Exercise.objects.create(workout=workout, name=name)
+        for number, weight in enumerate(weights, 1):
+            SetDescription.objects.create(exercise=exercise,
+                                          number=number,
+                                          weight=weight,
+                                          repeats=10)
+        return exercise
+
+    def test_spellings_share_a_movement(self):
+        first = self.exercise('Жим лёжа')
+        second = self.exercise('  жим  ЛЕЖА ')
+        other = self.exercise('Присед')
+        self.assertEqual(first.movement_id, second.movement_id)
+        self.assertNotEqual(first.movement_id, other.movement_id)
+        self.assertEqual(first.movement.name, 'Жим лёжа')
+        stranger = AdvUser.objects.create_user('stranger', password='pass')
+        self.assertNotEqual(
+            movements.resolve(stranger.pk, ['Жим лёжа'])['Жим лёжа'],
+            first.movement_id)
+
+    def test_rename_follows_name(self):
+        exercise = self.exercise('Жим лёжа')
+        squat = self.exercise('Присед').movement_id
+        exercise.name = 'присед'
+        exercise.save()
+        self.assertEqual(exercise.movement_id, squat)
+
+    def test_rename_keeping_the_spelling_skips_lookups(self):
+        exercise = self.exercise('Жим лёжа')
+        exercise.name = 'жим  лежа'
+        with mock.patch.object(movements, 'resolve') as resolve:
+            exercise.save()
+        resolve.assert_not_called()
+
+    def test_concurrently_added_spelling(self):
+        bench = self.exercise('Жим лёжа').movement_id
+        # The other request added the alias after this one looked it up
+        with mock.patch.object(movements, '_movement_ids',
+                               side_effect=[{}, {'жим лежа': bench}]):
+            ids = movements.resolve(self.user.pk, ['жим лежа', 'Присед'])
+        self.assertEqual(ids['жим лежа'], bench)
+        self.assertEqual(Movement.objects.filter(owner=self.user).count(), 2)
+
+    def test_import_resolves_in_bulk(self):
+        self.exercise('Становая тяга')
+        lines = ['date,workout,comment,exercise,number,weight,repeats',
+                 '2021-11-18,Спина,,становая  тяга,1,100,5',
+                 '2021-11-18,Спина,,Тяга блока,1,40,12']
+        import_rows(self.user, lines)
+        self.assertEqual(Movement.objects.filter(owner=self.user).count(), 2)
+        self.assertFalse(Exercise.objects.filter(movement=None).exists())
+
+    def test_merge(self):
+        bench = self.exercise('Жим лёжа')
+        press = self.exercise('Жим штанги лёжа')
+        self.assertEqual(
+            movements.merge(bench.movement, [press.movement]), 1)
+        press.refresh_from_db()
+        self.assertEqual(press.movement_id, bench.movement_id)
+        self.assertEqual(
+            self.exercise('жим штанги лежа').movement_id, bench.movement_id)
+
+    def test_catalogue_migration(self):
+        migration = __import__('main.migrations.0012_dedupe_movements',
+                               fromlist=['build_catalogue'])
+        self.exercise('Жим лёжа')
+        self.exercise('жим лежа')
+        self.exercise('жим лежа')
+        Exercise.objects.update(movement=None)
+        Movement.objects.all().delete()
+        migration.build_catalogue(apps, connection.schema_editor())
+        movement = Movement.objects.get()
+        self.assertEqual(movement.name, 'жим лежа')
+        self.assertEqual(MovementAlias.objects.get().key, 'жим лежа')
+        self.assertEqual(Exercise.objects.filter(movement=movement).count(),
+                         3)
+
+    def test_history(self):
+        self.exercise('Жим лёжа', day=1, weights=(40, 45))
+        self.exercise('Присед', day=2)
+        movement = self.exercise('жим лежа', day=3, weights=(50, 55)).movement
+        response = self.client.get(
+            reverse('main:movement', kwargs={'pk': movement.pk}))
+        self.assertEqual([(s.exercise.workout.created_at.day, s.number)
+                          for s in response.context['page']],
+                         [(3, 1), (3, 2), (1, 1), (1, 2)])
+        url = reverse('api:movement_history', kwargs={'pk': movement.pk})
+        data = self.client.get(url, {'limit': 3}).json()
+        self.assertEqual([s['weight'] for s in data['results']],
+                         ['50.0', '55.0', '40.0'])
+        self.assertEqual(data['results'][0]['date'], '2021-11-03')
+        data = self.client.get(data['next']).json()
+        self.assertEqual([s['weight'] for s in data['results']], ['45.0'])
+        stranger = AdvUser.objects.create_user('stranger', password='pass')
+        self.client.force_login(stranger)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_history_uses_movement_index(self):
+        movement = self.exercise('Жим лёжа').movement
+        sql = str(movements.history(movement).order_by(
+            *movements.HISTORY_ORDERING).query)
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql.replace(
+                '= %d' % movement.pk, '= %s'), [movement.pk])
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('exercise_movement_workout_idx', plan)
+
+
+class WorkoutSummaryTests(TestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        self.user = AdvUser.objects.create_user('sportsman', password='pass')
+
+    def summary(self, workout):
+        return Workout.objects.filter(pk=workout.pk).values_list(
+            *Workout.SUMMARY_FIELDS).get()
+
+    def test_single_writes_keep_summary(self):
+        workout = make_workout(self.user, exercises=2, sets=3)
+        self.assertEqual(self.summary(workout), (2, 6, 3000, 50))
+        set_description = SetDescription.objects.filter(
+            exercise__workout=workout).first()
+        set_description.weight = '62.5'
+        set_description.repeats = 8
+        set_description.save()
+        self.assertEqual(self.summary(workout), (2, 6, 3000, Decimal('62.5')))
+        set_description.delete()
+        self.assertEqual(self.summary(workout), (2, 5, 2500, 50))
+        deletion.delete_exercise(workout.exercise_set.first())
+        self.assertEqual(self.summary(workout), (1, 3, 1500, 50))
+        workout.exercise_set.get().delete()
+        self.assertEqual(self.summary(workout), (0, 0, 0, 0))
+
+    def test_bulk_writes_keep_summary(self):
+        workout, = batch.create_workouts(self.user, [{
+            'name': 'Ноги',
+            'created_at': datetime.date(2021, 11, 18),
+            'exercises': [{
+                'name': 'Присед',
+                'sets': [{'number': 1, 'weight': 80, 'repeats': 5},
+                         {'number': 2, 'weight': 90, 'repeats': 3}],
+            }],
+        }])
+        self.assertEqual(self.summary(workout), (1, 2, 670, 90))
+        exercise = workout.exercises[0]
+        first, second = exercise.sets
+        first.repeats = 6
+        batch.save_sets(exercise, updated=[first], fields=['repeats'],
+                        deleted=[second])
+        self.assertEqual(self.summary(workout), (1, 1, 480, 80))
+        import_rows(self.user, io.StringIO(IMPORT_CSV), 'csv')
+        self.assertEqual(self.summary(Workout.objects.get(name='Грудь')),
+                         (2, 3, 1100, 70))
+
+    def test_bulk_signals_carry_the_alias(self):
+        sent = []
+
+        def receiver(sender, using, **kwargs):
+            sent.append(using)
+
+        workouts_bulk_created.connect(receiver)
+        sets_bulk_saved.connect(receiver)
+        try:
+            workout, = batch.create_workouts(self.user, [{
+                'name': 'Ноги',
+                'created_at': datetime.date(2021, 11, 18),
+                'exercises': [{'name': 'Присед', 'sets': []}],
+            }], using='default')
+            batch.save_sets(workout.exercises[0],
+                            created=[SetDescription(number=1, weight=80,
+                                                    repeats=5)])
+        finally:
+            workouts_bulk_created.disconnect(receiver)
+            sets_bulk_saved.disconnect(receiver)
+        self.assertEqual(sent, ['default', 'default'])
+
+    def test_stale_instance_does_not_overwrite_summary(self):
+        workout = make_workout(self.user, exercises=0)
+        Exercise.objects.create(workout=workout, name='Жим')
+        workout.name = 'Грудь'
+        workout.save()
+        self.assertEqual(self.summary(workout)[0], 1)
+
+    def test_rebuild_command(self):
+        workouts = [make_workout(self.user, exercises=2, sets=2)
+                    for _ in range(3)]
+        Workout.objects.update(exercise_count=0, set_count=0,
+                               total_volume=0, top_weight=0)
+        out = io.StringIO()
+        call_command('rebuild_workout_summaries', batch_size=2, stdout=out)
+        self.assertIn('3', out.getvalue())
+        for workout in workouts:
+            self.assertEqual(self.summary(workout), (2, 4, 2000, 50))
+
+    def test_list_shows_summary_without_extra_queries(self):
+        self.client.force_login(self.user)
+        make_workout(self.user, exercises=2, sets=3)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('main:workouts'))
+        self.assertContains(response, 'подходов: 6')
+        self.assertFalse(
+            [q for q in queries if 'main_setdescription' in q['sql']])
+        set_description = SetDescription.objects.first()
+        set_description.delete()
+        response = self.client.get(reverse('main:workouts'))
+        self.assertContains(response, 'подходов: 5')
+
+
+class DailyActivityTests(TestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        self.user = AdvUser.objects.create_user('sportsman', password='pass')
+
+    def days(self):
+        return list(
+            DailyActivity.objects.filter(user=self.user).values_list(
+                'day', 'sessions', 'set_count', 'volume'))
+
+    def assertRebuildAgrees(self):
+        days = self.days()
+        activity.rebuild_user(self.user.pk)
+        self.assertEqual(days, self.days())
+
+    def test_single_writes(self):
+        day = datetime.date(2021, 11, 18)
+        next_day = datetime.date(2021, 11, 19)
+        first = make_workout(self.user, exercises=2, sets=2)
+        make_workout(self.user)
+        self.assertEqual(self.days(), [(day, 2, 5, 2500)])
+        set_description = SetDescription.objects.filter(
+            exercise__workout=first).first()
+        set_description.repeats = 20
+        set_description.save()
+        self.assertEqual(self.days(), [(day, 2, 5, 3000)])
+        first.created_at = next_day
+        first.save()
+        self.assertEqual(self.days(), [(day, 1, 1, 500),
+                                       (next_day, 1, 4, 2500)])
+        self.assertRebuildAgrees()
+        first.delete()
+        self.assertEqual(self.days(), [(day, 1, 1, 500)])
+        self.assertRebuildAgrees()
+
+    def test_bulk_writes(self):
+        import_rows(self.user, io.StringIO(IMPORT_CSV), 'csv')
+        self.assertEqual(self.days(),
+                         [(datetime.date(2021, 11, 1), 1, 3, 1100),
+                          (datetime.date(2021, 11, 3), 1, 1, 400),
+                          (datetime.date(2021, 11, 6), 1, 0, 0)])
+        self.assertRebuildAgrees()
+        deletion.delete_workouts(
+            Workout.objects.filter(created_at__gt=datetime.date(2021, 11, 1)))
+        self.assertEqual(self.days(),
+                         [(datetime.date(2021, 11, 1), 1, 3, 1100)])
+
+    def test_window_is_an_index_range_scan(self):
+        start, end = datetime.date(2021, 1, 1), datetime.date(2021, 12, 31)
+        sql, params = activity.window(self.user.pk, start,
+                                      end).query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        # The unique constraint's index, whatever SQLite names it
+        self.assertIn('USING INDEX', plan)
+        self.assertIn('user_id=? AND day>?', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_rebuild_command(self):
+        make_workout(self.user, exercises=2, sets=2)
+        days = self.days()
+        DailyActivity.objects.all().delete()
+        out = io.StringIO()
+        call_command('rebuild_activity', stdout=out)
+        self.assertIn('1', out.getvalue())
+        self.assertEqual(self.days(), days)
+
+    def test_calendar_page(self):
+        self.client.force_login(self.user)
+        make_workout(self.user, exercises=2, sets=2)
+        make_workout(self.user, created_at=datetime.date(2021, 11, 19))
+        response = self.client.get(reverse('main:calendar') + '?year=2021')
+        rows = response.context['rows']
+        self.assertEqual(len(rows), 7)
+        cells = {cell['day']: cell['level'] for row in rows for cell in row
+                 if cell}
+        self.assertEqual(len(cells), 365)
+        self.assertEqual(cells[datetime.date(2021, 11, 18)], 4)
+        self.assertEqual(cells[datetime.date(2021, 11, 19)], 1)
+        self.assertEqual(cells[datetime.date(2021, 11, 20)], 0)
+        self.assertContains(response, 'Тренировок: 2, тоннаж: 2500')
+        response = self.client.get(reverse('main:calendar') + '?year=вчера')
+        self.assertEqual(response.status_code, 404)
+
+
+class AnalyticsTests(TestCase):
+    def setUp(self):
+        self.user = AdvUser.objects.create_user('sportsman', password='pass')
+        plan = [
+            (datetime.date(2021, 11, 1), 'Жим лёжа', [(60, 10), (70, 5)]),
+            (datetime.date(2021, 11, 1), 'Присед', [(80, 5)]),
+            (datetime.date(2021, 11, 5), 'жим лежа', [(75, 3)]),
+            (datetime.date(2021, 11, 12), 'Жим лёжа', [(65, 8), (0, 0)]),
+        ]
+        for day, name, sets in plan:
+            workout = make_workout(self.user, exercises=0, created_at=day)
+            exercise = Exercise.objects.create(workout=workout, name=name)
+            for number, (weight, repeats) in enumerate(sets, 1):
+                SetDescription.objects.create(exercise=exercise,
+                                              number=number,
+                                              weight=weight,
+                                              repeats=repeats)
+
+    def test_single_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            analytics.progress_report(self.user.pk)
+        self.assertEqual(len(queries), 1)
+
+    def test_report(self):
+        report = analytics.progress_report(self.user.pk, window=7)
+        self.assertEqual(report['days'],
+                         ['2021-11-01', '2021-11-05', '2021-11-12'])
+        self.assertEqual(report['volume'], [1350.0, 225.0, 520.0])
+        # 12.11 is more than a week after 05.11
+        self.assertEqual(report['rolling_volume'], [1350.0, 1575.0, 520.0])
+        bench, squat = report['exercises']
+        self.assertEqual(bench['days'], [0, 1, 2])
+        self.assertEqual(
+            bench['e1rm'],
+            [float(stats.estimated_1rm(70, 5)),
+             float(stats.estimated_1rm(75, 3)),
+             float(stats.estimated_1rm(65, 8))])
+        self.assertEqual(bench['best_e1rm'],
+                         [81.7, 82.5, 82.5])
+        self.assertEqual(squat['name'], 'Присед')
+        self.assertEqual(squat['days'], [0])
+
+    def test_empty_history(self):
+        AdvUser.objects.create_user('newcomer', password='pass')
+        report = analytics.progress_report(
+            AdvUser.objects.get(username='newcomer').pk)
+        self.assertEqual(report['days'], [])
+        self.assertEqual(report['exercises'], [])
+
+    def test_api_endpoint(self):
+        self.client.force_login(self.user)
+        data = self.client.get('/api/analytics/?window=30').json()
+        self.assertEqual(data['rolling_volume'], [1350.0, 1575.0, 2095.0])
+
+    def test_command_rejects_empty_window(self):
+        for window in ('0', '-7'):
+            with self.assertRaises(CommandError):
+                call_command('export_analytics', self.user.username,
+                             '--window', window, stdout=io.StringIO())
+
+
+IMPORT_CSV = """date,workout,comment,exercise,number,weight,repeats
+2021-11-01,Грудь,,Жим лёжа,1,60,10
+2021-11-01,Грудь,,Жим лёжа,2,70,5
+2021-11-01,Грудь,,Разводка,1,12.5,12
+2021-11-01,Грудь,,Разводка,2,150,12
+2021-11-03,Ноги,Тяжело,Присед,1,80,5
+2021-11-03,Ноги,Тяжело,Выпады,,,
+2021-13-01,Спина,,Тяга,1,50,10
+2021-11-05,,,,,,
+2021-11-06,Отдых,,,,,
+"""
+
+
+class ImportTests(TestCase):
+    def setUp(self):
+        self.user = AdvUser.objects.create_user('sportsman', password='pass')
+
+    def test_csv_import(self):
+        report = import_rows(self.user, io.StringIO(IMPORT_CSV), 'csv')
+        self.assertEqual((report.workouts, report.exercises, report.sets),
+                         (3, 4, 4))
+        self.assertEqual([e['line'] for e in report.errors], [5, 8, 9])
+        self.assertIn('weight', report.errors[0]['error'])
+        chest = Workout.objects.get(name='Грудь')
+        self.assertEqual(chest.owner, self.user)
+        self.assertEqual(
+            [(e.name, e.setdescription_set.count())
+             for e in chest.exercise_set.order_by('pk')],
+            [('Жим лёжа', 2), ('Разводка', 1)])
+        self.assertEqual(Workout.objects.get(name='Ноги').comment, 'Тяжело')
+
+    def test_derived_data_is_updated(self):
+        import_rows(self.user, io.StringIO(IMPORT_CSV), 'csv')
+        self.assertEqual(
+            set(search.filter_workouts(Workout.objects.all(), 'выпад')),
+            {Workout.objects.get(name='Ноги')})
+        self.assertEqual(
+            ExerciseStats.objects.get(exercise_key='жим лежа').best_weight,
+            70)
+
+    def test_ids_of_deleted_workouts_are_not_reused(self):
+        workouts = [make_workout(self.user, exercises=0) for _ in range(3)]
+        deleted = workouts[-1].pk
+        workouts[-1].delete()
+        import_rows(self.user, io.StringIO(IMPORT_CSV), 'csv')
+        created = batch.create_workouts(self.user, [{
+            'name': 'Спина',
+            'created_at': datetime.date(2021, 11, 20),
+            'exercises': [{'name': 'Тяга', 'sets': []}],
+        }])
+        ids = set(Workout.objects.values_list('pk', flat=True))
+        self.assertNotIn(deleted, ids)
+        self.assertEqual(len(ids), 2 + 3 + 1)
+        self.assertGreater(created[0].pk, max(ids - {created[0].pk}))
+        self.assertTrue(
+            Change.objects.get(kind=Change.WORKOUT, object_id=deleted).deleted)
+
+    def test_command_rejects_non_utf8_file(self):
+        with tempfile.NamedTemporaryFile(suffix='.csv') as file:
+            file.write(IMPORT_CSV.encode('cp1251'))
+            file.flush()
+            with self.assertRaisesMessage(CommandError, 'not UTF-8'):
+                call_command('import_workouts', 'sportsman', file.name,
+                             stdout=io.StringIO())
+        self.assertFalse(Workout.objects.exists())
+
+    def test_ndjson_import(self):
+        lines = [
+            '{"date": "2021-11-01", "workout": "Грудь", "exercise": "Жим",'
+            ' "number": 1, "weight": 60, "repeats": 10}',
+            '',
+            '[1, 2]',
+            '{"date": "2021-11-01", "workout": "Грудь", "exercise": "Жим",'
+            ' "number": 2, "weight": "62.5", "repeats": 8}',
+            '{broken',
+        ]
+        report = import_rows(self.user, lines, 'ndjson')
+        self.assertEqual((report.workouts, report.sets), (1, 2))
+        self.assertEqual([e['line'] for e in report.errors], [3, 5])
+
+    def test_statements_do_not_grow_with_rows(self):
+        def csv_for(workouts):
+            lines = ['date,workout,comment,exercise,number,weight,repeats']
+            for w in range(workouts):
+                for e in range(3):
+                    for number in range(1, 4):
+                        lines.append('2021-11-%02d,W%d,,E%d,%d,50,10' %
+                                     (w % 28 + 1, w, e, number))
+            return io.StringIO('\n'.join(lines))
+
+        def inserts(workouts):
+            # A new user each time, so both imports create their catalogue
+            user = AdvUser.objects.create_user('user%d' % workouts)
+            with CaptureQueriesContext(connection) as queries:
+                import_rows(user, csv_for(workouts), 'csv', chunk_size=1000)
+            return sum(q['sql'].startswith('INSERT') for q in queries)
+
+        # Below SQLite's per-statement parameter limit: one INSERT per
+        # table, the change log's for all 13 rows of each workout
+        self.assertEqual(inserts(2), inserts(15))
+        self.assertEqual(SetDescription.objects.count(), 17 * 9)
+
+    def test_chunks_keep_workouts_whole(self):
+        report = import_rows(self.user, io.StringIO(IMPORT_CSV), 'csv',
+                             chunk_size=1)
+        self.assertEqual((report.workouts, report.exercises, report.sets),
+                         (3, 4, 4))
+        self.assertEqual(Workout.objects.get(name='Грудь')
+                         .exercise_set.count(), 2)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.user = AdvUser.objects.create_user('sportsman', password='pass')
+        import_rows(self.user, io.StringIO(IMPORT_CSV), 'csv')
+        self.client.force_login(self.user)
+
+    def export(self, format):
+        response = self.client.get(reverse('main:export'),
+                                   {'format': format})
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def diary(self, user):
+        workouts = Workout.objects.filter(owner=user).order_by(
+            'created_at', 'pk', 'exercise__pk',
+            'exercise__setdescription__number')
+        return list(workouts.values_list(
+            'created_at', 'name', 'comment', 'exercise__name',
+            'exercise__setdescription__number',
+            'exercise__setdescription__weight',
+            'exercise__setdescription__repeats'))
+
+    def test_csv_round_trip(self):
+        data = self.export('csv')
+        self.assertTrue(data.startswith('date,workout,comment,exercise'))
+        copy = AdvUser.objects.create_user('copy', password='pass')
+        report = import_rows(copy, io.StringIO(data), 'csv')
+        self.assertEqual(report.error_count, 0)
+        self.assertEqual(self.diary(copy), self.diary(self.user))
+
+    def test_ndjson_round_trip(self):
+        data = self.export('ndjson')
+        self.assertIn('"weight": "60.0"', data)
+        copy = AdvUser.objects.create_user('copy', password='pass')
+        report = import_rows(copy, data.splitlines(), 'ndjson')
+        self.assertEqual(report.error_count, 0)
+        self.assertEqual(self.diary(copy), self.diary(self.user))
+
+    def test_only_own_diary(self):
+        stranger = AdvUser.objects.create_user('stranger', password='pass')
+        make_workout(stranger, name='Чужая')
+        self.assertNotIn('Чужая', self.export('csv'))
+
+    def test_unknown_format(self):
+        response = self.client.get(reverse('main:export'), {'format': 'xml'})
+        self.assertEqual(response.status_code, 404)
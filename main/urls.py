@@ -9,6 +9,13 @@ from .views import (
     UserLogoutView,
     all_workouts,
     profile,
+    stats,
+    calendar,
+    movements,
+    movement,
+    export,
+    cache_stats,
+    profiling,
     index,
     about,
     UserLoginView,
@@ -58,6 +65,13 @@ urlpatterns = [
          ChangeUserInfoView.as_view(),
          name='profile_change'),
     path('accounts/profile/', profile, name='profile'),
+    path('stats/', stats, name='stats'),
+    path('calendar/', calendar, name='calendar'),
+    path('movements/', movements, name='movements'),
+    path('movements/<int:pk>/', movement, name='movement'),
+    path('cache-stats/', cache_stats, name='cache_stats'),
+    path('profiling/', profiling, name='profiling'),
+    path('export/', export, name='export'),
     path('acoounts/logout/', UserLogoutView.as_view(), name='logout'),
     path('accounts/login/', UserLoginView.as_view(), name='login'),
     path('<str:page>/', about, name='about'),
@@ -1,5 +1,9 @@
+import sqlite3
+
 from django.template.loader import render_to_string
 from django.core.signing import Signer
+from django.db import (DEFAULT_DB_ALIAS, NotSupportedError, connections,
+                       transaction)
 
 from workout_diary.settings import ALLOWED_HOSTS
 
@@ -7,6 +11,10 @@ signer = Signer()
 
 
 def send_activation_notification(user):
+    """Puts the activation letter into the outbox, see main.mailer"""
+    # main.apps imports this module before the models are loaded
+    from .models import Letter
+
     if ALLOWED_HOSTS:
         host = 'http://' + ALLOWED_HOSTS[0]
     else:
@@ -15,4 +23,93 @@ def send_activation_notification(user):
     context = {'user': user, 'host': host, 'sign': signer.sign(user.username)}
     subject = render_to_string('email/activation_letter_subject.txt', context)
     body_text = render_to_string('email/activation_letter_body.txt', context)
-    user.email_user(subject, body_text)
+    return Letter.objects.create(user=user,
+                                 recipient=user.email,
+                                 subject=' '.join(subject.splitlines()),
+                                 body=body_text)
+
+
+def reserve_sqlite_pks(counts, using):
+    """Takes ids from the AUTOINCREMENT sequences of SQLite tables, `counts`
+    being {model: number of ids}, and returns {model: first id}.
+
+    The sequences are bumped before they are read, so the statement takes
+    the write lock first and no other writer gets the same ranges until
+    this transaction ends. Ids of deleted rows are never handed out again,
+    as with ordinary inserts. All tables take one UPDATE ... RETURNING
+    where SQLite has it (3.35).
+    """
+    connection = connections[using]
+    tables = {model._meta.db_table: model for model in counts}
+    cases = ' '.join(['WHEN %s THEN %s'] * len(tables))
+    params = [value for table, model in tables.items()
+              for value in (table, counts[model])]
+    names = ', '.join(['%s'] * len(tables))
+    update = ('UPDATE sqlite_sequence SET seq = seq + CASE name %s END '
+              'WHERE name IN (%s)' % (cases, names))
+    with connection.cursor() as cursor:
+        if sqlite3.sqlite_version_info >= (3, 35):
+            cursor.execute(update + ' RETURNING name, seq',
+                           params + list(tables))
+            last = dict(cursor.fetchall())
+        else:
+            cursor.execute(update, params + list(tables))
+            cursor.execute(
+                'SELECT name, seq FROM sqlite_sequence WHERE name IN (%s)' %
+                names, list(tables))
+            last = dict(cursor.fetchall())
+        for table in set(tables) - set(last):
+            # Nothing was ever inserted into the table
+            model = tables[table]
+            cursor.execute(
+                'INSERT INTO sqlite_sequence (name, seq) '
+                'SELECT %%s, COALESCE(MAX(%s), 0) + %%s FROM %s' %
+                (connection.ops.quote_name(model._meta.pk.column),
+                 connection.ops.quote_name(table)), [table, counts[model]])
+            cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s',
+                           [table])
+            last[table] = cursor.fetchone()[0]
+    return {model: last[table] - counts[model] + 1
+            for table, model in tables.items()}
+
+
+def reserve_pks(groups, using=DEFAULT_DB_ALIAS):
+    """Gives the objects of (model, objects) pairs that are about to be
+    bulk-inserted their ids up front, with one statement for all of them.
+
+    Only needed where bulk inserts can't return ids (SQLite on this Django
+    version), elsewhere bulk_create_with_pks() fills them in; call inside
+    the transaction of the inserts.
+    """
+    connection = connections[using]
+    if connection.features.can_return_rows_from_bulk_insert:
+        return
+    if connection.vendor != 'sqlite':
+        raise NotSupportedError(
+            'bulk_create_with_pks() needs ids from bulk inserts')
+    groups = [(model, [obj for obj in objects if obj.pk is None])
+              for model, objects in groups]
+    counts = {model: len(objects) for model, objects in groups if objects}
+    if not counts:
+        return
+    firsts = reserve_sqlite_pks(counts, using)
+    for model, objects in groups:
+        if objects:
+            for pk, obj in enumerate(objects, firsts[model]):
+                obj.pk = pk
+
+
+def bulk_create_with_pks(model, objects, using=DEFAULT_DB_ALIAS):
+    """bulk_create() that always fills in the primary keys.
+
+    Backends that can't return ids from a bulk insert (SQLite on this Django
+    version) get explicit ids reserved from the table's sequence, unless
+    reserve_pks() already gave them theirs, so children can reference the
+    new rows right away.
+    """
+    objects = list(objects)
+    if not objects:
+        return objects
+    with transaction.atomic(using=using, savepoint=False):
+        reserve_pks([(model, objects)], using)
+        return model.objects.using(using).bulk_create(objects)
@@ -1,17 +1,21 @@
+import datetime
+
 from django import template
 from django.db.models.query import QuerySet
 from django.forms.models import inlineformset_factory
 from django import forms
-from django.http.response import Http404, HttpResponse
+from django.http.response import (Http404, HttpResponse, JsonResponse,
+                                  StreamingHttpResponse)
 from django.shortcuts import redirect, render, get_object_or_404
 from django.template import TemplateDoesNotExist
 from django.template.loader import get_template
 from django.contrib import messages
 from django.contrib.auth import login, logout
 from django.contrib.auth.views import LoginView, LogoutView, PasswordChangeView
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import Q, fields
+from django.db.models import Count, Q, fields
 from django.db import transaction
 from django.urls.base import reverse
 from django.views.generic.edit import DeleteView, UpdateView, CreateView, DeleteView, FormView
@@ -20,20 +24,29 @@ from django.views.generic.list import ListView
 from django.contrib.messages.views import SuccessMessageMixin
 from django.urls import reverse_lazy
 from django.core.signing import BadSignature
-from django.core.paginator import Paginator
 from extra_views import CreateWithInlinesView, UpdateWithInlinesView, ModelFormSetView, FormSetView
-from extra_views.advanced import InlineFormSetFactory
 from extra_views.formsets import InlineFormSetView
-from .models import AdvUser, Exercise, SetDescription, Workout
-from .forms import SearchForm, ChangeUserInfoForm, RegisterUserForm, SetDescriptionForm, SetDescriptionFormInline, WorkoutForm, ExerciseInline, SetDescriptionFormSet
+from .models import (AdvUser, Exercise, ExerciseStats, Movement,
+                     SetDescription, WeeklyTonnage, Workout)
+from .pagination import KeysetPaginator, cursor_url
+from .forms import SearchForm, ChangeUserInfoForm, RegisterUserForm, SetDescriptionForm, WorkoutForm, ExerciseFormSet, SetDescriptionFormSet
 from .utilities import signer
+from .search import filter_workouts
+from .exporters import FORMATS as EXPORT_FORMATS
+from .caching import cache_stats as get_cache_stats, cache_user_page
+from .profiling import profiler
+from . import activity, batch, deletion, movements as catalogue
 from django.forms.formsets import BaseFormSet
 
 
+@cache_user_page(lists=True)
 def index(request):
     """Main page"""
-    workouts = Workout.objects.filter(
-        sportsman_name=request.user).order_by('-created_at')
+    if request.user.is_authenticated:
+        workouts = Workout.objects.filter(
+            owner=request.user).order_by('-created_at', '-id')
+    else:
+        workouts = Workout.objects.none()
     return render(request, 'main/index.html', {'workouts': workouts})
 
 
@@ -53,8 +66,6 @@ class UserLoginView(LoginView):
 
 @login_required
 def profile(request):
-    workouts = Workout.objects.filter(sportsman_name=request.user.pk)
-    context = {'workouts': workouts}
     return render(request, 'main/profile.html')
 
 
@@ -124,8 +135,13 @@ class DeleteUserView(LoginRequiredMixin, DeleteView):
         return super().setup(request, *args, **kwargs)
 
     def post(self, request, *args, **kwargs):
+        user = self.get_object()
         logout(request)
         messages.add_message(request, messages.SUCCESS, "Пользователь удален")
+        if deletion.should_defer(user):
+            # Large accounts are removed later by purge_deleted_users
+            deletion.request_deletion(user)
+            return redirect(self.success_url)
         return super().post(request, *args, **kwargs)
 
     def get_object(self, queryset=None):
@@ -134,40 +150,124 @@ class DeleteUserView(LoginRequiredMixin, DeleteView):
         return get_object_or_404(queryset, pk=self.user_id)
 
 
+@login_required
+@cache_user_page(lists=True)
 def all_workouts(request):
-    workouts = Workout.objects.filter(
-        sportsman_name=request.user).order_by('-created_at')
+    workouts = Workout.objects.filter(owner=request.user)
     if 'keyword' in request.GET:
         keyword = request.GET['keyword']
-        q = Q(name__icontains=keyword) | Q(comment__icontains=keyword)
-        workouts = workouts.filter(q)
+        workouts = filter_workouts(workouts, keyword)
     else:
         keyword = ''
     form = SearchForm(initial={'keyword': keyword})
-    paginator = Paginator(workouts, 2)
-    if 'page' in request.GET:
-        page_num = request.GET['page']
-    else:
-        page_num = 1
-    page = paginator.get_page(page_num)
-    context = {'workouts': workouts, 'page': page, 'form': form}
+    paginator = KeysetPaginator(workouts, 2)
+    page = paginator.get_page(request.GET.get('cursor'))
+    context = {'page': page, 'form': form}
+    if page.has_next():
+        context['next_url'] = cursor_url(request, page.next_cursor)
+    if page.has_previous():
+        context['previous_url'] = cursor_url(request, page.previous_cursor)
     return render(request, 'main/workouts.html', context)
 
 
 @login_required
+def stats(request):
+    """Training statistics, read straight from the precomputed aggregates"""
+    exercises = ExerciseStats.objects.filter(user=request.user)
+    weeks = WeeklyTonnage.objects.filter(user=request.user,
+                                         set_count__gt=0)[:12]
+    context = {'exercises': exercises, 'weeks': weeks}
+    return render(request, 'main/stats.html', context)
+
+
+@login_required
+@cache_user_page(lists=True)
+def calendar(request):
+    """A year of training, one cell per day, read from the daily rollup"""
+    try:
+        year = int(request.GET.get('year') or datetime.date.today().year)
+        start, end = datetime.date(year, 1, 1), datetime.date(year, 12, 31)
+    except ValueError:
+        raise Http404
+    days = list(activity.window(request.user.pk, start, end))
+    context = {
+        'year': year,
+        'rows': activity.calendar_rows(start, end, days),
+        'sessions': sum(day.sessions for day in days),
+        'volume': sum(day.volume for day in days),
+    }
+    return render(request, 'main/calendar.html', context)
+
+
+@login_required
+def movements(request):
+    """The user's exercise catalogue"""
+    movements = Movement.objects.filter(owner=request.user).annotate(
+        sessions=Count('exercise'))
+    return render(request, 'main/movements.html', {'movements': movements})
+
+
+@login_required
+def movement(request, pk):
+    """Every set of one movement, newest first"""
+    movement = get_object_or_404(Movement, pk=pk, owner=request.user)
+    paginator = KeysetPaginator(catalogue.history(movement), 20,
+                                catalogue.HISTORY_ORDERING)
+    page = paginator.get_page(request.GET.get('cursor'))
+    context = {'movement': movement, 'page': page}
+    if page.has_next():
+        context['next_url'] = cursor_url(request, page.next_cursor)
+    if page.has_previous():
+        context['previous_url'] = cursor_url(request, page.previous_cursor)
+    return render(request, 'main/movement_detail.html', context)
+
+
+@staff_member_required
+def cache_stats(request):
+    """Hit/miss counters of the page cache of this process"""
+    return JsonResponse(get_cache_stats())
+
+
+@staff_member_required
+def profiling(request):
+    """Rolling per-view timings of this process; POST clears them"""
+    if request.method == 'POST':
+        profiler.reset()
+    return JsonResponse(profiler.report())
+
+
+@login_required
+def export(request):
+    """The whole diary as CSV or NDJSON, streamed as it is read"""
+    format = request.GET.get('format', 'csv')
+    if format not in EXPORT_FORMATS:
+        raise Http404
+    lines, content_type = EXPORT_FORMATS[format]
+    response = StreamingHttpResponse(lines(request.user),
+                                     content_type=content_type)
+    response['Content-Disposition'] = (
+        'attachment; filename="workouts.%s"' % format)
+    return response
+
+
+@login_required
+@cache_user_page(workout_kwarg='pk')
 def workout(request, pk):
-    workout = get_object_or_404(Workout, pk=pk)
-    exercises = Exercise.objects.filter(workout=workout)
-    sets = SetDescription.objects.filter(exercise__in=exercises)
-    context = {'workout': workout, 'exercises': exercises, 'sets': sets}
+    # Three queries for the whole tree regardless of its size: the workout,
+    # its exercises and all of their sets, already ordered for the template.
+    workout = get_object_or_404(Workout.objects.with_tree(),
+                                pk=pk,
+                                owner=request.user)
+    exercises = workout.exercise_set.all()
+    context = {'workout': workout, 'exercises': exercises}
     return render(request, 'main/workout_detail.html', context)
 
 
 @login_required
 def workout_delete(request, workout_pk):
-    workout = get_object_or_404(Workout, pk=workout_pk)
+    workout = get_object_or_404(Workout, pk=workout_pk, owner=request.user)
     if request.method == "POST":
-        workout.delete()
+        deletion.delete_workouts(Workout.objects.filter(pk=workout.pk))
         messages.add_message(request, messages.SUCCESS, 'Тренировка удалена')
         return redirect('main:workouts')
     else:
@@ -175,11 +275,11 @@ def workout_delete(request, workout_pk):
         return render(request, 'main/workout_delete.html', context)
 
 
-class CreateWorkoutView(CreateWithInlinesView, SuccessMessageMixin,
-                        LoginRequiredMixin):
+class CreateWorkoutView(LoginRequiredMixin, SuccessMessageMixin, CreateView):
+    """A workout with its exercises and their sets from one page, written by
+    batch.create_workouts with one insert per table"""
     model = Workout
     form_class = WorkoutForm
-    inlines = [ExerciseInline]
     success_message = "Тренировка  была успешно добавлена"
     template_name = 'main/workout_add.html'
 
@@ -190,15 +290,47 @@ class CreateWorkoutView(CreateWithInlinesView, SuccessMessageMixin,
         kwargs = super(CreateWorkoutView, self).get_form_kwargs()
         if kwargs['instance'] is None:
             kwargs['instance'] = Workout()
-        kwargs['instance'].sportsman_name = self.request.user
+        kwargs['instance'].owner = self.request.user
         return kwargs
 
+    def get_exercises(self):
+        if not hasattr(self, '_exercises'):
+            self._exercises = ExerciseFormSet(self.request.POST or None,
+                                              instance=Workout())
+        return self._exercises
+
+    def get_context_data(self, **kwargs):
+        kwargs.setdefault('exercises', self.get_exercises())
+        return super().get_context_data(**kwargs)
+
+    def post(self, request, *args, **kwargs):
+        self.object = None
+        form = self.get_form()
+        # Both are validated, so that all errors are shown at once
+        valid = form.is_valid()
+        if self.get_exercises().is_valid() and valid:
+            return self.form_valid(form)
+        return self.form_invalid(form)
+
+    def form_valid(self, form):
+        tree = dict(form.cleaned_data, exercises=self.get_exercises().trees())
+        self.object = batch.create_workouts(self.request.user, [tree])[0]
+        messages.success(self.request,
+                         self.get_success_message(form.cleaned_data))
+        return redirect(self.get_success_url())
+
 
-class CreateSetDescription(CreateView, LoginRequiredMixin):
+class CreateSetDescription(LoginRequiredMixin, CreateView):
     model = Exercise
     fields = ('__all__')
     success_url = reverse_lazy('main:workouts')
 
+    def get_form(self, form_class=None):
+        form = super().get_form(form_class)
+        form.fields['workout'].queryset = Workout.objects.filter(
+            owner=self.request.user)
+        return form
+
     def get_context_data(self, **kwargs):
         data = super(CreateSetDescription, self).get_context_data(**kwargs)
         if self.request.POST:
@@ -210,12 +342,15 @@ class CreateSetDescription(CreateView, LoginRequiredMixin):
     def form_valid(self, form):
         context = self.get_context_data()
         setdescriptions = context['setdescriptions']
+        if not setdescriptions.is_valid():
+            return self.form_invalid(form)
         with transaction.atomic():
-            self.object = form.save()
-            if setdescriptions.is_valid():
-                setdescriptions.instance = self.object
-                setdescriptions.save()
-        return super(CreateSetDescription, self).form_valid(form)
+            # The exercise and all its sets with one insert each and the
+            # derived data updated once, see batch.save_sets()
+            self.object = form.save(commit=False)
+            setdescriptions.instance = self.object
+            setdescriptions.save()
+        return redirect(self.get_success_url())
 
     def get_initial(self):
         return {
@@ -223,22 +358,21 @@ class CreateSetDescription(CreateView, LoginRequiredMixin):
         }
 
 
-class SetDescriptionUpdate(UpdateView, LoginRequiredMixin):
+class SetDescriptionUpdate(LoginRequiredMixin, UpdateView):
     model = SetDescription
     form_class = SetDescriptionFormSet
 
     def get(self, request, **kwargs):
-        self.object = Exercise.objects.get(id=self.kwargs.get('exercise_id'))
+        self.object = self.get_object()
         form_class = self.get_form_class()
         form = self.get_form(form_class)
         context = self.get_context_data(object=self.object, form=form)
         return self.render_to_response(context)
 
     def get_object(self, queryset=None):
-        if not queryset:
-            queryset = self.get_queryset()
-        obj = Exercise.objects.get(id=self.kwargs.get('exercise_id'))
-        return obj
+        return get_object_or_404(Exercise,
+                                 id=self.kwargs.get('exercise_id'),
+                                 workout__owner=self.request.user)
 
     def get_success_url(self):
         return reverse_lazy('main:workouts')
@@ -248,9 +382,10 @@ class SetDescriptionUpdate(UpdateView, LoginRequiredMixin):
 def exercise_delete(request, workout_pk, exercise_id):
     exercise = get_object_or_404(Exercise,
                                  workout_id=workout_pk,
+                                 workout__owner=request.user,
                                  id=exercise_id)
     if request.method == "POST":
-        exercise.delete()
+        deletion.delete_exercise(exercise)
         messages.add_message(request, messages.SUCCESS, 'Упражнение удалено')
         return redirect('main:workouts')
     else:
@@ -12,5 +12,8 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'workout_diary.settings')
+# Under ASGI the read-only API endpoints don't tie up a thread while they
+# wait for the database
+os.environ.setdefault('API_ASYNC_READS', '1')
 
 application = get_asgi_application()
@@ -13,6 +13,8 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 from pathlib import Path
 import os
 
+from .databases import parse_database_url
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -46,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'main.middlewares.ProfilingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -53,6 +56,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'main.middlewares.ReplicaRoutingMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -80,13 +84,108 @@ WSGI_APPLICATION = 'workout_diary.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# DATABASE_URL picks the primary database, see workout_diary/databases.py
+# for the URL format. Connections are kept open for DATABASE_CONN_MAX_AGE
+# seconds (0 closes them after every request). With PostgreSQL this is the
+# connection pool of each worker; for more workers than the server has
+# connections, put PgBouncer in transaction mode in front of it and add
+# ?pgbouncer=1 to the URL.
+#
+# DATABASE_REPLICA_URL adds a read replica: GET requests to the views in
+# REPLICA_READ_VIEWS read the diary tables from it, except for clients that
+# wrote something in the last REPLICA_STICKY_SECONDS (main.routers).
+# Without it the 'replica' alias is the primary database and is not used.
+DATABASE_CONN_MAX_AGE = int(os.environ.get('DATABASE_CONN_MAX_AGE', 60))
+
 DATABASES = {
+    'default': parse_database_url(
+        os.environ.get('DATABASE_URL',
+                       'sqlite:///%s' % (BASE_DIR / 'workouts.data')),
+        DATABASE_CONN_MAX_AGE),
+}
+
+USE_REPLICA = bool(os.environ.get('DATABASE_REPLICA_URL'))
+
+if USE_REPLICA:
+    DATABASES['replica'] = parse_database_url(
+        os.environ['DATABASE_REPLICA_URL'], DATABASE_CONN_MAX_AGE)
+else:
+    DATABASES['replica'] = dict(DATABASES['default'])
+DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['main.routers.PrimaryReplicaRouter']
+
+REPLICA_READ_VIEWS = [
+    'main:index',
+    'main:workouts',
+    'main:workout',
+    'main:movements',
+    'main:movement',
+    'main:calendar',
+    'api:workouts',
+    'api:workout',
+    'api:exercises',
+    'api:sets',
+    'api:search',
+    'api:stats',
+    'api:analytics',
+    'api:movements',
+    'api:movement_history',
+    'api:calendar',
+]
+
+REPLICA_STICKY_SECONDS = 10
+
+# Serve the read-only workout endpoints with the async views of
+# api.async_views; set by workout_diary/asgi.py for ASGI servers
+API_ASYNC_READS = os.environ.get('API_ASYNC_READS', '') in ('1', 'true')
+
+# Applied to every new SQLite connection by main.database. journal_mode=wal
+# is stored in the database file; busy_timeout is in milliseconds, mmap_size
+# in bytes and a negative cache_size in KiB. An empty dict keeps SQLite's
+# defaults.
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'wal'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'normal'),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 128 * 1024 * 1024)),
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -32000)),
+    'temp_store': 'memory',
+}
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+# The 'workouts' cache holds rendered pages and per-user data (main.caching).
+# Any backend works, e.g. FileBasedCache with a directory or DatabaseCache
+# with a table as LOCATION; locmem evicts the least recently used entries
+# once MAX_ENTRIES is reached.
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'workouts.data',
-    }
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'workouts': {
+        'BACKEND': os.environ.get(
+            'WORKOUT_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('WORKOUT_CACHE_LOCATION', 'workouts'),
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('WORKOUT_CACHE_MAX_ENTRIES',
+                                              5000)),
+        },
+    },
 }
 
+WORKOUT_CACHE_ALIAS = 'workouts'
+
+# Share of requests timed by main.middlewares.ProfilingMiddleware (0 turns
+# it off) and the number of samples kept per URL name; the report is at
+# /profiling/ for staff
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0.05))
+
+PROFILING_WINDOW = 1000
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 